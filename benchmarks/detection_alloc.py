@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Allocations per frame: detection dicts vs DetectionBatch
+
+Builds each frame's detections the way the pad probe used to (a dict and a
+bbox dict per detection, the accessor probed with hasattr every time) and
+the way it does now (one structured array per frame), from the fake hailo
+module's detections. Reports memory blocks and bytes still held per frame
+while frames wait in the worker queue, and the time to build and to turn a
+frame into its saved JSON form.
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(BENCH_DIR, "fakes"), os.path.dirname(BENCH_DIR)]
+
+import hailo
+from detection_batch import DetectionBatch, LabelTable, resolve_bbox_reader
+
+
+def build_dicts(detections):
+    """The probe's former per-detection dicts"""
+    result = []
+    for detection in detections:
+        detection_info = {
+            "label": detection.get_label(),
+            "confidence": detection.get_confidence(),
+        }
+        try:
+            bbox = {}
+            if hasattr(detection, "get_bbox_xmin"):
+                bbox = {
+                    "xmin": detection.get_bbox_xmin(),
+                    "ymin": detection.get_bbox_ymin(),
+                    "xmax": detection.get_bbox_xmax(),
+                    "ymax": detection.get_bbox_ymax(),
+                }
+            elif hasattr(detection, "get_bbox"):
+                bbox_obj = detection.get_bbox()
+                if bbox_obj:
+                    bbox = {
+                        "xmin": bbox_obj.xmin(),
+                        "ymin": bbox_obj.ymin(),
+                        "xmax": bbox_obj.xmax(),
+                        "ymax": bbox_obj.ymax(),
+                    }
+            detection_info["bbox"] = bbox
+        except Exception:
+            pass
+        result.append(detection_info)
+    return result
+
+
+def make_frames(count, per_frame):
+    frames = []
+    for index in range(count):
+        roi = hailo.get_roi_from_buffer(type("Buffer", (), {"pts": index}))
+        detections = roi.get_objects_typed(hailo.HAILO_DETECTION)
+        if per_frame:
+            detections = (detections * per_frame)[:per_frame]
+        frames.append(detections)
+    return frames
+
+
+def held_per_frame(build, frames):
+    """Blocks and bytes still allocated per frame while all are kept"""
+    tracemalloc.start()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before = tracemalloc.take_snapshot().filter_traces(ignore)
+    kept = [build(detections) for detections in frames]
+    after = tracemalloc.take_snapshot().filter_traces(ignore)
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del kept
+    return blocks / len(frames), size / len(frames)
+
+
+def time_per_frame(func, items, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = (time.perf_counter() - start) / len(items)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=2000, help="Frames to build")
+    parser.add_argument(
+        "--per-frame",
+        type=int,
+        default=0,
+        help="Detections per frame (default: 1-4 as the fake hailo gives)",
+    )
+    parser.add_argument("--repeats", type=int, default=5, help="Timing repeats")
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames, args.per_frame)
+    detections = sum(len(f) for f in frames)
+    print(f"{args.frames} frames, {detections / args.frames:.2f} detections/frame")
+
+    labels = LabelTable()
+    read_bbox = resolve_bbox_reader(hailo.HailoDetection)
+    build_batch = lambda d: DetectionBatch.from_detections(d, labels, read_bbox)
+    build_batch(frames[0])  # Fill the label table first
+
+    paths = {
+        "dicts": (build_dicts, list),
+        "batch": (build_batch, DetectionBatch.to_dicts),
+    }
+    print(
+        f"{'':<6} {'blocks/frame':>12} {'bytes/frame':>12} "
+        f"{'build us':>9} {'to json us':>10}"
+    )
+    for name, (build, to_json) in paths.items():
+        blocks, size = held_per_frame(build, frames)
+        built = [build(d) for d in frames]
+        build_us = time_per_frame(build, frames, args.repeats) * 1e6
+        json_us = time_per_frame(to_json, built, args.repeats) * 1e6
+        print(f"{name:<6} {blocks:12.1f} {size:12.0f} {build_us:9.2f} {json_us:10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
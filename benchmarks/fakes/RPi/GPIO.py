@@ -0,0 +1,63 @@
+"""Stand-in for RPi.GPIO; benchmarks drive pins with set_input() and trigger()"""
+import threading
+
+BCM = "BCM"
+IN = "in"
+OUT = "out"
+PUD_UP = "pud_up"
+PUD_DOWN = "pud_down"
+RISING = "rising"
+FALLING = "falling"
+BOTH = "both"
+HIGH = 1
+LOW = 0
+
+_inputs = {}
+_outputs = {}
+_callbacks = {}
+
+
+def setmode(mode):
+    pass
+
+
+def setup(pin, direction, pull_up_down=None):
+    if direction == IN:
+        _inputs.setdefault(pin, HIGH if pull_up_down == PUD_UP else LOW)
+    else:
+        _outputs[pin] = LOW
+
+
+def input(pin):
+    return _inputs.get(pin, LOW)
+
+
+def output(pin, value):
+    _outputs[pin] = value
+
+
+def add_event_detect(pin, edge, callback=None, bouncetime=None):
+    _callbacks[pin] = callback
+
+
+def remove_event_detect(pin):
+    _callbacks.pop(pin, None)
+
+
+def cleanup():
+    _inputs.clear()
+    _outputs.clear()
+    _callbacks.clear()
+
+
+def set_input(pin, value):
+    """Set the level input() reports for a pin"""
+    _inputs[pin] = value
+
+
+def trigger(pin, value):
+    """Set a pin and fire its edge callback on another thread, like RPi.GPIO"""
+    _inputs[pin] = value
+    callback = _callbacks.get(pin)
+    if callback:
+        threading.Thread(target=callback, args=(pin,), daemon=True).start()
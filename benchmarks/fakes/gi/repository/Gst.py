@@ -0,0 +1,43 @@
+"""The parts of GStreamer that detection_app.py touches"""
+
+SECOND = 1_000_000_000
+
+
+class PadProbeReturn:
+    DROP = 0
+    OK = 1
+    REMOVE = 2
+
+
+class FlowReturn:
+    OK = 0
+    FLUSHING = -2
+
+
+class Format:
+    TIME = 3
+
+
+class Caps:
+    @staticmethod
+    def from_string(text):
+        return text
+
+
+class Buffer:
+    def __init__(self, data=b""):
+        self.data = data
+        self.pts = 0
+        self.duration = 0
+
+    @classmethod
+    def new_wrapped(cls, data):
+        return cls(data)
+
+
+def init(argv):
+    pass
+
+
+def util_uint64_scale_int(value, num, denom):
+    return value * num // denom
@@ -0,0 +1,66 @@
+"""Stand-in for the hailo module: a few detections for every buffer"""
+import random
+
+HAILO_DETECTION = "detection"
+
+LABELS = ["person", "person", "hat", "glasses", "balloon", "crown"]
+
+
+class HailoBBox:
+    def __init__(self, xmin, ymin, width, height):
+        self._xmin, self._ymin = xmin, ymin
+        self._width, self._height = width, height
+
+    def xmin(self):
+        return self._xmin
+
+    def ymin(self):
+        return self._ymin
+
+    def xmax(self):
+        return self._xmin + self._width
+
+    def ymax(self):
+        return self._ymin + self._height
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+
+class HailoDetection:
+    def __init__(self, label, confidence, bbox):
+        self.label = label
+        self.confidence = confidence
+        self.bbox = bbox
+
+    def get_label(self):
+        return self.label
+
+    def get_confidence(self):
+        return self.confidence
+
+    def get_bbox(self):
+        return self.bbox
+
+
+class HailoROI:
+    def __init__(self, detections):
+        self.detections = detections
+
+    def get_objects_typed(self, object_type):
+        return list(self.detections) if object_type == HAILO_DETECTION else []
+
+
+def get_roi_from_buffer(buffer):
+    """Same detections for the same buffer timestamp"""
+    rng = random.Random(getattr(buffer, "pts", 0))
+    detections = []
+    for _ in range(rng.randint(1, 4)):
+        x, y = rng.uniform(0, 0.7), rng.uniform(0, 0.7)
+        bbox = HailoBBox(x, y, rng.uniform(0.1, 0.3), rng.uniform(0.1, 0.3))
+        label, confidence = rng.choice(LABELS), rng.uniform(0.4, 1.0)
+        detections.append(HailoDetection(label, confidence, bbox))
+    return HailoROI(detections)
@@ -0,0 +1,38 @@
+"""Stand-in for GStreamerDetectionApp: runs the callback on each frame"""
+import threading
+
+from gi.repository import Gst
+from hailo_apps_infra import gstreamer_app
+
+
+class ProbeInfo:
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def get_buffer(self):
+        return self.buffer
+
+
+class GStreamerDetectionApp:
+    def __init__(self, app_callback, user_data, video_width=1280, video_height=720):
+        self.app_callback = app_callback
+        self.user_data = user_data
+        self.video_width = video_width
+        self.video_height = video_height
+        self.pipeline = gstreamer_app.Pipeline()
+
+    def run(self):
+        # Looked up at run time, as detection_app.py may have replaced it
+        source = threading.Thread(
+            target=gstreamer_app.picamera_thread,
+            args=(self.pipeline, self.video_width, self.video_height, "RGB"),
+            daemon=True,
+        )
+        source.start()
+
+        appsrc = self.pipeline.get_by_name("app_source")
+        while True:
+            buffer = appsrc.buffers.get()
+            result = self.app_callback(None, ProbeInfo(buffer), self.user_data)
+            if result == Gst.PadProbeReturn.REMOVE:
+                break
@@ -0,0 +1,49 @@
+"""Stand-in for hailo_apps_infra.gstreamer_app: an appsrc fed by a thread"""
+import queue
+import time
+
+from gi.repository import Gst
+
+
+class AppSrc:
+    def __init__(self):
+        self.buffers = queue.Queue(maxsize=3)
+        self.properties = {}
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def emit(self, signal, buffer):
+        # Like a leaky downstream queue: drop the oldest when full
+        if self.buffers.full():
+            try:
+                self.buffers.get_nowait()
+            except queue.Empty:
+                pass
+        self.buffers.put(buffer)
+        return Gst.FlowReturn.OK
+
+
+class Pipeline:
+    def __init__(self):
+        self.app_source = AppSrc()
+
+    def get_by_name(self, name):
+        return self.app_source if name == "app_source" else None
+
+
+def picamera_thread(
+    pipeline, video_width, video_height, video_format, picamera_config=None
+):
+    """Push empty frames at 30 fps, standing in for Picamera2"""
+    appsrc = pipeline.get_by_name("app_source")
+    duration = Gst.util_uint64_scale_int(1, Gst.SECOND, 30)
+    count = 0
+    while True:
+        buffer = Gst.Buffer.new_wrapped(bytes(video_width * video_height * 3))
+        buffer.pts = count * duration
+        buffer.duration = duration
+        if appsrc.emit("push-buffer", buffer) != Gst.FlowReturn.OK:
+            break
+        count += 1
+        time.sleep(1 / 30)
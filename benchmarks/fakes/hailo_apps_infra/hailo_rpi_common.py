@@ -0,0 +1,14 @@
+"""Stand-in for hailo_apps_infra.hailo_rpi_common"""
+
+
+class app_callback_class:
+    def __init__(self):
+        self.frame_count = 0
+        self.use_frame = False
+        self.running = True
+
+    def increment(self):
+        self.frame_count += 1
+
+    def get_count(self):
+        return self.frame_count
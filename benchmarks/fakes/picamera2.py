@@ -0,0 +1,58 @@
+"""Stand-in for Picamera2 producing paced frames without a sensor"""
+import time
+
+import cv2
+import numpy as np
+
+FRAME_INTERVAL = 1 / 30
+
+
+class Picamera2:
+    def __init__(self, camera_num=0):
+        self.config = None
+        self.next_frame = 0
+        self.count = 0
+
+    def create_still_configuration(self, main=None, lores=None, display=None, **kwargs):
+        return {"main": dict(main or {"size": (2304, 1296)}), "lores": lores}
+
+    def create_preview_configuration(self, main=None, lores=None, **kwargs):
+        return {"main": dict(main or {"size": (640, 480)}), "lores": lores}
+
+    def configure(self, config):
+        self.config = config
+
+    def start(self):
+        self.next_frame = time.monotonic()
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+    def wait_frame(self):
+        # Frames arrive on the sensor's schedule, not on demand
+        now = time.monotonic()
+        if self.next_frame > now:
+            time.sleep(self.next_frame - now)
+        self.next_frame = max(now, self.next_frame) + FRAME_INTERVAL
+        self.count += 1
+
+    def capture_array(self, name="main"):
+        self.wait_frame()
+        width, height = self.config[name]["size"]
+        if name == "lores":
+            # lores defaults to YUV420: a full Y plane then quarter U and V
+            frame = np.full((height * 3 // 2, width), 128, dtype=np.uint8)
+            frame[:height] = (self.count * 4) % 256
+            return frame
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        frame[:, :, 1] = (self.count * 4) % 256
+        return frame
+
+    def capture_file(self, path, name="main"):
+        frame = self.capture_array(name)
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_YUV420p2BGR)
+        cv2.imwrite(path, frame)
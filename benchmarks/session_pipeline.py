@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Drive PhotoboothSystem through complete sessions on fake hardware
+
+Runs main.py's orchestrator in-process with the stand-ins from
+benchmarks/fakes (GPIO, Picamera2, Hailo, GStreamer) and a headless SDL
+display. Each session goes motion -> user input -> detection -> button ->
+countdown -> review -> idle, driven through the same GPIO callbacks the
+real sensors use. Reports per-stage latencies, sessions per minute, CPU
+time and peak RSS.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FAKES_DIR = os.path.join(BENCH_DIR, "fakes")
+
+
+def prepare_environment():
+    """Headless display, fake hardware modules, and a scratch working dir"""
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    os.environ.setdefault("PHOTOBOOTH_CAMERA", "picamera")
+
+    # Stage processes find the fakes through PYTHONPATH
+    paths = [FAKES_DIR, REPO_DIR, os.environ.get("PYTHONPATH", "")]
+    os.environ["PYTHONPATH"] = os.pathsep.join(p for p in paths if p)
+    sys.path[:0] = [FAKES_DIR, REPO_DIR]
+
+    # main.py uses paths relative to its working directory
+    workdir = tempfile.mkdtemp(prefix="photobooth_bench_")
+    for name in os.listdir(REPO_DIR):
+        if name.endswith(".py"):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(workdir, name))
+    shutil.copy(os.path.join(FAKES_DIR, "user_input_app.py"), workdir)
+    os.chdir(workdir)
+    return workdir
+
+
+def wait_until(predicate, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for {what}")
+        time.sleep(0.005)
+
+
+def scene_shown(booth, scene_class):
+    scene = booth.scene_host.scene
+    return isinstance(scene, scene_class) and scene.shown
+
+
+def run_session(booth, args):
+    """One visitor, start to finish; returns the wall time in seconds"""
+    import main
+    from RPi import GPIO
+
+    start = time.monotonic()
+
+    # Motion held high past handle_motion's recheck
+    GPIO.trigger(main.PIR_PIN, GPIO.HIGH)
+    in_detection = lambda: booth.current_state == main.DETECTION
+    wait_until(in_detection, args.timeout, "detection")
+    GPIO.set_input(main.PIR_PIN, GPIO.LOW)
+
+    # Let detection run for a while before the visitor presses the button
+    time.sleep(args.detect_seconds)
+    GPIO.trigger(main.BUTTON_PIN, GPIO.LOW)
+    wait_until(lambda: scene_shown(booth, main.ReviewScene), args.timeout, "review")
+    GPIO.set_input(main.BUTTON_PIN, GPIO.HIGH)
+
+    # Same event the review screen's Continue button posts
+    booth.post_event("review_result", result="continue")
+    wait_until(lambda: scene_shown(booth, main.IdleScene), args.timeout, "idle")
+    return time.monotonic() - start
+
+
+def cpu_and_memory():
+    usage = {}
+    for who, flag in (
+        ("self", resource.RUSAGE_SELF),
+        ("children", resource.RUSAGE_CHILDREN),
+    ):
+        ru = resource.getrusage(flag)
+        usage[who] = {
+            "cpu_seconds": ru.ru_utime + ru.ru_stime,
+            # ru_maxrss is in KiB on Linux; for children it is the largest one
+            "peak_rss_mib": ru.ru_maxrss / 1024,
+        }
+    return usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=5, help="Sessions to run")
+    parser.add_argument(
+        "--countdown", type=int, default=1, help="Countdown seconds (booth uses 5)"
+    )
+    parser.add_argument(
+        "--detect-seconds", type=float, default=1.0, help="Detection time per visit"
+    )
+    parser.add_argument("--timeout", type=float, default=30, help="Per-step timeout")
+    parser.add_argument("--json", type=str, help="Also write the results here")
+    parser.add_argument("--keep", action="store_true", help="Keep the working dir")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = prepare_environment()
+    import main as photobooth_main
+    import metrics
+
+    photobooth_main.COUNTDOWN = args.countdown
+
+    durations = []
+    booth = photobooth_main.PhotoboothSystem()
+    try:
+        wait_until(lambda: scene_shown(booth, photobooth_main.IdleScene), 30, "idle")
+        bench_start = time.monotonic()
+        for index in range(args.sessions):
+            durations.append(run_session(booth, args))
+            print(f"Session {index + 1}/{args.sessions}: {durations[-1]:.2f}s")
+        bench_seconds = time.monotonic() - bench_start
+    finally:
+        booth.cleanup()
+
+    # Children's usage is only counted once they have been reaped
+    usage = cpu_and_memory()
+    report = metrics.REGISTRY.report()
+    results = {
+        "sessions": len(durations),
+        "countdown": args.countdown,
+        "detect_seconds": args.detect_seconds,
+        "session_seconds": {
+            "mean": statistics.mean(durations),
+            "min": min(durations),
+            "max": max(durations),
+        },
+        "sessions_per_minute": len(durations) / bench_seconds * 60,
+        "usage": usage,
+        "latency": report["latency"],
+    }
+
+    print()
+    print(metrics.REGISTRY.format_report())
+    print()
+    print(
+        f"sessions={len(durations)}  "
+        f"mean={results['session_seconds']['mean']:.2f}s  "
+        f"sessions/min={results['sessions_per_minute']:.2f}"
+    )
+    for who, values in usage.items():
+        print(
+            f"{who:<9} cpu={values['cpu_seconds']:7.2f}s  "
+            f"peak_rss={values['peak_rss_mib']:7.1f} MiB"
+        )
+
+    if args.json:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.keep:
+        print(f"Working directory kept at {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zygote import PRELOAD_MODULES, ZygoteClient
+
+# Minimal stage: import what a real stage imports, then report readiness.
+# Modules that are not installed are skipped so the comparison still runs
+# on a development machine.
+STAGE_SOURCE = """
+import importlib
+for name in {modules!r}:
+    try:
+        importlib.import_module(name)
+    except Exception:
+        pass
+print("READY", flush=True)
+"""
+
+
+def time_to_ready(process):
+    """Seconds until the stage prints READY, then reap it"""
+    start = time.perf_counter()
+    for line in process.stdout:
+        if line.strip() == "READY":
+            break
+    elapsed = time.perf_counter() - start
+    process.wait()
+    return elapsed
+
+
+def measure_popen(cmd, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+        spawn = time.perf_counter() - start
+        samples.append(spawn + time_to_ready(process))
+    return samples
+
+
+def measure_zygote(client, cmd, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = client.spawn(cmd)
+        spawn = time.perf_counter() - start
+        samples.append(spawn + time_to_ready(process))
+    return samples
+
+
+def report(name, samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{name:<8} runs={len(samples):<4} "
+        f"mean={statistics.mean(samples) * 1000:8.1f} ms  "
+        f"p50={statistics.median(samples) * 1000:8.1f} ms  "
+        f"p95={p95 * 1000:8.1f} ms  "
+        f"max={ordered[-1] * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare stage startup latency: Popen vs zygote fork"
+    )
+    parser.add_argument("--runs", type=int, default=20, help="Spawns per path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stage = os.path.join(workdir, "stage.py")
+        with open(stage, "w") as f:
+            f.write(STAGE_SOURCE.format(modules=PRELOAD_MODULES))
+        cmd = ["python3", stage]
+
+        client = ZygoteClient(socket_path=os.path.join(workdir, "zygote.sock"))
+        client.start()
+        try:
+            # One warm-up each so file caches are equally hot
+            measure_popen(cmd, 1)
+            measure_zygote(client, cmd, 1)
+
+            print(f"Stage imports: {PRELOAD_MODULES}")
+            report("popen", measure_popen(cmd, args.runs))
+            report("zygote", measure_zygote(client, cmd, args.runs))
+        finally:
+            client.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import struct
+import argparse
+import threading
+import subprocess
+import socketserver
+
+import cv2
+import numpy as np
+
+from frame_ring import FrameRing
+
+DEFAULT_SOCKET_PATH = f"/tmp/photobooth_camera_{os.getuid()}.sock"
+
+# Stages started by main.py find the broker through this variable
+CAMERA_SOCKET_ENV = "PHOTOBOOTH_CAMERA_SOCKET"
+
+# Requests and replies are length-prefixed JSON, as on the stage channel.
+# Pixels never cross the socket; replies name a slot in a shared frame ring.
+HEADER = struct.Struct("!I")
+
+STILL_SIZE = (2304, 1296)  # 16:9 aspect ratio
+STREAM_SIZE = (1280, 720)
+
+# Full resolution slots: room for a burst of five around the countdown's end
+STILL_SLOTS = 6
+
+
+def recv_exact(conn, size):
+    """Read exactly size bytes from a socket"""
+    data = bytearray(size)
+    view = memoryview(data)
+    while view:
+        received = conn.recv_into(view)
+        if not received:
+            raise ConnectionError("Connection closed while reading")
+        view = view[received:]
+    return data
+
+
+def send_message(conn, message):
+    body = json.dumps(message).encode("utf-8")
+    conn.sendall(HEADER.pack(len(body)) + body)
+
+
+def recv_message(conn):
+    (length,) = HEADER.unpack(recv_exact(conn, HEADER.size))
+    return json.loads(recv_exact(conn, length).decode("utf-8"))
+
+
+class PicameraBackend:
+    """Picamera2 configured once for stills, streaming from the lores output"""
+
+    def __init__(self, still_size=STILL_SIZE, stream_size=STREAM_SIZE):
+        self.still_size = still_size
+        self.stream_size = stream_size
+        self.camera = None
+
+    def open(self):
+        from picamera2 import Picamera2
+
+        self.camera = Picamera2()
+        config = self.camera.create_still_configuration(
+            # RGB888 is B, G, R in memory, which is what cv2 encodes
+            main={"size": self.still_size, "format": "RGB888"},
+            lores={"size": self.stream_size},
+            display="lores",
+        )
+        self.camera.configure(config)
+        self.camera.start()
+
+    def capture_frame(self, out):
+        """Convert the next lores frame to RGB into out"""
+        yuv = self.camera.capture_array("lores")
+        cv2.cvtColor(yuv, cv2.COLOR_YUV420p2RGB, dst=out)
+
+    def capture_main(self, out):
+        """Copy the next full resolution BGR frame into out"""
+        np.copyto(out, self.camera.capture_array("main"))
+
+    def close(self):
+        if self.camera:
+            try:
+                self.camera.stop()
+                self.camera.close()
+            except Exception:
+                pass
+            self.camera = None
+
+
+class SyntheticBackend:
+    """Generated frames at a steady rate, for running without a camera"""
+
+    def __init__(self, still_size=STILL_SIZE, stream_size=STREAM_SIZE, fps=30):
+        self.still_size = still_size
+        self.stream_size = stream_size
+        self.fps = fps
+        self.count = 0
+        self.next_time = 0
+
+    def open(self):
+        self.count = 0
+
+    def render(self, out):
+        """A gradient with a bar that moves one step per frame"""
+        height, width = out.shape[:2]
+        out[:, :, 0] = np.linspace(0, 255, width, dtype=np.uint8)
+        out[:, :, 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+        out[:, :, 2] = 96
+        bar = (self.count * 8) % width
+        out[:, bar : bar + width // 32] = 255
+
+    def capture_frame(self, out):
+        # Pace frames like a sensor would
+        now = time.monotonic()
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time = max(now, self.next_time) + 1 / self.fps
+        self.count += 1
+        self.render(out)
+
+    def capture_main(self, out):
+        self.render(out)
+
+    def close(self):
+        pass
+
+
+BACKENDS = {"picamera": PicameraBackend, "synthetic": SyntheticBackend}
+
+
+class CameraBroker:
+    """Keeps the camera open and shares it between detection and capture
+
+    Frames are published in shared memory: lores RGB frames in one ring,
+    full resolution BGR stills in another. One thread fills the lores ring
+    while anyone is streaming; stills are taken from the running camera, so
+    a shot never waits for reconfiguration. The socket only carries
+    requests and new-frame notifications.
+
+    While a client holds full resolution frames, the same thread also keeps
+    the main ring filled, and a burst around a time is taken from the held
+    frames rather than captured afterwards. The burst then stays in the
+    ring, which stops filling until the hold ends.
+    """
+
+    def __init__(self, backend, ring_prefix, slots=3, still_slots=STILL_SLOTS):
+        self.backend = backend
+        self.camera_lock = threading.Lock()
+        self.frames = threading.Condition()
+        self.frame_id = 0
+        self.streams = 0
+        self.main_id = 0
+        self.holds = 0  # clients holding full resolution frames
+        self.hold_frozen = False  # a still was chosen from the held frames
+        self.running = True
+
+        width, height = backend.stream_size
+        self.lores = FrameRing.create(f"{ring_prefix}_lores", (height, width, 3), slots)
+        width, height = backend.still_size
+        self.main = FrameRing.create(
+            f"{ring_prefix}_main", (height, width, 3), still_slots
+        )
+
+    def start(self):
+        self.backend.open()
+        threading.Thread(
+            target=self.frame_loop, name="camera-frames", daemon=True
+        ).start()
+
+    def stop(self):
+        with self.frames:
+            self.running = False
+            self.frames.notify_all()
+        with self.camera_lock:
+            self.backend.close()
+            self.lores.close()
+            self.main.close()
+
+    def rings(self):
+        return {"lores": self.lores.name, "main": self.main.name}
+
+    def publish_lores(self):
+        """Capture one lores frame into the ring (single writer: hold camera_lock)"""
+        seq, slot = self.lores.begin_write()
+        self.backend.capture_frame(slot)
+        self.lores.commit(seq)
+        with self.frames:
+            self.frame_id = seq
+            self.frames.notify_all()
+        return seq
+
+    def publish_main(self):
+        """Capture one full resolution frame into the ring (hold camera_lock)"""
+        seq, slot = self.main.begin_write()
+        self.backend.capture_main(slot)
+        self.main.commit(seq)
+        with self.frames:
+            self.main_id = seq
+            self.frames.notify_all()
+        return seq
+
+    def holding(self):
+        return self.holds > 0 and not self.hold_frozen
+
+    def frame_loop(self):
+        while True:
+            with self.frames:
+                # Leave the sensor running but skip conversion when idle
+                self.frames.wait_for(
+                    lambda: self.streams or self.holding() or not self.running
+                )
+                if not self.running:
+                    return
+                streaming = self.streams > 0
+
+            try:
+                with self.camera_lock:
+                    # Checked again: a burst may have been chosen meanwhile
+                    if self.holding():
+                        self.publish_main()
+                    if streaming:
+                        self.publish_lores()
+            except Exception as e:
+                print(f"Camera broker: frame capture failed: {e}")
+                time.sleep(0.1)
+
+    def next_frame(self, last_id, timeout=1.0):
+        """Wait for a frame newer than last_id; returns its sequence number"""
+        with self.frames:
+            self.frames.wait_for(
+                lambda: self.frame_id != last_id or not self.running, timeout
+            )
+            return self.frame_id
+
+    def grab(self):
+        """Sequence number of a current lores frame, capturing one if idle"""
+        with self.frames:
+            streaming = self.streams > 0
+            last_id = self.frame_id
+        if streaming:
+            return self.next_frame(last_id)
+        with self.camera_lock:
+            return self.publish_lores()
+
+    def capture_still(self):
+        """Put a full resolution frame in the main ring
+
+        Returns (seq, timestamp, seconds). While a burst is kept in the ring
+        nothing is written over it; the newest held frame is returned.
+        """
+        start = time.monotonic()
+        with self.camera_lock:
+            if self.holds > 0 and self.hold_frozen:
+                seq = self.main.latest_seq
+                timestamp = float(self.main.timestamps[seq % self.main.slots])
+                return seq, timestamp, time.monotonic() - start
+            seq, slot = self.main.begin_write()
+            self.backend.capture_main(slot)
+            self.main.commit(seq)
+            timestamp = float(self.main.timestamps[seq % self.main.slots])
+        return seq, timestamp, time.monotonic() - start
+
+    def burst(self, at, count=1):
+        """seqs of the count held frames nearest at, a time.time() value
+
+        Waits for the frames after at to arrive, then keeps the burst in the
+        main ring until the hold ends. Empty when no frames are held.
+        """
+        count = max(1, min(count, self.main.slots))
+        after = count // 2 + 1
+        with self.frames:
+            self.frames.wait_for(
+                lambda: self.main.count_after(at) >= after or not self.holding(), 1.0
+            )
+
+        with self.camera_lock:
+            if not self.holding():
+                return []
+            seqs = self.main.nearest(at, count, max_gap=1.0)
+            if seqs:
+                self.hold_frozen = True
+            return seqs
+
+    def hold(self, conn):
+        """Keep full resolution frames coming until conn closes"""
+        with self.frames:
+            self.holds += 1
+            self.hold_frozen = False
+            self.frames.notify_all()
+
+        try:
+            send_message(conn, {"ok": True})
+            while conn.recv(1):
+                pass
+        except OSError:
+            pass
+        finally:
+            with self.frames:
+                self.holds -= 1
+
+    def stream(self, conn):
+        """Notify one client of each new lores frame until it disconnects"""
+        with self.frames:
+            self.streams += 1
+            self.frames.notify_all()
+
+        last_id = self.frame_id
+        try:
+            while self.running:
+                frame_id = self.next_frame(last_id)
+                if frame_id == last_id:
+                    continue
+                last_id = frame_id
+                send_message(conn, {"frame": frame_id})
+        except OSError:
+            pass
+        finally:
+            with self.frames:
+                self.streams -= 1
+
+
+class BrokerRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        broker = self.server.broker
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+
+            command = request.get("cmd")
+            try:
+                if command == "ping":
+                    send_message(self.request, {"ok": True, "rings": broker.rings()})
+                elif command == "grab":
+                    send_message(self.request, {"ok": True, "frame": broker.grab()})
+                elif command == "capture":
+                    seq, timestamp, seconds = broker.capture_still()
+                    reply = {
+                        "ok": True,
+                        "frame": seq,
+                        "timestamp": timestamp,
+                        "seconds": seconds,
+                    }
+                    send_message(self.request, reply)
+                elif command == "burst":
+                    seqs = broker.burst(request["at"], request.get("count", 1))
+                    send_message(self.request, {"ok": True, "frames": seqs})
+                elif command == "hold":
+                    broker.hold(self.request)
+                    return
+                elif command == "stream":
+                    broker.stream(self.request)
+                    return
+                else:
+                    send_message(
+                        self.request,
+                        {"ok": False, "error": f"unknown command {command}"},
+                    )
+            except OSError:
+                return
+            except Exception as e:
+                print(f"Camera broker: {command} failed: {e}")
+                try:
+                    send_message(self.request, {"ok": False, "error": str(e)})
+                except OSError:
+                    return
+
+
+class BrokerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, broker):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, BrokerRequestHandler)
+        self.broker = broker
+
+
+class CameraClient:
+    """Talks to the camera broker; can also launch it"""
+
+    def __init__(self, socket_path=None):
+        self.socket_path = (
+            socket_path or os.environ.get(CAMERA_SOCKET_ENV) or DEFAULT_SOCKET_PATH
+        )
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.ring_names = None
+        self.rings = {}
+
+    def start(self, backend="picamera", timeout=30):
+        """Launch the broker and wait until it accepts connections"""
+        script = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "camera_broker.py"
+        )
+        self.process = subprocess.Popen(
+            ["python3", script, "--socket", self.socket_path, "--backend", backend],
+            stdin=subprocess.DEVNULL,
+        )
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Camera broker exited during startup")
+            try:
+                self.ping()
+                return True
+            except OSError:
+                self.disconnect()
+                time.sleep(0.05)
+
+        self.close()
+        raise RuntimeError("Timed out waiting for camera broker")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def connect(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(self.socket_path)
+        return conn
+
+    def request(self, message):
+        """Send one request and return the reply"""
+        with self.lock:
+            if self.conn is None:
+                self.conn = self.connect()
+            try:
+                send_message(self.conn, message)
+                return recv_message(self.conn)
+            except (OSError, ValueError):
+                self.conn.close()
+                self.conn = None
+                raise
+
+    def ping(self):
+        reply = self.request({"cmd": "ping"})
+        self.ring_names = reply.get("rings")
+        return reply.get("ok", False)
+
+    def ring(self, stream):
+        """Attach to the broker's "lores" or "main" frame ring"""
+        if stream not in self.rings:
+            if self.ring_names is None:
+                self.ping()
+            self.rings[stream] = FrameRing.attach(self.ring_names[stream])
+        return self.rings[stream]
+
+    def frame_valid(self, stream, seq):
+        """Whether frame seq is still in its ring; check after copying a view"""
+        return self.ring(stream).valid(seq)
+
+    def read_frame(self, stream, seq, copy=False):
+        """Frame seq from a ring as a NumPy view, or None if overwritten"""
+        result = self.ring(stream).read(seq, copy)
+        return result[1] if result else None
+
+    def grab_frame(self, copy=False):
+        """A current lores RGB frame"""
+        reply = self.request({"cmd": "grab"})
+        if not reply.get("ok"):
+            raise RuntimeError(f"Camera broker grab failed: {reply.get('error')}")
+        return self.read_frame("lores", reply["frame"], copy)
+
+    def hold_frames(self):
+        """Have the broker keep recent full resolution frames
+
+        They are kept until the returned socket is closed; meanwhile
+        burst() takes frames from them.
+        """
+        conn = self.connect()
+        try:
+            send_message(conn, {"cmd": "hold"})
+            recv_message(conn)
+        except (OSError, ValueError):
+            conn.close()
+            raise
+        return conn
+
+    def burst(self, at, count=1):
+        """(seq, timestamp, frame) of the count held frames nearest at
+
+        Frames are BGR views into the main ring, which keeps them until the
+        hold ends; empty when no frames are held.
+        """
+        reply = self.request({"cmd": "burst", "at": at, "count": count})
+        if not reply.get("ok"):
+            raise RuntimeError(f"Camera broker burst failed: {reply.get('error')}")
+        ring = self.ring("main")
+        frames = []
+        for seq in reply["frames"]:
+            result = ring.read(seq)
+            if result:
+                frames.append((seq,) + result)
+        return frames
+
+    def capture_frame(self):
+        """(seq, timestamp, frame) of a new full resolution still, not saved
+
+        The frame is a BGR view into the main ring.
+        """
+        reply = self.request({"cmd": "capture"})
+        if not reply.get("ok"):
+            raise RuntimeError(f"Camera broker capture failed: {reply.get('error')}")
+        seq = reply["frame"]
+        return seq, reply["timestamp"], self.read_frame("main", seq)
+
+    def frames(self, size=None):
+        """Yield (frame_id, capture time, RGB frame) for each new lores frame
+
+        Capture times are time.time() values. A frame that was overwritten
+        before we got to it, or while it was resized, is skipped. Frames at
+        their original size are views into shared memory: copy them, then
+        check frame_valid("lores", frame_id).
+        """
+        ring = self.ring("lores")
+        conn = self.connect()
+        try:
+            send_message(conn, {"cmd": "stream"})
+            while True:
+                seq = recv_message(conn)["frame"]
+                result = ring.read(seq)
+                if result is None:
+                    continue
+                timestamp, frame = result
+                if size and (frame.shape[1], frame.shape[0]) != tuple(size):
+                    frame = cv2.resize(frame, tuple(size))
+                    if not ring.valid(seq):
+                        continue
+                yield seq, timestamp, frame
+        except ConnectionError:
+            return
+        finally:
+            conn.close()
+
+    def disconnect(self):
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+
+    def close(self):
+        """Close the connection, and stop the broker if we started it"""
+        self.disconnect()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+        if self.alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait(timeout=1)
+        self.process = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Photobooth camera broker")
+    parser.add_argument(
+        "--socket", type=str, default=DEFAULT_SOCKET_PATH, help="Unix socket path"
+    )
+    parser.add_argument(
+        "--backend", choices=sorted(BACKENDS), default="picamera", help="Frame source"
+    )
+    args = parser.parse_args()
+
+    ring_prefix = os.path.splitext(os.path.basename(args.socket))[0]
+    try:
+        start = time.time()
+        broker = CameraBroker(BACKENDS[args.backend](), ring_prefix)
+        broker.start()
+        print(f"Camera broker ({args.backend}) started in {time.time() - start:.2f}s")
+    except Exception as e:
+        print(f"Camera broker could not open the camera: {e}")
+        return 1
+
+    server = BrokerServer(args.socket, broker)
+    parent_pid = os.getppid()
+
+    def watch_parent():
+        # Exit with the orchestrator instead of holding the camera as an orphan
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        print("Camera broker: parent exited, shutting down")
+        server.shutdown()
+
+    def handle_sigterm(signum, frame):
+        # shutdown() blocks until serve_forever returns, so not on this thread
+        threading.Thread(target=server.shutdown).start()
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    print(f"Camera broker ready on {args.socket}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        broker.stop()
+        try:
+            os.remove(args.socket)
+        except OSError:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import metrics
+from detection_batch import PlainDetection
+
+# "hailo" or "cpu"; detection_app.py uses hailo whenever it is installed
+DETECTION_BACKEND_ENV = "PHOTOBOOTH_DETECTION_BACKEND"
+
+# A YOLOv8 model exported to ONNX; export it with a dynamic batch size, or
+# set PHOTOBOOTH_CPU_BATCH to 1 for a model fixed at one frame per pass
+CPU_MODEL = os.environ.get("PHOTOBOOTH_CPU_MODEL", "models/yolov8n.onnx")
+CPU_WORKERS = int(os.environ.get("PHOTOBOOTH_CPU_WORKERS", "2"))
+CPU_BATCH = int(os.environ.get("PHOTOBOOTH_CPU_BATCH", "2"))
+CPU_THRESHOLD = float(os.environ.get("PHOTOBOOTH_CPU_THRESHOLD", "0.5"))
+
+# Inference time is reported every this many batches
+REPORT_EVERY = 30
+
+COCO_LABELS = (
+    "person", "bicycle", "car", "motorcycle", "airplane", "bus", "train",
+    "truck", "boat", "traffic light", "fire hydrant", "stop sign",
+    "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow",
+    "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella", "handbag",
+    "tie", "suitcase", "frisbee", "skis", "snowboard", "sports ball", "kite",
+    "baseball bat", "baseball glove", "skateboard", "surfboard",
+    "tennis racket", "bottle", "wine glass", "cup", "fork", "knife", "spoon",
+    "bowl", "banana", "apple", "sandwich", "orange", "broccoli", "carrot",
+    "hot dog", "pizza", "donut", "cake", "chair", "couch", "potted plant",
+    "bed", "dining table", "toilet", "tv", "laptop", "mouse", "remote",
+    "keyboard", "cell phone", "microwave", "oven", "toaster", "sink",
+    "refrigerator", "book", "clock", "vase", "scissors", "teddy bear",
+    "hair drier", "toothbrush",
+)  # fmt: skip
+
+
+def load_labels(path=None):
+    """Label names by class id, from a labels JSON file or COCO's"""
+    if not path:
+        return COCO_LABELS
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data["labels"]
+    # Hailo label files start with a background class ONNX models do not have
+    if data and data[0] == "unlabeled":
+        data = data[1:]
+    return tuple(data)
+
+
+class FrameCounter:
+    """Frame counting of hailo_apps_infra's app_callback_class, without it"""
+
+    def __init__(self):
+        self.frame_count = 0
+        self.use_frame = False
+        self.running = True
+
+    def increment(self):
+        self.frame_count += 1
+
+    def get_count(self):
+        return self.frame_count
+
+
+class CpuDetector:
+    """A YOLOv8 ONNX model run with OpenCV's DNN module
+
+    The model's output is (batch, 4 + classes, anchors): box centre and size
+    in input pixels, then a score per class. Frames are stretched to the
+    input size, so boxes divided by it are relative to the frame, as the
+    Hailo pipeline's are.
+    """
+
+    def __init__(self, model_path, labels, input_size=640, threshold=CPU_THRESHOLD):
+        self.net = cv2.dnn.readNet(model_path)
+        self.labels = labels
+        self.input_size = input_size
+        self.threshold = threshold
+        self.nms_threshold = 0.45
+
+    def prepare(self, frame):
+        """Resize an RGB frame to the network input; this also copies it"""
+        size = (self.input_size, self.input_size)
+        return cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+
+    def detect(self, images):
+        """Detections for each prepared image, in one forward pass"""
+        blob = cv2.dnn.blobFromImages(images, 1 / 255.0)
+        self.net.setInput(blob)
+        output = self.net.forward()
+        return [self.decode(rows) for rows in output]
+
+    def decode(self, output):
+        rows = output.T
+        scores = rows[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(rows)), class_ids]
+        keep = confidences >= self.threshold
+        if not keep.any():
+            return []
+
+        boxes = rows[keep, :4].copy()
+        boxes[:, :2] -= boxes[:, 2:] / 2  # centre to top left
+        class_ids = class_ids[keep]
+        confidences = confidences[keep]
+        indices = cv2.dnn.NMSBoxesBatched(
+            boxes.tolist(),
+            confidences.tolist(),
+            class_ids.tolist(),
+            self.threshold,
+            self.nms_threshold,
+        )
+
+        detections = []
+        scale = 1.0 / self.input_size
+        for index in np.asarray(indices, dtype=int).reshape(-1).tolist():
+            x, y, w, h = (boxes[index] * scale).tolist()
+            box = (max(x, 0.0), max(y, 0.0), min(x + w, 1.0), min(y + h, 1.0))
+            class_id = int(class_ids[index])
+            label = (
+                self.labels[class_id] if class_id < len(self.labels) else str(class_id)
+            )
+            detections.append(PlainDetection(label, float(confidences[index]), box))
+        return detections
+
+
+class CpuDetectionBackend:
+    """Detection on the CPU for booths without a Hailo accelerator
+
+    Frames are resized as they are read and grouped into batches of
+    batch_size, each one forward pass. Batches run on a pool of workers
+    threads, each with its own network, as a cv2.dnn.Net cannot be shared;
+    OpenCV releases the GIL while it runs, so they run in parallel. At
+    most one batch per thread is in flight, and frames that arrive while
+    all are busy are skipped by the camera broker rather than queued.
+    """
+
+    name = "cpu"
+
+    def __init__(
+        self,
+        model_path=CPU_MODEL,
+        labels=COCO_LABELS,
+        workers=CPU_WORKERS,
+        batch_size=CPU_BATCH,
+    ):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"No CPU detection model at {model_path}")
+        self.model_path = model_path
+        self.labels = labels
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.local = threading.local()
+        # Loaded here too, so a bad model fails before the first session
+        self.detector = CpuDetector(model_path, labels)
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="cpu-detect")
+        self.batches = 0
+
+    def detect_batch(self, images):
+        detector = getattr(self.local, "detector", None)
+        if detector is None:
+            detector = self.local.detector = CpuDetector(self.model_path, self.labels)
+        start = time.monotonic()
+        results = detector.detect(images)
+        return results, time.monotonic() - start
+
+    def deliver(self, times, future, on_frame):
+        results, seconds = future.result()
+        self.batches += 1
+        if self.batches % REPORT_EVERY == 0:
+            metrics.observe("detection.inference.cpu", seconds / len(results))
+        for objects, captured_at in zip(results, times):
+            on_frame(objects, captured_at)
+
+    def run(self, frames, on_frame):
+        """Detect objects in every frame until frames ends
+
+        frames yields (capture time, RGB frame); on_frame gets each frame's
+        detections and capture time, in frame order.
+        """
+        pending = collections.deque()
+        images, times = [], []
+        for captured_at, frame in frames:
+            images.append(self.detector.prepare(frame))
+            times.append(captured_at)
+            if len(images) < self.batch_size:
+                continue
+            pending.append((times, self.pool.submit(self.detect_batch, images)))
+            images, times = [], []
+
+            # Hand over finished batches; with every thread busy, wait
+            while pending and (pending[0][1].done() or len(pending) >= self.workers):
+                self.deliver(*pending.popleft(), on_frame)
+
+        if images:
+            pending.append((times, self.pool.submit(self.detect_batch, images)))
+        while pending:
+            self.deliver(*pending.popleft(), on_frame)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
@@ -372,7 +372,6 @@
 #             save_detections_to_json(last_detections)
 
 #!/usr/bin/env python3
-import gi
 import json
 import os
 import argparse
@@ -381,19 +380,81 @@ import datetime
 import cv2
 import numpy as np
 import threading
+import queue
 import time
-
-gi.require_version("Gst", "1.0")
-from gi.repository import Gst
-import hailo
-from hailo_apps_infra.hailo_rpi_common import app_callback_class
-from hailo_apps_infra.detection_pipeline_simple import GStreamerDetectionApp
+import signal
+
+# Booths without a Hailo accelerator run the CPU backend instead
+try:
+    import gi
+
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst
+    import hailo
+    from hailo_apps_infra.hailo_rpi_common import app_callback_class
+    from hailo_apps_infra.detection_pipeline_simple import GStreamerDetectionApp
+except (ImportError, ValueError):
+    Gst = hailo = GStreamerDetectionApp = None
+    from cpu_detection import FrameCounter as app_callback_class
+
+import stage_ipc
+import metrics
+from session_store import JsonFileCache, write_json_atomic
+from detection_log import DetectionLogWriter, DETECTION_LOG_ENV, log_path
+from detection_log import read_detection_log
+from camera_broker import CameraClient, CAMERA_SOCKET_ENV
+from detection_control import ControlServer, DetectionSession, DETECTION_SOCKET_ENV
+from detection_batch import DetectionBatch, LabelTable, PropWindow, resolve_bbox_reader
+from detection_batch import PlainDetection
+from cpu_detection import CpuDetectionBackend, DETECTION_BACKEND_ENV, CPU_MODEL
+from cpu_detection import load_labels
 
 # Global variables
+START_TIME = time.monotonic()
 running = True
-last_detections = []
+last_detections = None  # DetectionBatch of the last frame with any
 display_window = None
-additional_args = {}
+session = DetectionSession()
+
+# Frames waiting for the worker; when full, PHOTOBOOTH_DETECTION_DROP says
+# whether the oldest queued frame ("oldest") or the new one ("newest") goes,
+# or ("block") that the caller waits, which only suits replays
+DETECTION_QUEUE_SIZE = int(os.environ.get("PHOTOBOOTH_DETECTION_QUEUE", "8"))
+DETECTION_DROP_POLICY = os.environ.get("PHOTOBOOTH_DETECTION_DROP", "oldest")
+
+# Queue wait, latency, frame time and dropped frames are reported every
+# this many frames
+REPORT_EVERY = 60
+
+# "hailo" or "cpu", named in metrics so the two can be compared
+BACKEND = os.environ.get(DETECTION_BACKEND_ENV) or ("hailo" if hailo else "cpu")
+
+# The display branch of hailo_apps_infra's pipeline ends in this sink; as a
+# service a valve is put in front of it so it can be taken down
+DISPLAY_SINK = "hailo_display"
+DISPLAY_VALVE = "hailo_display_valve"
+
+# Capture times of frames pushed from the camera broker, by buffer pts
+capture_times = {}
+
+# A label is a prop of the session while it was in PROP_MIN_HITS of the last
+# PROP_WINDOW frames with an average confidence of at least PROP_CONFIDENCE
+PROP_WINDOW = 30
+PROP_MIN_HITS = 15
+PROP_CONFIDENCE = 0.7
+
+LABELS = LabelTable()
+
+# temp_user_data_*.json as main.py last wrote it
+user_data_files = JsonFileCache()
+
+# Per session, the state last written, to skip writes that change nothing
+written_states = {}
+
+# How boxes are read is decided once, not probed on every detection
+read_bbox = None
+if hasattr(hailo, "HailoDetection"):
+    read_bbox = resolve_bbox_reader(hailo.HailoDetection)
 
 
 def parse_arguments():
@@ -442,6 +503,17 @@ def parse_arguments():
         "--labels-json", type=str, help="Path to custom labels JSON file"
     )
 
+    # Replaying a detection log instead of running the pipeline
+    parser.add_argument(
+        "--replay", type=str, help="Feed a detection log through the callback"
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="Replay speed; 1 is real time, 0 as fast as possible",
+    )
+
     return parser.parse_args()
 
 
@@ -450,9 +522,8 @@ DATA_DIR = "./data"
 os.makedirs(DATA_DIR, exist_ok=True)
 
 
-def load_additional_args():
-    """Load additional arguments from environment variable"""
-    global additional_args
+def load_additional_args(defaults=None):
+    """Start the one session described by DETECTION_ARGS"""
     try:
         detection_args_str = os.environ.get("DETECTION_ARGS", "{}")
         additional_args = json.loads(detection_args_str)
@@ -460,58 +531,114 @@ def load_additional_args():
     except Exception as e:
         print(f"Error loading additional arguments: {e}")
         additional_args = {}
+    session.start(dict(defaults or {}, **additional_args))
+
+
+def gate_display(pipeline_string):
+    """The pipeline with a valve in front of its display sink, if it has one"""
+    sink = f"fpsdisplaysink name={DISPLAY_SINK} "
+    if sink not in pipeline_string:
+        return pipeline_string
+    valve = f"valve name={DISPLAY_VALVE} drop=false ! "
+    return pipeline_string.replace(sink, valve + sink, 1)
+
+
+if GStreamerDetectionApp is not None:
+
+    class ServiceDetectionApp(GStreamerDetectionApp):
+        """The detection pipeline with its display sink behind a valve"""
+
+        def get_pipeline_string(self):
+            return gate_display(super().get_pipeline_string())
+
+
+class SessionDisplay:
+    """Shows the detection window only while a session is active
 
+    The service's pipeline keeps running between sessions, and its window
+    would stay above the idle, countdown and review scenes with the last
+    frame in it. Between sessions the valve drops frames and the sink is
+    held in NULL, which closes the window.
+    """
+
+    def __init__(self, pipeline):
+        self.valve = pipeline.get_by_name(DISPLAY_VALVE)
+        self.sink = pipeline.get_by_name(DISPLAY_SINK)
+
+    def show(self, visible):
+        if self.valve is None or self.sink is None:
+            return
+        if visible:
+            self.sink.set_locked_state(False)
+            self.sink.sync_state_with_parent()
+            self.valve.set_property("drop", False)
+        else:
+            self.valve.set_property("drop", True)
+            self.sink.set_locked_state(True)
+            self.sink.set_state(Gst.State.NULL)
+
+
+def finish_session(args):
+    """Save what the session detected last, then forget it"""
+    global last_detections
+    detection_worker.flush()
+    detection_worker.close_log()
+    if args.get("json_id") and last_detections:
+        props = detection_worker.prop_window.props()
+        save_detections_to_json(last_detections, props, args)
+    last_detections = None
+    print(f"Detection session {args.get('json_id')} stopped")
+
+
+def save_detections_to_json(batch, props, additional_args=None):
+    """Write the last DetectionBatch and the props to the session state file"""
+    if additional_args is None:
+        additional_args = session.args
 
-def save_detections_to_json(detections):
-    """Save detection results to a JSON file"""
     # Use json_id from additional args if available
     json_id = additional_args.get("json_id")
     if not json_id:
         return
-
-    # Create timestamp
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    detections = batch.to_dicts() if batch else []
 
     # Prepare data
     data = {
-        "timestamp": timestamp,
         "detections": detections,
         "prop_list": additional_args.get("prop_list", []),
         "cache_img_path": additional_args.get("cache_path"),
     }
 
-    # Find existing session data file
+    # Merge in the session data file, read again only once it has changed
     user_data_file = os.path.join(DATA_DIR, f"temp_user_data_{json_id}.json")
-    if os.path.exists(user_data_file):
-        try:
-            # Load existing data
-            with open(user_data_file, "r") as f:
-                user_data = json.load(f)
-
-            # Merge with our detection data
-            if "story_id" in user_data:
-                data["story_id"] = user_data["story_id"]
-
-            if "users" in user_data:
-                data["users"] = user_data["users"]
-
-                # Update detected props
-                if detections:
-                    props = [
-                        d["label"] for d in detections if d.get("confidence", 0) >= 0.7
-                    ]
-                    if props:
-                        data["users"]["detected_props"] = props
-        except Exception as e:
-            print(f"Error loading user data: {e}")
+    try:
+        user_data = user_data_files.load(user_data_file) or {}
+        if "story_id" in user_data:
+            data["story_id"] = user_data["story_id"]
+        if "users" in user_data:
+            data["users"] = dict(user_data["users"])
+            # Update detected props
+            if props:
+                data["users"]["detected_props"] = props
+    except Exception as e:
+        print(f"Error loading user data: {e}")
 
-    # Create output filename with session ID and timestamp
-    filename = os.path.join(DATA_DIR, f"detection_data_{json_id}_{timestamp}.json")
+    if written_states.get(json_id) == data:
+        return
+    written_states.clear()
+    written_states[json_id] = data
+
+    stage_ipc.send_event(
+        stage_ipc.DETECTIONS,
+        json_id=json_id,
+        detections=detections,
+        detected_props=props,
+    )
 
-    # Write data to file
+    # One file per session, replaced whole so readers never see half of it
+    data = dict(data, timestamp=datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+    filename = os.path.join(DATA_DIR, f"detection_state_{json_id}.json")
     try:
-        with open(filename, "w") as f:
-            json.dump(data, f, indent=2)
+        write_json_atomic(filename, data)
         print(f"Saved detections to {filename}")
     except Exception as e:
         print(f"Error saving detections: {e}")
@@ -526,34 +653,29 @@ class user_app_callback_class(app_callback_class):
         self.window_name = None
         # Visualization handled within the app, not through additional args
 
+        # Frames seen in the current session; the service runs several
+        self.session_started = None
+        self.session_frames = 0
+
 
-def draw_detections(frame, detections):
+def draw_detections(frame, batch):
     """Draw detection boxes and labels on frame"""
-    if frame is None or not detections:
+    if frame is None or not batch:
         return frame
 
     result = frame.copy()
 
-    for det in detections:
-        label = det.get("label", "Unknown")
-        confidence = det.get("confidence", 0)
-
+    for label, confidence, bbox in batch.rows():
         try:
-            bbox = det.get("bbox", {})
-            if bbox and all(k in bbox for k in ["xmin", "ymin", "xmax", "ymax"]):
-                cv2.rectangle(
-                    result,
-                    (int(bbox["xmin"]), int(bbox["ymin"])),
-                    (int(bbox["xmax"]), int(bbox["ymax"])),
-                    (0, 255, 0),
-                    2,
-                )
+            if bbox[0] == bbox[0]:  # NaN when there is no box
+                xmin, ymin, xmax, ymax = (int(v) for v in bbox)
+                cv2.rectangle(result, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
 
                 text = f"{label}: {confidence:.2f}"
                 cv2.putText(
                     result,
                     text,
-                    (int(bbox["xmin"]), int(bbox["ymin"]) - 10),
+                    (xmin, ymin - 10),
                     cv2.FONT_HERSHEY_SIMPLEX,
                     0.5,
                     (0, 255, 0),
@@ -565,68 +687,378 @@ def draw_detections(frame, detections):
     return result
 
 
-def app_callback(pad, info, user_data):
-    global running, last_detections
+class DetectionWorker:
+    """Aggregates and saves detections off the GStreamer streaming thread
+
+    The pad probe only copies each frame into a DetectionBatch and queues
+    it. Here frames are voted on over a sliding window, and detections are
+    saved whenever the resulting props change.
+    """
+
+    def __init__(self, maxsize=DETECTION_QUEUE_SIZE, drop=DETECTION_DROP_POLICY):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.drop = drop
+        self.dropped = 0  # since last reported
+        self.total_dropped = 0
+        self.prop_window = PropWindow(PROP_WINDOW, PROP_MIN_HITS, PROP_CONFIDENCE)
+        self.log_dir = os.environ.get(DETECTION_LOG_ENV)
+        self.log = None
+        self.interval_start = (0, 0.0)  # session frame and time it began
+        self.thread = threading.Thread(
+            target=self.run, name="detection-worker", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, item):
+        """Queue a frame; only the "block" policy ever waits"""
+        if self.drop == "block":
+            self.queue.put(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                self.dropped += 1
+                self.total_dropped += 1
+                if self.drop == "newest":
+                    return
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
 
+    def flush(self, timeout=2):
+        """Wait until every frame queued so far has been handled"""
+        done = threading.Event()
+        try:
+            self.queue.put(done.set, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if callable(item):
+                self.report_drops()
+                item()
+                continue
+            try:
+                self.handle(*item)
+            except Exception as e:
+                print(f"Error handling detections: {e}")
+
+    def open_log(self):
+        """Start the session's detection log, if logging is enabled"""
+        self.close_log()
+        json_id = session.args.get("json_id")
+        if self.log_dir and json_id:
+            try:
+                self.log = DetectionLogWriter(log_path(self.log_dir, json_id))
+            except OSError as e:
+                print(f"Error opening detection log: {e}")
+
+    def close_log(self):
+        if self.log:
+            try:
+                self.log.close()
+            except OSError as e:
+                print(f"Error writing detection log: {e}")
+            self.log = None
+
+    def report_drops(self):
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            metrics.count("detection.dropped_frames", dropped)
+
+    def handle(self, frame_count, session_frame, captured_at, capture_time, batch):
+        """Take one frame's detections
+
+        captured_at is when the detections came out of the network, on the
+        monotonic clock; capture_time when the camera took the frame, as
+        time.time(), if known.
+        """
+        global last_detections
+
+        if frame_count == 1:
+            metrics.observe("detection.first_frame", captured_at - START_TIME)
+        if session_frame == 1:
+            self.prop_window.reset()
+            self.open_log()
+            if session.started:
+                since_start = captured_at - session.started
+                metrics.observe("detection.session_first_frame", since_start)
+            self.interval_start = (session_frame, captured_at)
+
+        # Update last detections
+        if batch:
+            last_detections = batch
+
+        wall_time = time.time() - (time.monotonic() - captured_at)
+        if self.log:
+            self.log.append(session_frame, wall_time, batch)
+
+        if session_frame % REPORT_EVERY == 0:
+            metrics.observe("detection.queue_wait", time.monotonic() - captured_at)
+            # Camera to detections, and time per frame; throughput is its inverse
+            if capture_time:
+                latency = wall_time - capture_time
+                metrics.observe(f"detection.latency.{BACKEND}", latency)
+            start_frame, start_time = self.interval_start
+            frame_time = (captured_at - start_time) / (session_frame - start_frame)
+            metrics.observe(f"detection.frame_time.{BACKEND}", frame_time)
+            self.interval_start = (session_frame, captured_at)
+            self.report_drops()
+
+        # Only a change in the session's props is worth a write
+        if self.prop_window.update(batch):
+            with metrics.span("detection.save"):
+                save_detections_to_json(last_detections, self.prop_window.props())
+
+
+detection_worker = DetectionWorker()
+
+
+def app_callback(pad, info, user_data):
     # Check if we should exit
     if not running:
         return Gst.PadProbeReturn.REMOVE
 
-    # Count frames
-    user_data.increment()
-    frame_count = user_data.get_count()
+    # Between sessions the service is paused; frames still in flight are dropped
+    if not session.active.is_set():
+        return Gst.PadProbeReturn.OK
 
     # Get buffer
     buffer = info.get_buffer()
     if buffer is None:
         return Gst.PadProbeReturn.OK
 
-    # Process detections
-    detections = []
+    # Copy out the detections; the buffer is not ours once we return
     roi = hailo.get_roi_from_buffer(buffer)
-    if roi:
-        for detection in roi.get_objects_typed(hailo.HAILO_DETECTION):
-            # Extract detection info
-            detection_info = {
-                "label": detection.get_label(),
-                "confidence": detection.get_confidence(),
-            }
-
-            # Try to get bounding box info
+    objects = roi.get_objects_typed(hailo.HAILO_DETECTION) if roi else []
+    submit_frame(objects, user_data, capture_times.pop(buffer.pts, None))
+    return Gst.PadProbeReturn.OK
+
+
+def submit_frame(objects, user_data, capture_time=None):
+    """Count a frame and queue its detections for the worker
+
+    capture_time is when the camera took the frame, as time.time(), if known.
+    """
+    global read_bbox
+
+    user_data.increment()
+    if user_data.session_started != session.started:
+        user_data.session_started = session.started
+        user_data.session_frames = 0
+    user_data.session_frames += 1
+
+    if objects and read_bbox is None:
+        read_bbox = resolve_bbox_reader(type(objects[0]))
+    batch = DetectionBatch.from_detections(objects, LABELS, read_bbox)
+
+    detection_worker.submit(
+        (
+            user_data.get_count(),
+            user_data.session_frames,
+            time.monotonic(),
+            capture_time,
+            batch,
+        )
+    )
+
+
+def replay_detections(path, speed=1.0):
+    """Feed a detection log's frames through the same path as the pad probe
+
+    With speed 0 frames are fed as fast as the worker takes them; otherwise
+    at the recorded frame times divided by speed.
+    """
+    log = read_detection_log(path)
+    names = log["labels"]
+    counts = log["frame_counts"].tolist()
+    times = log["frame_times"].tolist()
+    labels = log["label"].tolist()
+    confidences = log["confidence"].tolist()
+    boxes = log["bbox"].tolist()
+    if not counts:
+        print(f"{path} has no frames to replay")
+        return
+
+    user_data = user_app_callback_class()
+    start = time.monotonic()
+    offset = 0
+    for count, frame_time in zip(counts, times):
+        end = offset + count
+        if end > len(labels):
+            break  # Log cut short
+        if speed > 0:
+            delay = start + (frame_time - times[0]) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        objects = []
+        for index in range(offset, end):
+            objects.append(
+                PlainDetection(names[labels[index]], confidences[index], boxes[index])
+            )
+        submit_frame(objects, user_data)
+        offset = end
+
+    detection_worker.flush(timeout=None)
+    elapsed = time.monotonic() - start
+    frames = user_data.session_frames
+    print(
+        f"Replayed {frames} frames, {offset} detections in {elapsed:.2f}s "
+        f"({frames / elapsed:.0f} frames/s, "
+        f"{detection_worker.total_dropped} dropped)"
+    )
+
+
+def use_camera_broker(socket_path):
+    """Feed the rpi source from the camera broker instead of opening Picamera2
+
+    hailo_apps_infra starts picamera_thread to push frames into the
+    pipeline's appsrc; this swaps in a thread that reads the broker stream.
+    The stream is only open during a session, so between sessions nothing
+    reaches the network and the broker stops converting frames.
+    """
+    import hailo_apps_infra.gstreamer_app as gstreamer_app
+
+    def broker_thread(pipeline, video_width, video_height, video_format, *args):
+        appsrc = pipeline.get_by_name("app_source")
+        appsrc.set_property("is-live", True)
+        appsrc.set_property("format", Gst.Format.TIME)
+        appsrc.set_property(
+            "caps",
+            Gst.Caps.from_string(
+                f"video/x-raw, format=RGB, width={video_width}, "
+                f"height={video_height}, framerate=30/1, pixel-aspect-ratio=1/1"
+            ),
+        )
+
+        client = CameraClient(socket_path)
+        duration = Gst.util_uint64_scale_int(1, Gst.SECOND, 30)
+        count = 0
+        try:
+            while running:
+                if not session.active.wait(timeout=0.5):
+                    continue
+                frames = client.frames(size=(video_width, video_height))
+                try:
+                    for seq, timestamp, frame in frames:
+                        if not session.active.is_set():
+                            break
+                        data = frame.tobytes()
+                        if not client.frame_valid("lores", seq):
+                            continue  # Overwritten while it was copied
+                        buffer = Gst.Buffer.new_wrapped(data)
+                        buffer.pts = count * duration
+                        # Frames dropped inside the pipeline leave theirs behind
+                        if len(capture_times) > 64:
+                            capture_times.clear()
+                        capture_times[buffer.pts] = timestamp
+                        buffer.duration = duration
+                        if appsrc.emit("push-buffer", buffer) != Gst.FlowReturn.OK:
+                            return
+                        count += 1
+                    else:
+                        return  # Broker went away
+                finally:
+                    frames.close()
+        except Exception as e:
+            print(f"Camera broker stream ended: {e}")
+        finally:
+            client.close()
+
+    gstreamer_app.picamera_thread = broker_thread
+    print(f"Reading frames from camera broker at {socket_path}")
+
+
+def open_frame_source(args):
+    """Frames for the CPU backend: (generator function, close function)
+
+    The generator yields (capture time, RGB frame). The rpi camera is read
+    from the camera broker main.py runs, or from one started here when
+    there is none; a file or USB camera through OpenCV.
+    """
+    if args.input in (None, "rpi"):
+        client = CameraClient()
+        if not os.environ.get(CAMERA_SOCKET_ENV):
+            client.start()
+
+        def frames():
+            stream = client.frames()
             try:
-                bbox = {}
-                if hasattr(detection, "get_bbox_xmin"):
-                    bbox = {
-                        "xmin": detection.get_bbox_xmin(),
-                        "ymin": detection.get_bbox_ymin(),
-                        "xmax": detection.get_bbox_xmax(),
-                        "ymax": detection.get_bbox_ymax(),
-                    }
-                elif hasattr(detection, "get_bbox"):
-                    bbox_obj = detection.get_bbox()
-                    if bbox_obj:
-                        bbox = {
-                            "xmin": bbox_obj.xmin(),
-                            "ymin": bbox_obj.ymin(),
-                            "xmax": bbox_obj.xmax(),
-                            "ymax": bbox_obj.ymax(),
-                        }
-
-                detection_info["bbox"] = bbox
-            except Exception:
-                pass
+                for seq, timestamp, frame in stream:
+                    # Batches are read after the ring has moved on
+                    frame = frame.copy()
+                    if client.frame_valid("lores", seq):
+                        yield timestamp, frame
+            finally:
+                stream.close()
+
+        return frames, client.close
+
+    capture = cv2.VideoCapture(0 if args.input == "usb" else args.input)
+    if not capture.isOpened():
+        raise RuntimeError(f"Could not open input {args.input}")
+
+    def frames():
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield time.time(), cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    return frames, capture.release
+
+
+def run_cpu_detection(args, user_data):
+    """Detect on the CPU while sessions are active, until the input ends"""
+    backend = CpuDetectionBackend(CPU_MODEL, load_labels(args.labels_json))
+    frames, close = open_frame_source(args)
+    print(
+        f"Detecting on the CPU with {CPU_MODEL}, {backend.workers} threads, "
+        f"batches of {backend.batch_size}"
+    )
 
-            detections.append(detection_info)
+    def on_frame(objects, capture_time):
+        # Batches still in flight when a session ends belong to no session
+        if session.active.is_set():
+            submit_frame(objects, user_data, capture_time)
 
-    # Update last detections
-    if detections:
-        last_detections = detections
+    def while_active(stream):
+        for item in stream:
+            if not running or not session.active.is_set():
+                return
+            yield item
 
-    # Save detections occasionally
-    if frame_count % 60 == 0:
-        save_detections_to_json(last_detections)
+    try:
+        while running:
+            if not session.active.wait(timeout=0.5):
+                continue
+            stream = frames()
+            try:
+                backend.run(while_active(stream), on_frame)
+            finally:
+                stream.close()
+            if session.active.is_set():
+                print("Detection input ended")
+                return
+    finally:
+        backend.close()
+        close()
 
-    return Gst.PadProbeReturn.OK
+
+def handle_sigterm(signum, frame):
+    """Save the session before going, as main.py stops stages with SIGTERM"""
+    global running
+    print("Received termination signal")
+    running = False
+    session.stop()
+    sys.exit(0)
 
 
 def main():
@@ -635,21 +1067,73 @@ def main():
     # Parse arguments
     args = parse_arguments()
 
-    # Load additional arguments from environment
-    load_additional_args()
+    if args.replay:
+        # Nothing to pace a maximum speed replay but the worker itself
+        if args.replay_speed <= 0 and "PHOTOBOOTH_DETECTION_DROP" not in os.environ:
+            detection_worker.drop = "block"
+        session.on_stop = finish_session
+        stem = os.path.splitext(os.path.basename(args.replay))[0]
+        load_additional_args(defaults={"json_id": f"replay_{stem}"})
+        try:
+            replay_detections(args.replay, args.replay_speed)
+        finally:
+            session.stop()
+        return
 
-    # Initialize GStreamer
-    Gst.init(None)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    # As a service, sessions come over the control socket; otherwise there
+    # is one session, described in the environment
+    session.on_stop = finish_session
+    control = None
+    control_path = os.environ.get(DETECTION_SOCKET_ENV)
+    if control_path:
+        control = ControlServer(control_path, session)
+        control.start()
+        print(f"Detection service waiting for sessions on {control_path}")
+    else:
+        load_additional_args()
+
+    if BACKEND == "hailo" and hailo is None:
+        print(f"Hailo is not installed; set {DETECTION_BACKEND_ENV}=cpu")
+        session.stop()
+        return
+
+    if BACKEND == "hailo":
+        # Initialize GStreamer
+        Gst.init(None)
+
+        # main.py keeps the camera open in a broker process
+        if args.input == "rpi" and os.environ.get(CAMERA_SOCKET_ENV):
+            try:
+                use_camera_broker(os.environ[CAMERA_SOCKET_ENV])
+            except Exception as e:
+                print(f"Could not use camera broker, opening the camera directly: {e}")
 
     try:
         # Create user data instance
         user_data = user_app_callback_class()
 
-        # Create and start the app
-        app = GStreamerDetectionApp(app_callback, user_data)
+        if BACKEND == "cpu":
+            run_cpu_detection(args, user_data)
+        else:
+            # Create and start the app
+            if control:
+                app = ServiceDetectionApp(app_callback, user_data)
+                display = SessionDisplay(app.pipeline)
+                session.on_start = lambda args: display.show(True)
+                display.show(session.active.is_set())
+
+                def stop_display(args):
+                    display.show(False)
+                    finish_session(args)
+
+                session.on_stop = stop_display
+            else:
+                app = GStreamerDetectionApp(app_callback, user_data)
 
-        # Run the app
-        app.run()
+            # Run the app
+            app.run()
 
     except KeyboardInterrupt:
         print("Interrupted by user")
@@ -659,9 +1143,10 @@ def main():
 
         traceback.print_exc()
     finally:
+        if control:
+            control.close()
         # Save final detections
-        if additional_args.get("json_id") and last_detections:
-            save_detections_to_json(last_detections)
+        session.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+import collections
+
+import numpy as np
+
+# One row per detection; boxes are xmin, ymin, xmax, ymax
+DETECTION_DTYPE = np.dtype(
+    [("label", np.int16), ("confidence", np.float32), ("bbox", np.float32, (4,))]
+)
+NO_BOX = (np.nan, np.nan, np.nan, np.nan)
+
+
+class LabelTable:
+    """Small integer ids for label strings, shared by every batch"""
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.id(name)
+
+    def id(self, name):
+        label_id = self.ids.get(name)
+        if label_id is None:
+            label_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return label_id
+
+    def name(self, label_id):
+        return self.names[label_id]
+
+
+def resolve_bbox_reader(detection_type):
+    """Pick how boxes are read from a detection type, once
+
+    Returns a function giving (xmin, ymin, xmax, ymax) for a detection, or
+    NO_BOX when it has none.
+    """
+    if hasattr(detection_type, "get_bbox_xmin"):
+
+        def read_bbox(detection):
+            return (
+                detection.get_bbox_xmin(),
+                detection.get_bbox_ymin(),
+                detection.get_bbox_xmax(),
+                detection.get_bbox_ymax(),
+            )
+
+    elif hasattr(detection_type, "get_bbox"):
+
+        def read_bbox(detection):
+            bbox = detection.get_bbox()
+            if not bbox:
+                return NO_BOX
+            return (bbox.xmin(), bbox.ymin(), bbox.xmax(), bbox.ymax())
+
+    else:
+
+        def read_bbox(detection):
+            return NO_BOX
+
+    return read_bbox
+
+
+class PlainBBox:
+    __slots__ = ("box",)
+
+    def __init__(self, box):
+        self.box = box
+
+    def xmin(self):
+        return self.box[0]
+
+    def ymin(self):
+        return self.box[1]
+
+    def xmax(self):
+        return self.box[2]
+
+    def ymax(self):
+        return self.box[3]
+
+
+class PlainDetection:
+    """A detection not from Hailo, with the accessors of hailo.HailoDetection
+
+    Used for replayed logs and the CPU backend.
+    """
+
+    __slots__ = ("label", "confidence", "box")
+
+    def __init__(self, label, confidence, box):
+        self.label = label
+        self.confidence = confidence
+        self.box = box
+
+    def get_label(self):
+        return self.label
+
+    def get_confidence(self):
+        return self.confidence
+
+    def get_bbox(self):
+        return PlainBBox(self.box)
+
+    def get_bbox_xmin(self):
+        return self.box[0]
+
+    def get_bbox_ymin(self):
+        return self.box[1]
+
+    def get_bbox_xmax(self):
+        return self.box[2]
+
+    def get_bbox_ymax(self):
+        return self.box[3]
+
+
+class DetectionBatch:
+    """The detections of one frame as a structured array"""
+
+    __slots__ = ("records", "labels")
+
+    def __init__(self, records, labels):
+        self.records = records
+        self.labels = labels
+
+    @classmethod
+    def from_detections(cls, detections, labels, read_bbox):
+        records = np.empty(len(detections), dtype=DETECTION_DTYPE)
+        if not detections:
+            # [] cannot be assigned to the (0, 4) box column
+            return cls(records, labels)
+        # Filled a column at a time; the lists are gone once this returns
+        records["label"] = [labels.id(d.get_label()) for d in detections]
+        records["confidence"] = [d.get_confidence() for d in detections]
+        records["bbox"] = [read_bbox(d) for d in detections]
+        return cls(records, labels)
+
+    def __len__(self):
+        return len(self.records)
+
+    def rows(self):
+        """(label, confidence, bbox) per detection as plain Python values"""
+        records = self.records
+        names = self.labels.names
+        labels = [names[label_id] for label_id in records["label"].tolist()]
+        return zip(labels, records["confidence"].tolist(), records["bbox"].tolist())
+
+    def to_dicts(self):
+        """The JSON form saved to disk and sent to main.py"""
+        result = []
+        for label, confidence, bbox in self.rows():
+            if bbox[0] == bbox[0]:  # NaN marks a missing box
+                xmin, ymin, xmax, ymax = bbox
+                box = {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax}
+            else:
+                box = {}
+            result.append(
+                {"label": label, "confidence": confidence, "bbox": box}
+            )
+        return result
+
+
+class PropWindow:
+    """Props seen steadily over the last frames, rather than in one frame
+
+    For each label it keeps how many of the last size frames contained it
+    and an exponential moving average of its confidence in those frames.
+    A label becomes a prop once it is in at least min_hits of the frames
+    with an average of at least min_confidence. It stays one until it is
+    in fewer than half that many frames or its average falls 0.1 below the
+    cut, so labels near either threshold do not flicker.
+    """
+
+    def __init__(self, size=30, min_hits=15, min_confidence=0.7, alpha=0.2):
+        self.size = size
+        self.min_hits = min_hits
+        self.keep_hits = max(1, min_hits // 2)
+        self.keep_confidence = min_confidence - 0.1
+        self.min_confidence = min_confidence
+        self.alpha = alpha
+        self.labels = None
+        self.reset()
+
+    def reset(self):
+        self.frames = collections.deque()  # label ids present, per frame
+        self.hits = {}
+        self.average = {}
+        self.stable = ()
+
+    def update(self, batch):
+        """Add a frame; returns True when the stable props changed"""
+        self.labels = batch.labels
+
+        # Best confidence per label in this frame
+        best = {}
+        records = batch.records
+        for label_id, confidence in zip(
+            records["label"].tolist(), records["confidence"].tolist()
+        ):
+            if confidence > best.get(label_id, -1.0):
+                best[label_id] = confidence
+
+        for label_id, confidence in best.items():
+            self.hits[label_id] = self.hits.get(label_id, 0) + 1
+            average = self.average.get(label_id, confidence)
+            self.average[label_id] = average + self.alpha * (confidence - average)
+        self.frames.append(tuple(best))
+
+        if len(self.frames) > self.size:
+            for label_id in self.frames.popleft():
+                self.hits[label_id] -= 1
+                if not self.hits[label_id]:
+                    del self.hits[label_id]
+                    del self.average[label_id]
+
+        stable = []
+        for label_id, hits in self.hits.items():
+            if label_id in self.stable:
+                hits_needed, confidence_needed = self.keep_hits, self.keep_confidence
+            else:
+                hits_needed, confidence_needed = self.min_hits, self.min_confidence
+            if hits >= hits_needed and self.average[label_id] >= confidence_needed:
+                stable.append(label_id)
+        stable = tuple(sorted(stable))
+        changed = stable != self.stable
+        self.stable = stable
+        return changed
+
+    def props(self):
+        """Names of the stable props, most often seen first"""
+        ordered = sorted(self.stable, key=lambda label_id: -self.hits[label_id])
+        return [self.labels.name(label_id) for label_id in ordered]
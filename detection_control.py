@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import os
+import time
+import socket
+import threading
+import socketserver
+
+from camera_broker import send_message, recv_message
+
+DEFAULT_SOCKET_PATH = f"/tmp/photobooth_detection_{os.getuid()}.sock"
+
+# detection_app.py runs as a long-lived service when this is set
+DETECTION_SOCKET_ENV = "PHOTOBOOTH_DETECTION_SOCKET"
+
+# Session arguments the service accepts, as DETECTION_ARGS carries them
+SESSION_KEYS = ("json_id", "cache_path", "prop_list")
+
+
+class DetectionSession:
+    """Arguments of the current session and whether inference should run
+
+    Shared between the control server's threads and the pipeline; args is
+    replaced, never changed in place, so readers can take it without a lock.
+    """
+
+    def __init__(self, args=None):
+        self.lock = threading.Lock()
+        self.active = threading.Event()
+        self.args = dict(args or {})
+        self.started = None
+        self.on_start = None  # called with the args of a session that started
+        self.on_stop = None  # called with the args of a session that ended
+
+    def start(self, args):
+        with self.lock:
+            previous = self.args if self.active.is_set() else None
+            self.args = {k: args.get(k) for k in SESSION_KEYS if k in args}
+            self.started = time.monotonic()
+            self.active.set()
+            args = self.args
+        if previous is not None and self.on_stop:
+            self.on_stop(previous)
+        if self.on_start:
+            self.on_start(args)
+
+    def deactivate(self):
+        """Stop inference; returns the args of the session, None if idle"""
+        with self.lock:
+            if not self.active.is_set():
+                return None
+            self.active.clear()
+            return self.args
+
+    def finish(self, args):
+        """Save what a deactivated session detected"""
+        if self.on_stop:
+            self.on_stop(args)
+
+    def stop(self):
+        args = self.deactivate()
+        if args is None:
+            return False
+        self.finish(args)
+        return True
+
+    def set_prop_list(self, prop_list):
+        with self.lock:
+            self.args = dict(self.args, prop_list=list(prop_list))
+
+
+class ControlRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        session = self.server.session
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+
+            command = request.get("cmd")
+            ended = None  # a session to save once the reply is sent
+            try:
+                if command == "ping":
+                    reply = {"ok": True, "active": session.active.is_set()}
+                elif command == "start_session":
+                    session.start(request)
+                    reply = {"ok": True}
+                elif command == "stop_session" and not request.get("wait", True):
+                    ended = session.deactivate()
+                    reply = {"ok": True, "stopped": ended is not None}
+                elif command == "stop_session":
+                    reply = {"ok": True, "stopped": session.stop()}
+                elif command == "set_prop_list":
+                    session.set_prop_list(request.get("prop_list", []))
+                    reply = {"ok": True}
+                else:
+                    reply = {"ok": False, "error": f"unknown command {command}"}
+            except Exception as e:
+                print(f"Detection control: {command} failed: {e}")
+                reply = {"ok": False, "error": str(e)}
+
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+            finally:
+                if ended is not None:
+                    session.finish(ended)
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, session):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, ControlRequestHandler)
+        self.socket_path = socket_path
+        self.session = session
+
+    def start(self):
+        thread = threading.Thread(
+            target=self.serve_forever, name="detection-control", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+
+class DetectionControl:
+    """Client for the detection service's control socket"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def request(self, message, timeout=30):
+        """Send one command and return the reply
+
+        Retries the connection until timeout, as the service may still be
+        loading its network when the first session starts.
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while self.conn is None:
+                conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    conn.connect(self.socket_path)
+                    self.conn = conn
+                except OSError:
+                    conn.close()
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+            try:
+                send_message(self.conn, message)
+                reply = recv_message(self.conn)
+            except (OSError, ValueError):
+                self.conn.close()
+                self.conn = None
+                raise
+
+        if not reply.get("ok"):
+            error = reply.get("error")
+            raise RuntimeError(f"Detection {message['cmd']} failed: {error}")
+        return reply
+
+    def ping(self, timeout=30):
+        return self.request({"cmd": "ping"}, timeout)
+
+    def start_session(self, json_id, cache_path=None, prop_list=()):
+        message = {
+            "cmd": "start_session",
+            "json_id": json_id,
+            "cache_path": cache_path,
+            "prop_list": list(prop_list),
+        }
+        return self.request(message)
+
+    def stop_session(self, wait=True):
+        """Pause detection; with wait False, reply before saving the session"""
+        return self.request({"cmd": "stop_session", "wait": wait}, timeout=1)
+
+    def set_prop_list(self, prop_list):
+        return self.request({"cmd": "set_prop_list", "prop_list": list(prop_list)})
+
+    def close(self):
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
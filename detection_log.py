@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import mmap
+import time
+import glob
+import struct
+import argparse
+import collections
+
+import numpy as np
+
+from detection_batch import LabelTable
+
+# detection_app.py writes a log into this directory when it is set
+DETECTION_LOG_ENV = "PHOTOBOOTH_DETECTION_LOG"
+
+# One append-only file per session: the magic, then chunks of a header and
+# a payload. LABL chunks hold label names (a JSON list) for ids from the
+# header's count on. FRMS chunks hold count frames as columns of frame
+# number, time and number of detections, so a log can be replayed. DETS
+# chunks hold count detections as columns. Columns are padded to 8 bytes.
+# A chunk cut short by a crash is ignored when reading, and cut off when
+# the file is appended to again. Label ids are the file's own: a writer that
+# appends to a log maps its labels onto the names already in it.
+
+FILE_MAGIC = b"PBDLOG01"
+CHUNK_HEADER = struct.Struct("<4sIIII")  # kind, count, first frame, last frame, size
+LABELS_CHUNK = b"LABL"
+FRAMES_CHUNK = b"FRMS"
+DETECTIONS_CHUNK = b"DETS"
+
+FRAME_COLUMNS = (
+    ("frame_numbers", np.dtype("<u4"), ()),
+    ("frame_times", np.dtype("<f8"), ()),
+    ("frame_counts", np.dtype("<u2"), ()),
+)
+
+COLUMNS = (
+    ("frame", np.dtype("<u4"), ()),
+    ("timestamp", np.dtype("<f8"), ()),
+    ("label", np.dtype("<i2"), ()),
+    ("confidence", np.dtype("<f4"), ()),
+    ("bbox", np.dtype("<f4"), (4,)),
+)
+
+CHUNK_ROWS = 4096
+
+
+def column_bytes(dtype, shape, count):
+    size = count * dtype.itemsize * int(np.prod(shape, dtype=int))
+    return -(-size // 8) * 8
+
+
+def log_path(directory, session_id):
+    return os.path.join(directory, f"detections_{session_id}.dlog")
+
+
+class DetectionLogWriter:
+    """Buffers detections in column arrays and appends them a chunk at a time"""
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        names, end = self.existing_labels(path)
+        self.file_labels = LabelTable(names)
+        self.labels_written = len(names)
+        self.label_map = np.empty(0, dtype=np.int16)  # batch label id -> file id
+        self.mapped_labels = None
+
+        self.file = open(path, "ab")
+        self.file.truncate(end)
+        if end == 0:
+            # On disk at once, so a log stopped early is still one
+            self.file.write(FILE_MAGIC)
+            self.file.flush()
+        self.allocate(chunk_rows)
+        self.frame_columns = {
+            name: np.empty(chunk_rows, dtype=dtype) for name, dtype, _ in FRAME_COLUMNS
+        }
+        self.frames = 0
+        self.rows = 0
+        self.first_frame = None
+        self.last_frame = None
+
+    @staticmethod
+    def existing_labels(path):
+        """Label names in a log being appended to, and where its chunks end
+
+        A file that is not a detection log is renamed to .bad, never cut.
+        """
+        try:
+            if os.path.getsize(path) == 0:
+                return [], 0
+            log = read_detection_log(path)
+        except FileNotFoundError:
+            return [], 0
+        except ValueError as e:
+            print(f"Moving aside {path}: {e}")
+            os.replace(path, path + ".bad")
+            return [], 0
+        return log["labels"], log["end"]
+
+    def file_ids(self, labels, label_ids):
+        """A batch's label ids as the ids of this file"""
+        if labels is not self.mapped_labels:
+            self.mapped_labels = labels
+            self.label_map = np.empty(0, dtype=np.int16)
+        if len(self.label_map) < len(labels.names):
+            added = labels.names[len(self.label_map) :]
+            ids = [self.file_labels.id(name) for name in added]
+            self.label_map = np.concatenate(
+                [self.label_map, np.asarray(ids, dtype=np.int16)]
+            )
+        return self.label_map[label_ids]
+
+    def allocate(self, rows):
+        self.columns = {
+            name: np.empty((rows,) + shape, dtype=dtype)
+            for name, dtype, shape in COLUMNS
+        }
+
+    def append(self, frame, timestamp, batch):
+        """Add one frame's DetectionBatch; frames without detections count too"""
+        records = batch.records
+        count = len(records)
+        capacity = len(self.columns["frame"])
+        if self.rows + count > capacity or self.frames == len(self.frame_numbers):
+            # A frame's detections always stay together in one chunk
+            self.flush()
+            if count > capacity:
+                self.allocate(count)
+
+        self.frame_numbers[self.frames] = frame
+        self.frame_columns["frame_times"][self.frames] = timestamp
+        self.frame_columns["frame_counts"][self.frames] = count
+        self.frames += 1
+
+        if self.first_frame is None:
+            self.first_frame = frame
+        self.last_frame = frame
+
+        end = self.rows + count
+        self.columns["frame"][self.rows : end] = frame
+        self.columns["timestamp"][self.rows : end] = timestamp
+        self.columns["label"][self.rows : end] = self.file_ids(
+            batch.labels, records["label"]
+        )
+        self.columns["confidence"][self.rows : end] = records["confidence"]
+        self.columns["bbox"][self.rows : end] = records["bbox"]
+        self.rows = end
+
+    @property
+    def frame_numbers(self):
+        return self.frame_columns["frame_numbers"]
+
+    def write_columns(self, kind, count, columns, layout):
+        parts = []
+        for name, dtype, shape in layout:
+            data = columns[name][:count].tobytes()
+            padding = column_bytes(dtype, shape, count) - len(data)
+            parts.append(data + b"\0" * padding)
+        payload = b"".join(parts)
+        header = CHUNK_HEADER.pack(
+            kind, count, self.first_frame, self.last_frame, len(payload)
+        )
+        self.file.write(header + payload)
+
+    def flush(self):
+        """Write buffered frames and detections as chunks"""
+        if self.first_frame is None:
+            return
+
+        names = self.file_labels.names
+        if len(names) > self.labels_written:
+            payload = json.dumps(names[self.labels_written :]).encode("utf-8")
+            header = CHUNK_HEADER.pack(
+                LABELS_CHUNK, self.labels_written, 0, 0, len(payload)
+            )
+            self.file.write(header + payload)
+            self.labels_written = len(names)
+
+        self.write_columns(FRAMES_CHUNK, self.frames, self.frame_columns, FRAME_COLUMNS)
+        self.write_columns(DETECTIONS_CHUNK, self.rows, self.columns, COLUMNS)
+        self.file.flush()
+
+        self.frames = 0
+        self.rows = 0
+        self.first_frame = None
+        self.last_frame = None
+
+    def close(self):
+        if self.file:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+def read_detection_log(path):
+    """Load a session's log as NumPy arrays, mapped rather than read
+
+    Returns a dict of the columns in COLUMNS and FRAME_COLUMNS plus
+    "labels" (names by id), "frames" (frames covered, with or without
+    detections) and "end" (where the last complete chunk ends).
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(FILE_MAGIC):
+            raise ValueError(f"{path} is not a detection log")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[: len(FILE_MAGIC)] != FILE_MAGIC:
+        raise ValueError(f"{path} is not a detection log")
+
+    labels = []
+    chunks = {name: [] for name, _, _ in COLUMNS + FRAME_COLUMNS}
+    frames = 0  # spanned by DETS chunks, for logs from before FRMS chunks
+    frame_rows = None
+    offset = end = len(FILE_MAGIC)
+    while offset + CHUNK_HEADER.size <= size:
+        kind, count, first, last, length = CHUNK_HEADER.unpack_from(data, offset)
+        offset += CHUNK_HEADER.size
+        if offset + length > size:
+            break  # Cut short while being written
+
+        if kind == LABELS_CHUNK:
+            names = json.loads(data[offset : offset + length].decode("utf-8"))
+            labels[count:] = names
+        elif kind in (FRAMES_CHUNK, DETECTIONS_CHUNK):
+            layout = FRAME_COLUMNS if kind == FRAMES_CHUNK else COLUMNS
+            column_offset = offset
+            for name, dtype, shape in layout:
+                items = count * int(np.prod(shape, dtype=int))
+                column = np.frombuffer(
+                    data, dtype=dtype, count=items, offset=column_offset
+                )
+                chunks[name].append(column.reshape((count,) + shape))
+                column_offset += column_bytes(dtype, shape, count)
+            if kind == DETECTIONS_CHUNK:
+                frames += last - first + 1
+            else:
+                frame_rows = (frame_rows or 0) + count
+        offset += length
+        end = offset
+
+    result = {}
+    for name, dtype, shape in COLUMNS + FRAME_COLUMNS:
+        parts = chunks[name]
+        if len(parts) == 1:
+            result[name] = parts[0]
+        elif parts:
+            result[name] = np.concatenate(parts)
+        else:
+            result[name] = np.empty((0,) + shape, dtype=dtype)
+    result["labels"] = labels
+    # FRMS chunks hold every frame; DETS spans miss frames with no detections
+    # at the edges of a chunk
+    result["frames"] = frames if frame_rows is None else frame_rows
+    result["end"] = end
+    return result
+
+
+def summarize(paths):
+    """Prop frequency and detection density over many session logs"""
+    sessions = collections.Counter()
+    detections = collections.Counter()
+    total_frames = 0
+    total_rows = 0
+    read = 0
+    for path in paths:
+        try:
+            log = read_detection_log(path)
+        except ValueError as e:
+            # e.g. left empty by a stage stopped before it wrote anything
+            print(f"Skipping {path}: {e}")
+            continue
+        read += 1
+        total_frames += log["frames"]
+        total_rows += len(log["label"])
+        ids, counts = np.unique(log["label"], return_counts=True)
+        for label_id, count in zip(ids.tolist(), counts.tolist()):
+            name = log["labels"][label_id]
+            detections[name] += count
+            sessions[name] += 1
+    return {
+        "sessions": read,
+        "frames": total_frames,
+        "detections": total_rows,
+        "detections_per_frame": total_rows / total_frames if total_frames else 0.0,
+        "labels": {
+            name: {"detections": count, "sessions": sessions[name]}
+            for name, count in detections.most_common()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize detection logs")
+    parser.add_argument(
+        "paths", nargs="*", help="Log files (default: all in PHOTOBOOTH_DETECTION_LOG)"
+    )
+    args = parser.parse_args()
+
+    paths = args.paths
+    if not paths:
+        directory = os.environ.get(DETECTION_LOG_ENV, "data/detection_log")
+        paths = sorted(glob.glob(os.path.join(directory, "*.dlog")))
+    if not paths:
+        print("No detection logs found")
+        return 1
+
+    start = time.perf_counter()
+    summary = summarize(paths)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{summary['sessions']} sessions, {summary['frames']} frames, "
+        f"{summary['detections']} detections "
+        f"({summary['detections_per_frame']:.2f} per frame) in {elapsed:.2f}s"
+    )
+    for name, counts in summary["labels"].items():
+        print(
+            f"{name:<20} {counts['detections']:>10} detections "
+            f"in {counts['sessions']:>6} sessions"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# Header words: latest sequence number, slot count, frame height, width, channels
+HEADER_WORDS = 5
+ALIGN = 64
+
+
+def open_shared_memory(name):
+    """Attach to an existing segment without taking ownership of it
+
+    Before 3.13 attaching registers the segment with this process's
+    resource tracker, which would unlink it when the process exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class FrameRing:
+    """Fixed-size frames in shared memory with sequence numbers and timestamps
+
+    One writer fills slots round-robin; readers take NumPy views of the
+    newest slot without copying. A slot's sequence number is cleared while
+    it is being written, so a reader that copies or resizes a view calls
+    valid(seq) afterwards to check the writer did not lap it meanwhile, and
+    drops or retakes the frame if it did.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+
+        header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=shm.buf)
+        slots, height, width, channels = (int(v) for v in header[1:])
+        self.slots = slots
+        self.shape = (height, width, channels)
+
+        offset = header.nbytes
+        self.header = header
+        self.slot_seqs = np.ndarray(
+            (slots,), dtype=np.uint64, buffer=shm.buf, offset=offset
+        )
+        offset += self.slot_seqs.nbytes
+        self.timestamps = np.ndarray(
+            (slots,), dtype=np.float64, buffer=shm.buf, offset=offset
+        )
+        offset += self.timestamps.nbytes
+        offset = -(-offset // ALIGN) * ALIGN
+        self.data = np.ndarray(
+            (slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=offset
+        )
+
+    @staticmethod
+    def size_for(shape, slots):
+        header = (HEADER_WORDS + 2 * slots) * 8
+        return -(-header // ALIGN) * ALIGN + slots * int(np.prod(shape))
+
+    @classmethod
+    def create(cls, name, shape, slots=3):
+        """Create the segment; a stale one left by a crash is replaced"""
+        size = cls.size_for(shape, slots)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = open_shared_memory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = (0, slots) + tuple(shape)
+        ring = cls(shm, owner=True)
+        ring.slot_seqs[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        return cls(open_shared_memory(name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def latest_seq(self):
+        return int(self.header[0])
+
+    def begin_write(self):
+        """Claim the next slot; returns (seq, writable view)"""
+        seq = self.latest_seq + 1
+        index = seq % self.slots
+        self.slot_seqs[index] = 0
+        return seq, self.data[index]
+
+    def commit(self, seq, timestamp=None):
+        """Publish a slot filled after begin_write()"""
+        index = seq % self.slots
+        self.timestamps[index] = time.time() if timestamp is None else timestamp
+        self.slot_seqs[index] = seq
+        self.header[0] = seq
+
+    def write(self, frame, timestamp=None):
+        seq, slot = self.begin_write()
+        np.copyto(slot, frame)
+        self.commit(seq, timestamp)
+        return seq
+
+    def valid(self, seq):
+        """True while the frame published as seq is still in its slot"""
+        return seq > 0 and int(self.slot_seqs[seq % self.slots]) == seq
+
+    def nearest(self, timestamp, count=1, max_gap=None):
+        """seqs of the count held frames taken nearest timestamp, oldest first
+
+        With max_gap, frames further than that from timestamp do not count.
+        """
+        held = []
+        for index in range(self.slots):
+            seq = int(self.slot_seqs[index])
+            gap = abs(float(self.timestamps[index]) - timestamp)
+            if seq and (max_gap is None or gap <= max_gap):
+                held.append((gap, seq))
+        return sorted(seq for _, seq in sorted(held)[:count])
+
+    def count_after(self, timestamp):
+        """How many held frames were taken at or after timestamp"""
+        held = self.slot_seqs > 0
+        return int(np.count_nonzero(held & (self.timestamps >= timestamp)))
+
+    def read(self, seq, copy=False):
+        """(timestamp, frame) for seq, or None once it has been overwritten"""
+        index = seq % self.slots
+        if not self.valid(seq):
+            return None
+        timestamp = float(self.timestamps[index])
+        frame = self.data[index]
+        if copy:
+            frame = frame.copy()
+            if not self.valid(seq):
+                return None
+        return timestamp, frame
+
+    def latest(self, copy=False):
+        """(seq, timestamp, frame) for the newest frame, or None if empty"""
+        for _ in range(self.slots):
+            seq = self.latest_seq
+            if seq == 0:
+                return None
+            result = self.read(seq, copy)
+            if result:
+                return (seq,) + result
+        return None
+
+    def close(self):
+        # Views must go before the mapping can be closed
+        self.header = self.slot_seqs = self.timestamps = self.data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            print(f"Frame ring {self.name}: views still in use, leaving it mapped")
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
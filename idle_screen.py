@@ -2,70 +2,66 @@ import pygame
 import sys
 import os
 
-# Initialize pygame
-pygame.init()
-
-# Get screen info for fullscreen
-screen_info = pygame.display.Info()
-SCREEN_WIDTH = screen_info.current_w
-SCREEN_HEIGHT = screen_info.current_h
+from scene_host import Scene, SceneHost
 
 # Colors
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 
-# Fullscreen display
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.FULLSCREEN)
-pygame.display.set_caption("Photobooth")
 
-# Font setup
-font_path = pygame.font.get_default_font()  # Default font
-try:
-    # Try to use a nicer font if available
-    font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-    if not os.path.exists(font_path):
-        font_path = pygame.font.get_default_font()
-except:
-    pass
+def load_font_path():
+    """Use a nicer font if available, otherwise pygame's default"""
+    font_path = pygame.font.get_default_font()  # Default font
+    try:
+        # Try to use a nicer font if available
+        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+        if not os.path.exists(font_path):
+            font_path = pygame.font.get_default_font()
+    except:
+        pass
+    return font_path
 
-# Create fonts of different sizes
-large_font = pygame.font.Font(font_path, 120)
-small_font = pygame.font.Font(font_path, 40)
 
-def main():
-    clock = pygame.time.Clock()
-    running = True
-    
-    # Main loop
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    running = False
-        
+class IdleScene(Scene):
+    """Attract screen shown while waiting for motion"""
+
+    def enter(self, host):
+        super().enter(host)
+        font_path = load_font_path()
+
+        # Create fonts of different sizes
+        self.large_font = pygame.font.Font(font_path, 120)
+        self.small_font = pygame.font.Font(font_path, 40)
+
+        # Text never changes, so render it once
+        self.title_text = self.large_font.render("PHOTOBOOTH", True, WHITE)
+        self.instr_text = self.small_font.render(
+            "Stand in front of the camera to begin", True, WHITE
+        )
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            self.finish("quit")
+
+    def draw(self, screen):
+        width, height = screen.get_size()
+
         # Clear screen
         screen.fill(BLACK)
-        
+
         # Render "PHOTOBOOTH" text
-        title_text = large_font.render("PHOTOBOOTH", True, WHITE)
-        title_rect = title_text.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT//2 - 50))
-        screen.blit(title_text, title_rect)
-        
+        title_rect = self.title_text.get_rect(center=(width // 2, height // 2 - 50))
+        screen.blit(self.title_text, title_rect)
+
         # Render instruction text
-        instr_text = small_font.render("Stand in front of the camera to begin", True, WHITE)
-        instr_rect = instr_text.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT//2 + 100))
-        screen.blit(instr_text, instr_rect)
-        
-        # Update display
-        pygame.display.flip()
-        clock.tick(30)
-    
-    # Clean up
-    pygame.quit()
+        instr_rect = self.instr_text.get_rect(center=(width // 2, height // 2 + 100))
+        screen.blit(self.instr_text, instr_rect)
+
+
+def main():
+    SceneHost(fullscreen=True, caption="Photobooth").run_scene(IdleScene())
     sys.exit()
 
+
 if __name__ == "__main__":
     main()
-
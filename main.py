@@ -1,15 +1,29 @@
 #!/usr/bin/env python3
 import RPi.GPIO as GPIO
-import time
-import subprocess
+import asyncio
 import os
 import signal
 import sys
 import threading
+import time
 import json
 import datetime
 import shutil
 import glob
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import stage_ipc
+import metrics
+from session_store import SessionStore
+from snapshot_index import SnapshotIndex, parse_session_id
+from zygote import ZygoteClient
+from camera_broker import CameraClient, CAMERA_SOCKET_ENV
+from detection_control import DetectionControl, DETECTION_SOCKET_ENV
+from scene_host import SceneHost
+from idle_screen import IdleScene
+from photo_preview import ReviewScene
+from snapshot_writer import WRITER
 
 # GPIO Configuration
 PIR_PIN = 23
@@ -23,30 +37,91 @@ DETECTION = "detect"
 PHOTO = "photo"
 REVIEW = "review"
 
+# Seconds of countdown before the snapshot
+COUNTDOWN = 5
+
+# How often latency histograms are written to data/metrics.json
+METRICS_INTERVAL = 60
+
+# Input events and the states they mean something in. Anything else is
+# dropped when dequeued, and a repeat of one still waiting in the queue is
+# merged into it, so a burst of edges acts once.
+INPUT_EVENT_STATES = {
+    "motion": (IDLE,),
+    "motion_confirm": (IDLE,),
+    "skip": (IDLE,),
+    "button": (DETECTION,),
+}
+
+# The PIR must still read high this long after its edge
+MOTION_CONFIRM_DELAY = 0.5
+
+DETECTION_COMMAND = ["python3", "detection_app.py", "-i", "rpi"]
+
+
+def install_child_watcher(loop):
+    """Use pidfds to reap children instead of one waiter thread per child
+
+    Python 3.12+ already does this by default.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+        return
+    try:
+        watcher = asyncio.PidfdChildWatcher()
+        asyncio.set_child_watcher(watcher)
+        watcher.attach_loop(loop)
+    except Exception as e:
+        print(f"Falling back to the default child watcher: {e}")
+
 
 class PhotoboothSystem:
+    """Session state machine driven by a single asyncio event loop
+
+    Everything that changes state (GPIO edges, console keys, scene results,
+    stage output and stage exits) arrives as an event on one queue and is
+    handled in order on the loop thread.
+    """
+
     def __init__(self):
-        self.current_state = IDLE
+        self.state = IDLE
+        self.state_since = time.monotonic()
+        self.event_time = time.monotonic()
+        self.pending_inputs = set()
+        self.motion_confirm_pending = False
         self.ui_process = None
         self.detection_process = None
-        self.photo_process = None
-        self.review_process = None
+        self.detection_service = None  # warm detection shared by sessions
+        self.detection_control = None
+        self.detection_session = False
+        self.exiting = {}  # stage told to stop -> task reaping it
+        self.camera_stages = set()  # stages that opened the camera themselves
+        self.photo_capture = None
+        self.snapshot_saved = None  # Future of the snapshot file being written
+        self.saving = set()  # tasks saving finished sessions
+        self.watchers = set()  # tasks following stage output until they exit
         self.session_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.skip_key_pressed = False
-
-        # Initialize session data
-        self.session_data = {
-            "story_id": None,
-            "users": {"names": [], "detected_props": [], "appearance": ""},
-            "timestamp": "",
-            "image_path": "",
-            "cache_image_path": "",
-        }
+        self.zygote = None
+        self.camera = None
+
+        # Authoritative session data; stages push updates into it
+        self.session = SessionStore()
+        self.session.recover()
+
+        # Event loop that owns the state machine
+        self.loop = asyncio.new_event_loop()
+        self.events = None
+        self.ready = threading.Event()
+        self.loop_thread = None
+
+        # Small fixed pool for blocking camera calls
+        self.blocking_pool = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="photobooth-io"
+        )
 
         # Create directories
         os.makedirs("cache", exist_ok=True)
-        os.makedirs("data", exist_ok=True)
         os.makedirs("snapshots", exist_ok=True)
+        self.snapshots = SnapshotIndex("snapshots")
 
         try:
             # Setup GPIO
@@ -67,485 +142,644 @@ class PhotoboothSystem:
             print(f"GPIO setup error (this is normal on non-RPi systems): {e}")
             print("Continuing in keyboard-control mode.")
 
-        print("Photobooth system initialized.")
-        print("Displaying idle screen. Press 's' to skip PIR and go to user input")
-        self.start_idle_screen()
+        # Start the fork server so stages don't pay for interpreter startup
+        if os.environ.get("PHOTOBOOTH_ZYGOTE", "1") != "0":
+            try:
+                self.zygote = ZygoteClient()
+                self.zygote.start()
+            except Exception as e:
+                print(f"Zygote unavailable, stages will start as subprocesses: {e}")
+                self.zygote = None
 
-        # Start key press monitoring thread
-        threading.Thread(target=self.monitor_skip_key, daemon=True).start()
+        # Keep the camera open for the whole run; detection and capture
+        # borrow it instead of reopening the sensor each session
+        if os.environ.get("PHOTOBOOTH_CAMERA_BROKER", "1") != "0":
+            try:
+                self.camera = CameraClient()
+                backend = os.environ.get("PHOTOBOOTH_CAMERA", "picamera")
+                self.camera.start(backend=backend)
+            except Exception as e:
+                print(f"Camera broker unavailable, stages will open the camera: {e}")
+                self.camera = None
 
-    def monitor_skip_key(self):
-        """Monitor for 's' key press to skip PIR motion detection"""
+        # One persistent display; idle, countdown and review are scenes on it
+        self.scene_host = SceneHost(fullscreen=True, caption="Photobooth")
         try:
-            # First try to import getch for non-blocking keyboard input
-            try:
-                import getch
-
-                has_getch = True
-            except ImportError:
-                has_getch = False
-
-            print("Key monitoring active. Press 's' to skip to user input.")
-            while self.current_state == IDLE:
-                if has_getch:
-                    # Non-blocking method
-                    if getch.kbhit():  # Check if a key is pressed
-                        key = getch.getch()
-                        if key.lower() == "s":
-                            print("Skip key pressed, going to user input")
-                            self.skip_key_pressed = True
-                            self.transition_to_user_input()
-                else:
-                    # Fallback to input() method (will block until Enter is pressed)
-                    threading.Thread(
-                        target=self.alternate_key_monitor, daemon=True
-                    ).start()
-                    break  # Exit this loop since we're using the alternate method
-
-                time.sleep(0.1)
+            self.scene_host.start()
         except Exception as e:
-            print(f"Error in key monitoring: {e}")
-            # Fall back to alternate method
-            threading.Thread(target=self.alternate_key_monitor, daemon=True).start()
-
-    def alternate_key_monitor(self):
-        """Alternative method to monitor for 's' key if getch is not available"""
-        print("Key monitoring active. Press 's' and Enter to skip to user input.")
-        while self.current_state == IDLE:
-            try:
-                key = input("")
-                if key.lower() == "s":
-                    print("Skip key pressed, going to user input")
-                    self.skip_key_pressed = True
-                    self.transition_to_user_input()
-            except Exception:
-                pass
-            time.sleep(0.1)
+            # Nothing works without a screen; stop what was started
+            print(f"Display unavailable: {e}")
+            self.cleanup()
+            raise
 
-    def start_idle_screen(self):
-        """Display the idle screen"""
-        self.stop_all_processes()
+        print("Photobooth system initialized.")
+        print("Displaying idle screen. Press 's' to skip PIR and go to user input")
 
-        try:
-            self.ui_process = subprocess.Popen(
-                ["python3", "idle_screen.py"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-            )
-            self.current_state = IDLE
-            print("Idle screen started. Waiting for motion...")
+        self.loop_thread = threading.Thread(
+            target=self.run_loop, name="photobooth-loop", daemon=True
+        )
+        self.loop_thread.start()
+        self.ready.wait(timeout=10)
+
+    @property
+    def current_state(self):
+        return self.state
+
+    @current_state.setter
+    def current_state(self, state):
+        """Every state change records how long the previous state lasted"""
+        now = time.monotonic()
+        if state != self.state:
+            metrics.REGISTRY.observe(f"state.{self.state}", now - self.state_since)
+            self.state_since = now
+            if state == USER_INPUT:
+                metrics.REGISTRY.end("motion", "motion_to_user_input", at=now)
+            elif state == DETECTION:
+                metrics.REGISTRY.end("review_decision", "review_to_detection", at=now)
+        self.state = state
+
+    def run_loop(self):
+        """Run the event loop until cleanup stops it"""
+        asyncio.set_event_loop(self.loop)
+        install_child_watcher(self.loop)
+        self.loop.run_until_complete(self.run())
+
+    async def run(self):
+        """Dispatch queued events one at a time"""
+        self.events = asyncio.Queue()
+        self.ready.set()
+
+        await self.start_idle_screen()
+        await self.start_detection_service()
+        # Snapshot workers load OpenCV now rather than at the first shutter
+        await self.run_blocking(WRITER.start)
+        metrics_task = asyncio.create_task(self.write_metrics_periodically())
 
-            # Monitor idle screen output
-            threading.Thread(target=self.monitor_idle_screen, daemon=True).start()
-        except FileNotFoundError:
-            print("Warning: idle_screen.py not found. Continuing without idle screen.")
-            self.current_state = IDLE
+        while True:
+            kind, data, self.event_time = await self.events.get()
+            self.pending_inputs.discard(kind)
+            if kind == "shutdown":
+                break
 
-    def monitor_idle_screen(self):
-        """Monitor idle screen process for any output"""
-        if not self.ui_process:
+            states = INPUT_EVENT_STATES.get(kind)
+            if states and self.current_state not in states:
+                metrics.REGISTRY.count(f"filtered.{kind}")
+                continue
+
+            # Time from the edge (or message) to its handler starting
+            start = time.monotonic()
+            waited = start - self.event_time
+            metrics.REGISTRY.observe(f"event_to_action.{kind}", waited)
+            try:
+                await self.handle_event(kind, data)
+            except Exception as e:
+                print(f"Error handling {kind} event: {e}")
+            metrics.REGISTRY.observe(f"event.{kind}", time.monotonic() - start)
+
+        metrics_task.cancel()
+        await self.shutdown()
+
+    def post_event(self, kind, **data):
+        """Queue an event from any thread, stamped with when it happened"""
+        if self.events is None or self.loop.is_closed():
             return
+        event = (kind, data, time.monotonic())
+        self.loop.call_soon_threadsafe(self.enqueue_event, event)
+
+    def enqueue_event(self, event):
+        """Queue an event on the loop thread, merging repeated input events"""
+        kind = event[0]
+        if kind in INPUT_EVENT_STATES:
+            if kind in self.pending_inputs:
+                metrics.REGISTRY.count(f"coalesced.{kind}")
+                return
+            self.pending_inputs.add(kind)
+        self.events.put_nowait(event)
+        metrics.REGISTRY.gauge("event_queue_depth", self.events.qsize())
+
+    async def write_metrics_periodically(self):
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            await self.run_blocking(self.write_metrics)
 
+    def write_metrics(self):
         try:
-            self.read_process_output(self.ui_process.stdout, "IDLE")
-            self.read_process_output(self.ui_process.stderr, "IDLE ERROR")
+            metrics.REGISTRY.write()
         except Exception as e:
-            print(f"Error monitoring idle screen: {e}")
-
+            print(f"Error writing metrics: {e}")
+
+    async def handle_event(self, kind, data):
+        """Apply one event to the state machine"""
+        if kind == "motion":
+            self.handle_motion()
+        elif kind == "motion_confirm":
+            await self.confirm_motion(data["motion_at"])
+        elif kind == "skip":
+            print("Skip key pressed, going to user input")
+            metrics.REGISTRY.mark("motion", self.event_time)
+            await self.transition_to_user_input()
+        elif kind == "button":
+            await self.handle_button(
+                data.get("simulated", False), data.get("released", False)
+            )
+        elif kind == stage_ipc.USER_DATA:
+            await self.handle_user_data(data["user_data"])
+        elif kind == stage_ipc.DETECTIONS:
+            self.handle_detections(data)
+        elif kind in (stage_ipc.SNAPSHOT_READY, stage_ipc.CACHE_READY):
+            self.handle_image_ready(kind, data["path"], data.get("renditions"))
+        elif kind == stage_ipc.PREVIEW_RESULT:
+            await self.finish_review(data["result"])
+        elif kind == "photo_done":
+            await self.finish_photo_capture(data["snapshot_path"])
+        elif kind == "review_result":
+            await self.finish_review(data["result"])
+        elif kind == "process_exit":
+            await self.handle_process_exit(data["name"], data["process"])
+        elif kind == stage_ipc.METRICS:
+            if "count" in data:
+                metrics.REGISTRY.count(data["name"], data["count"])
+            else:
+                metrics.REGISTRY.observe(data["name"], data["seconds"])
+
+    # GPIO callbacks run on the RPi.GPIO thread; they only queue events
     def motion_detected(self, channel):
         """Callback when motion is detected"""
-        if self.current_state == IDLE and not self.skip_key_pressed:
-            print("Motion detected! Starting user input screen...")
-            time.sleep(0.5)
-            try:
-                if GPIO.input(PIR_PIN):
-                    self.transition_to_user_input()
-            except Exception:
-                # If GPIO error, just proceed anyway
-                self.transition_to_user_input()
+        self.post_event("motion")
 
     def button_pressed(self, channel):
         """Callback when button is pressed"""
-        if self.current_state == DETECTION:
-            print("Snapshot button pressed! Starting photo capture...")
-            try:
-                if not GPIO.input(BUTTON_PIN):
-                    # Stop detection process
-                    self.stop_process(self.detection_process)
-                    self.detection_process = None
-
-                    # Turn on LED
-                    try:
-                        GPIO.output(LED_PIN, GPIO.HIGH)
-                    except Exception:
-                        pass  # Ignore GPIO errors
-
-                    # Start photo capture
-                    self.start_photo_capture()
-            except Exception:
-                # If GPIO error, just proceed anyway
-                self.stop_process(self.detection_process)
-                self.detection_process = None
-                self.start_photo_capture()
-
-    def start_photo_capture(self):
-        """Start photo capture with countdown"""
-        self.current_state = PHOTO
+        # Read now: by the time the loop gets to the event a short press
+        # is over, and a high pin then would look like a bounce
+        try:
+            released = bool(GPIO.input(BUTTON_PIN))
+        except Exception:
+            released = False  # If GPIO error, just proceed anyway
+        self.post_event("button", released=released)
 
-        # Generate temp file path for user data
-        data_json_path = os.path.join("data", f"temp_user_data_{self.session_id}.json")
+    def handle_motion(self):
+        """Recheck the PIR shortly, without holding up other events"""
+        if self.motion_confirm_pending:
+            metrics.REGISTRY.count("coalesced.motion")
+            return
 
-        # Save current session data to temp file
-        with open(data_json_path, "w") as f:
-            json.dump(self.session_data, f, indent=2)
-
-        # Start photo capture process
-        cmd = [
-            "python3",
-            "photo_capture.py",
-            "--fullscreen",
-            "--countdown",
-            "5",
-            "--json-id",
-            self.session_id,
-        ]
-
-        # Add cache path if available
-        if self.session_data.get("cache_image_path"):
-            cmd.extend(["--cache-path", self.session_data["cache_image_path"]])
-
-        print(f"Starting photo capture with command: {' '.join(cmd)}")
-
-        # Run photo capture app
-        self.photo_process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
+        print("Motion detected! Checking that it persists...")
+        self.motion_confirm_pending = True
+        self.loop.call_later(
+            MOTION_CONFIRM_DELAY, self.queue_motion_confirm, self.event_time
         )
 
-        # Monitor photo capture
-        threading.Thread(target=self.monitor_photo_process).start()
+    def queue_motion_confirm(self, motion_at):
+        self.motion_confirm_pending = False
+        data = {"motion_at": motion_at}
+        self.enqueue_event(("motion_confirm", data, time.monotonic()))
+
+    async def confirm_motion(self, motion_at):
+        """Start a session if motion persists while idle"""
+        try:
+            if not GPIO.input(PIR_PIN):
+                return
+        except Exception:
+            pass  # If GPIO error, just proceed anyway
+
+        print("Motion confirmed! Starting user input screen...")
+        metrics.REGISTRY.mark("motion", motion_at)
+        await self.transition_to_user_input()
+
+    async def handle_button(self, simulated=False, released=False):
+        """Take the photo when the button is pressed during detection
 
-    def monitor_photo_process(self):
-        """Monitor the photo capture process"""
-        if not self.photo_process:
+        released is the pin level read when the edge was seen; a button
+        already up again then was a bounce.
+        """
+        if simulated:
+            print("Simulating button press")
+        elif released:
             return
 
+        print("Snapshot button pressed! Starting photo capture...")
+        metrics.REGISTRY.mark("button", self.event_time)
+
+        # Stop detection; only wait for it if it has the camera itself
+        await self.end_detection_session(wait=False)
+        self.retire_process(self.detection_process)
+        self.detection_process = None
+        await self.wait_for_camera()
+
+        # Turn on LED
         try:
-            # Process stdout and stderr
-            stdout_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.photo_process.stdout, "PHOTO"),
-                daemon=True,
-            )
-            stderr_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.photo_process.stderr, "PHOTO ERROR"),
-                daemon=True,
-            )
+            GPIO.output(LED_PIN, GPIO.HIGH)
+        except Exception:
+            pass  # Ignore GPIO errors
+
+        # Start photo capture
+        await self.start_photo_capture()
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call on the I/O pool without stalling the loop"""
+        return await self.loop.run_in_executor(self.blocking_pool, func, *args)
+
+    async def spawn_stage(self, cmd, env=None):
+        """Start a stage script with a control channel
+
+        The stage is forked from the zygote when it is running. Returns the
+        process and a StreamReader for the stage's control messages.
+        """
+        if not os.path.exists(cmd[1]):
+            raise FileNotFoundError(cmd[1])
+
+        env = dict(os.environ if env is None else env)
+        ipc_read, ipc_write = stage_ipc.create_channel()
+        try:
+            process = None
+            if self.zygote and self.zygote.alive():
+                try:
+                    process = await self.zygote.spawn_async(
+                        cmd, env=env, fd_env={stage_ipc.IPC_FD_ENV: ipc_write}
+                    )
+                except Exception as e:
+                    print(f"Zygote spawn failed, starting a subprocess instead: {e}")
+
+            if process is None:
+                env[stage_ipc.IPC_FD_ENV] = str(ipc_write)
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    env=env,
+                    pass_fds=(ipc_write,),
+                )
+        except BaseException:
+            os.close(ipc_read)
+            raise
+        finally:
+            # Only the stage keeps the write end, so EOF means it exited
+            os.close(ipc_write)
+
+        messages = await stage_ipc.open_pipe_reader(ipc_read)
+        return process, messages
+
+    def watch_process(self, name, process, messages, prefix):
+        """Log a stage's output, handle its messages and report its exit"""
+
+        async def watch():
+            try:
+                await asyncio.gather(
+                    self.read_process_output(process.stdout, prefix),
+                    self.read_process_output(process.stderr, f"{prefix} ERROR"),
+                    self.read_stage_messages(name, messages),
+                )
+                await process.wait()
+            except Exception as e:
+                print(f"Error monitoring {name}: {e}")
+            self.post_event("process_exit", name=name, process=process)
+
+        task = asyncio.ensure_future(watch())
+        self.watchers.add(task)
+        task.add_done_callback(self.watchers.discard)
+        return task
+
+    async def read_stage_messages(self, name, messages):
+        """Turn control channel messages into state machine events"""
+        async for message in stage_ipc.read_messages(messages):
+            message_type = message.pop("type")
+            if message_type != stage_ipc.METRICS:
+                print(f"{name} -> {message_type}")
+            self.post_event(message_type, **message)
+
+    async def handle_process_exit(self, name, process):
+        """React to a stage exiting on its own"""
+        if name == "ui" and process is self.ui_process:
+            self.ui_process = None
+            # If we get here and still in USER_INPUT state, no data was received
+            if self.current_state == USER_INPUT:
+                print("UI process ended without providing user data")
+                await self.start_idle_screen()
+        elif name == "detection" and process is self.detection_process:
+            self.detection_process = None
+            # If we get here and still in detection state, restart
+            if self.current_state == DETECTION:
+                print("Detection process ended, restarting...")
+                await self.transition_to_detection()
+        elif name == "detection_service" and process is self.detection_service:
+            self.detection_service = None
+            self.detection_session = False
+            if self.current_state == DETECTION:
+                print("Detection service ended, restarting...")
+                await self.transition_to_detection()
 
-            stdout_thread.start()
-            stderr_thread.start()
+    async def start_idle_screen(self):
+        """Display the idle screen"""
+        await self.end_detection_session()
+        self.retire_all_processes()
 
-            # Wait for process to complete
-            self.photo_process.wait()
+        scene = IdleScene()
+        scene.on_shown = lambda at: metrics.REGISTRY.end(
+            "review_decision", "review_to_idle", at=at
+        )
+        self.scene_host.show(scene)
+        self.current_state = IDLE
+        print("Idle screen started. Waiting for motion...")
 
-            # After photo capture is complete, update data and transition to review
-            self.update_session_data_from_json()
-            self.transition_to_snapshot_review()
+    async def start_photo_capture(self):
+        """Start photo capture with countdown"""
+        self.current_state = PHOTO
 
+        # Imported on first use: it loads picamera2, cv2 and the shot
+        # scorer's cascades, which this process needs only to take a photo
+        capture = await self.run_blocking(importlib.import_module, "photo_capture")
+
+        # Open the camera before the countdown so the shot is on time
+        self.photo_capture = capture.PhotoCapture(
+            json_id=self.session_id,
+            cache_path=self.session.get("cache_image_path"),
+            write_json=False,
+            camera=self.camera if self.camera_broker_running() else None,
+            on_image_ready=lambda kind, path, **details: self.post_event(
+                kind, path=path, **details
+            ),
+        )
+        if not await self.run_blocking(self.photo_capture.init_camera):
+            print("Failed to initialize camera")
+            await self.finish_photo_capture(None)
+            return
+
+        print("Starting photo capture countdown")
+        scene = capture.CountdownScene(
+            self.photo_capture,
+            countdown=COUNTDOWN,
+            on_finish=lambda path: self.post_event("photo_done", snapshot_path=path),
+        )
+        scene.on_shown = lambda at: metrics.REGISTRY.end(
+            "button", "button_to_countdown", at=at, keep=True
+        )
+        self.scene_host.show(scene)
+
+    async def finish_photo_capture(self, snapshot_path):
+        """Release the camera and move on to the review"""
+        try:
+            capture = self.photo_capture
+            if capture:
+                self.handle_image_ready(stage_ipc.CACHE_READY, capture.cache_path)
+                if capture.shutter_time:
+                    shutter = capture.shutter_time
+                    metrics.REGISTRY.end("button", "button_to_shutter", at=shutter)
+                    metrics.REGISTRY.mark("shutter", shutter)
+            # The frame is still in memory and may not be on disk yet; review
+            # shows it directly while it is saved
+            frame = capture.snapshot_frame() if capture and snapshot_path else None
+            self.snapshot_saved = capture.saved if capture and snapshot_path else None
+            if frame is None and self.snapshot_saved:
+                # Overwritten in the ring already; review loads the JPEG
+                await self.run_blocking(capture.wait_saved)
+            await self.release_photo_capture()
+
+            # After photo capture is complete, transition to review
+            if self.current_state == PHOTO:
+                await self.transition_to_snapshot_review(frame, snapshot_path)
         except Exception as e:
             print(f"Error in photo capture: {e}")
         finally:
-            self.stop_process(self.photo_process)
-            self.photo_process = None
             try:
                 GPIO.output(LED_PIN, GPIO.LOW)
             except Exception:
                 pass  # Ignore GPIO errors
 
-    def read_process_output(self, stream, prefix):
-        """Read and log process output"""
+    async def release_photo_capture(self):
+        """Close the camera used by the countdown, if open"""
+        if self.photo_capture:
+            capture = self.photo_capture
+            self.photo_capture = None
+            await self.run_blocking(capture.cleanup)
+
+    async def read_process_output(self, stream, prefix):
+        """Log process output; results arrive on the control channel"""
         if not stream:
             return
 
         try:
-            for line in stream:
-                line = line.strip()
+            async for raw in stream:
+                line = raw.decode("utf-8", errors="replace").strip()
                 if line:
                     print(f"{prefix}: {line}")
 
-                    # Parse important output from photo_capture
-                    if "Final snapshot saved to" in line:
-                        path = line.split("to", 1)[1].strip()
-                        if os.path.exists(path):
-                            self.session_data["image_path"] = path
-                            print(f"Updated session with image path: {path}")
-                    elif "Cache image saved to" in line:
-                        path = line.split("to", 1)[1].strip()
-                        if os.path.exists(path):
-                            self.session_data["cache_image_path"] = path
-                            print(f"Updated session with cache path: {path}")
-                    # Parse important output from review
-                    elif line.startswith("PREVIEW_RESULT:"):
-                        result = line.split(":", 1)[1]
-                        print(f"Got preview result: {result}")
-                        if result == "continue":
-                            # Save and continue
-                            self.save_session_data()
-                            self.start_idle_screen()
-                        elif result == "try_again":
-                            # Try again
-                            self.transition_to_detection()
-                    # Parse user data from user input
-                    elif line.startswith("USER_DATA:"):
+                    # Legacy: user_input_app.py predates the control channel
+                    # and still prints its result. Other stages use stage_ipc.
+                    if prefix == "UI" and line.startswith("USER_DATA:"):
                         try:
                             data_json = line[len("USER_DATA:") :]
                             user_data = json.loads(data_json)
-                            print(f"User data received: {user_data}")
-
-                            # Update session data
-                            self.session_data["story_id"] = user_data.get("STORY_ID")
-
-                            # Extract names
-                            names = []
-                            for key in [
-                                "NAME_A",
-                                "NAME_B",
-                                "NAME_C",
-                                "NAME_D",
-                                "NAME_E",
-                            ]:
-                                if key in user_data and user_data[key].strip():
-                                    names.append(user_data[key])
-
-                            self.session_data["users"]["names"] = names
-
-                            # Save to JSON file for other components
-                            data_json_path = os.path.join(
-                                "data", f"temp_user_data_{self.session_id}.json"
-                            )
-                            with open(data_json_path, "w") as f:
-                                json.dump(self.session_data, f, indent=2)
-                            print(f"User data saved to: {data_json_path}")
-
-                            # Go to detection state
-                            self.transition_to_detection()
+                            self.post_event(stage_ipc.USER_DATA, user_data=user_data)
                         except json.JSONDecodeError as e:
                             print(f"Error parsing user data: {e}")
         except Exception as e:
             print(f"Error reading output: {e}")
 
-    def update_session_data_from_json(self):
-        """Update session data from latest JSON files"""
-        try:
-            # Find JSON files for this session
-            json_files = glob.glob(os.path.join("data", f"*{self.session_id}*.json"))
-
-            if json_files:
-                # Get the most recent file
-                latest_file = sorted(json_files)[-1]
-                print(f"Loading session data from {latest_file}")
-
-                with open(latest_file, "r") as f:
-                    data = json.load(f)
-
-                # Update our session data with new information
-                for key in ["image_path", "cache_image_path"]:
-                    if key in data and data[key]:
-                        self.session_data[key] = data[key]
-                        print(f"Updated {key} to: {data[key]}")
-
-                # Update props if available
-                if "users" in data and "detected_props" in data["users"]:
-                    self.session_data["users"]["detected_props"] = data["users"][
-                        "detected_props"
-                    ]
-                    print(
-                        f"Updated detected_props to: {data['users']['detected_props']}"
-                    )
+    async def handle_user_data(self, user_data):
+        """Store the names and story chosen on the user input screen"""
+        if self.current_state != USER_INPUT:
+            return
 
-                # Update story_id if needed
-                if (
-                    "story_id" in data
-                    and data["story_id"]
-                    and not self.session_data["story_id"]
-                ):
-                    self.session_data["story_id"] = data["story_id"]
-                    print(f"Updated story_id to: {data['story_id']}")
-        except Exception as e:
-            print(f"Error updating session data from JSON: {e}")
+        print(f"User data received: {user_data}")
+
+        # Extract names
+        names = []
+        for key in ["NAME_A", "NAME_B", "NAME_C", "NAME_D", "NAME_E"]:
+            if key in user_data and user_data[key].strip():
+                names.append(user_data[key])
+
+        # Update session data
+        self.session.update(
+            {"story_id": user_data.get("STORY_ID"), "users.names": names}
+        )
+
+        # Stages started later read the user data from this file
+        data_json_path = os.path.join("data", f"temp_user_data_{self.session_id}.json")
+        with open(data_json_path, "w") as f:
+            json.dump(self.session.snapshot(), f, indent=2)
+        print(f"User data saved to: {data_json_path}")
+
+        # Go to detection state
+        await self.transition_to_detection()
+
+    def handle_detections(self, data):
+        """Keep the latest props reported by the detection stage"""
+        props = data.get("detected_props")
+        if props and data.get("json_id") == self.session_id:
+            if self.session.update({"users.detected_props": props}):
+                print(f"Updated detected_props to: {props}")
+
+    def handle_image_ready(self, kind, path, renditions=None, session=None):
+        """Record a snapshot or cache image written by a stage"""
+        session = session or self.session
+        if not path or not os.path.exists(path):
+            return
+        if kind == stage_ipc.SNAPSHOT_READY:
+            # A session saved in the background records its own snapshot
+            owner = parse_session_id(os.path.basename(path))
+            if owner and owner != session.session_id:
+                return
+        key = "image_path" if kind == stage_ipc.SNAPSHOT_READY else "cache_image_path"
+        if session.update({key: path}):
+            print(f"Updated session with {key}: {path}")
+        if renditions:
+            renditions = {
+                name: rendition
+                for name, rendition in renditions.items()
+                if os.path.exists(rendition)
+            }
+            if session.update({"renditions": renditions}):
+                print(f"Updated session with renditions: {', '.join(renditions)}")
 
-    def transition_to_snapshot_review(self):
+    async def transition_to_snapshot_review(self, frame=None, snapshot_path=None):
         """Transition to reviewing the snapshot"""
         print("Transitioning to snapshot review...")
         self.current_state = REVIEW
 
-        # Update from JSON files first
-        self.update_session_data_from_json()
+        # The snapshot just taken: from memory while it is saved, else its file
+        if snapshot_path and (frame is not None or os.path.exists(snapshot_path)):
+            self.show_review_screen(snapshot_path, frame)
+            return
 
         # Check if we have a snapshot to review
-        if not self.session_data.get("image_path") or not os.path.exists(
-            self.session_data["image_path"]
-        ):
+        image_path = self.session.get("image_path")
+        if not image_path or not os.path.exists(image_path):
             print("No valid snapshot found, looking for latest snapshot")
             self.find_latest_snapshot()
+            image_path = self.session.get("image_path")
+            frame = None
 
         # Now check again
-        if self.session_data.get("image_path") and os.path.exists(
-            self.session_data["image_path"]
-        ):
-            print(f"Using image path: {self.session_data['image_path']}")
-            self.show_review_screen(self.session_data["image_path"])
+        if image_path and os.path.exists(image_path):
+            print(f"Using image path: {image_path}")
+            self.show_review_screen(image_path, frame)
         else:
             print("No valid snapshot found, returning to detection")
-            self.transition_to_detection()
+            await self.transition_to_detection()
 
     def find_latest_snapshot(self):
-        """Find the latest snapshot file"""
+        """Find the latest snapshot, preferring this session's own"""
         try:
-            snapshot_files = [
-                f
-                for f in os.listdir("snapshots")
-                if f.startswith("snapshot_") and f.endswith(".jpg")
-            ]
-
-            if snapshot_files:
-                latest = sorted(snapshot_files)[-1]
-                snapshot_path = os.path.join("snapshots", latest)
-                self.session_data["image_path"] = snapshot_path
+            session_snapshots = self.snapshots.for_session(self.session_id)
+            if session_snapshots:
+                snapshot_path = session_snapshots[-1]
+            else:
+                snapshot_path = self.snapshots.latest()
+
+            if snapshot_path:
+                self.session.update({"image_path": snapshot_path})
                 print(f"Found latest snapshot: {snapshot_path}")
         except Exception as e:
             print(f"Error finding latest snapshot: {e}")
 
-    def show_review_screen(self, image_path):
+    def show_review_screen(self, image_path, frame=None):
         """Show review screen"""
         print(f"Showing review screen: {image_path}")
 
-        # Check if review script exists
-        if os.path.exists("photo_preview.py"):
-            preview_script = "photo_preview.py"
-        elif os.path.exists("preview_screen.py"):
-            preview_script = "preview_screen.py"
-        else:
-            print("No review script found, saving data and returning to idle")
-            self.save_session_data()
-            self.start_idle_screen()
-            return
+        scene = ReviewScene(
+            image_path,
+            snapshots=self.snapshots,
+            frame=frame,
+            on_finish=lambda result: self.post_event("review_result", result=result),
+        )
+        scene.on_shown = lambda at: metrics.REGISTRY.end(
+            "shutter", "shutter_to_preview", at=at
+        )
+        self.scene_host.show(scene)
 
-        # Start preview process
-        cmd = ["python3", preview_script, "--image", image_path]
-        print(f"Running command: {' '.join(cmd)}")
+    async def finish_review(self, result):
+        """Act on the review decision"""
+        print(f"Got preview result: {result}")
+        if self.current_state != REVIEW:
+            return
+        metrics.REGISTRY.mark("review_decision", self.event_time)
 
-        self.review_process = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
-        )
+        try:
+            if result == "try_again":
+                # Try again
+                await self.transition_to_detection()
+            else:
+                # Continue; the session is saved once its snapshot is on disk
+                self.finish_session()
+                await self.start_idle_screen()
+        except Exception as e:
+            print(f"Error in review: {e}")
+            self.save_session_data()
+            await self.start_idle_screen()
 
-        # Monitor for result
-        threading.Thread(target=self.monitor_review_process).start()
+    def finish_session(self):
+        """Save the session, in the background while its snapshot is written
 
-    def monitor_review_process(self):
-        """Monitor the review process"""
-        if not self.review_process:
+        The session's store is handed to a task and replaced by a blank one,
+        so the dispatcher does not wait on the encoder and the next session
+        cannot write into this one.
+        """
+        saved, self.snapshot_saved = self.snapshot_saved, None
+        if saved is None:
+            self.save_session_data()
             return
+        session, self.session = self.session, SessionStore()
+        task = asyncio.ensure_future(
+            self.save_when_written(saved, session, self.session_id)
+        )
+        self.saving.add(task)
+        task.add_done_callback(self.saving.discard)
 
+    async def save_when_written(self, saved, session, session_id):
+        """Record the snapshot once its file is written, then save the session"""
         try:
-            # Read stdout and stderr
-            stdout_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.review_process.stdout, "REVIEW"),
-                daemon=True,
+            path, renditions = await asyncio.wait_for(
+                asyncio.wrap_future(saved), timeout=10
             )
-            stderr_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.review_process.stderr, "REVIEW ERROR"),
-                daemon=True,
+            self.handle_image_ready(
+                stage_ipc.SNAPSHOT_READY, path, renditions, session=session
             )
-
-            stdout_thread.start()
-            stderr_thread.start()
-
-            # Wait for process to complete
-            self.review_process.wait()
-
-            print(f"DEBUG: Review process ended. Current state: {self.current_state}")
-
-            # Process ended, save data and return to idle or detection
-            if self.current_state == REVIEW:
-                print("DEBUG: Transitioning from review state")
-                self.save_session_data()
-                self.start_idle_screen()
-
         except Exception as e:
-            print(f"Error in review: {e}")
-            self.save_session_data()
-            self.start_idle_screen()
-        finally:
-            self.stop_process(self.review_process)
-            self.review_process = None
+            print(f"Error saving snapshot: {e}")
+        self.save_session_data(session, session_id)
 
-    def save_session_data(self):
-        """Save the session data to file"""
-        # Add timestamp
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.session_data["timestamp"] = timestamp
-
-        # Save to file
-        filename = f"data/session_{timestamp}.json"
+    def save_session_data(self, session=None, session_id=None):
+        """Compact the session into its final data/session_*.json"""
+        session = session or self.session
+        session_id = session_id or self.session_id
         try:
-            with open(filename, "w") as f:
-                json.dump(self.session_data, f, indent=2)
+            filename = session.compact()
             print(f"Session data saved: {filename}")
 
             # Clean up temp files
-            temp_files = glob.glob(
-                os.path.join("data", f"temp_user_data_{self.session_id}.json")
-            )
-            for file in temp_files:
-                try:
-                    os.remove(file)
-                except:
-                    pass
+            try:
+                os.remove(os.path.join("data", f"temp_user_data_{session_id}.json"))
+            except OSError:
+                pass
 
         except Exception as e:
             print(f"Error saving session data: {e}")
 
-    def transition_to_user_input(self):
+    async def transition_to_user_input(self):
         """Transition to user input screen"""
-        self.stop_all_processes()
-        self.skip_key_pressed = False  # Reset skip flag
+        await self.end_detection_session()
+        self.retire_all_processes()
 
         # Generate new session ID for this user interaction
         self.session_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-
-        # Reset session data
-        self.session_data = {
-            "story_id": None,
-            "users": {"names": [], "detected_props": [], "appearance": ""},
-            "timestamp": "",
-            "image_path": "",
-            "cache_image_path": "",
-        }
+        self.session.begin(self.session_id)
 
         print("Starting user input...")
+        self.scene_host.show(None)
         try:
-            self.ui_process = subprocess.Popen(
-                ["python3", "user_input_app.py"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
+            self.ui_process, messages = await self.spawn_stage(
+                ["python3", "user_input_app.py"]
             )
             self.current_state = USER_INPUT
 
             # Monitor for user data
-            threading.Thread(target=self.monitor_ui_process).start()
+            print("Monitoring UI process")
+            self.watch_process("ui", self.ui_process, messages, "UI")
         except FileNotFoundError:
             print("Warning: user_input_app.py not found. Using mock user input.")
-            self.mock_user_input()
+            await self.mock_user_input()
 
-    def mock_user_input(self):
+    async def mock_user_input(self):
         """Create mock user input for testing"""
         print("Creating mock user data...")
 
@@ -559,228 +793,231 @@ class PhotoboothSystem:
             "NAME_E": "",
         }
 
-        # Update session data
-        self.session_data["story_id"] = user_data["STORY_ID"]
-
-        # Extract names
-        names = []
-        for key in ["NAME_A", "NAME_B", "NAME_C", "NAME_D", "NAME_E"]:
-            if key in user_data and user_data[key].strip():
-                names.append(user_data[key])
-
-        self.session_data["users"]["names"] = names
-
-        # Save to temp file
-        data_json_path = os.path.join("data", f"temp_user_data_{self.session_id}.json")
-        with open(data_json_path, "w") as f:
-            json.dump(self.session_data, f, indent=2)
-        print(f"Mock user data saved to: {data_json_path}")
-
-        # Proceed to detection
-        self.transition_to_detection()
-
-    def monitor_ui_process(self):
-        """Monitor UI process for user data"""
-        if not self.ui_process:
-            return
-
-        print("Monitoring UI process")
-        try:
-            # Use the read_process_output method to handle both stdout and stderr
-            # This will automatically handle the USER_DATA parsing
-            stdout_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.ui_process.stdout, "UI"),
-                daemon=True,
-            )
-            stderr_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.ui_process.stderr, "UI ERROR"),
-                daemon=True,
-            )
-
-            stdout_thread.start()
-            stderr_thread.start()
-
-            # Wait for process to complete
-            self.ui_process.wait()
-
-            # If we get here and still in USER_INPUT state, no data was received
-            if self.current_state == USER_INPUT:
-                print("UI process ended without providing user data")
-                self.start_idle_screen()
-
-        except Exception as e:
-            print(f"Error monitoring UI: {e}")
-            self.start_idle_screen()
-        finally:
-            self.stop_process(self.ui_process)
-            self.ui_process = None
-
-    def monitor_review_process(self):
-        """Monitor the review process"""
-        if not self.review_process:
-            return
-
-        try:
-            # Read stdout and stderr
-            stdout_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.review_process.stdout, "REVIEW"),
-                daemon=True,
-            )
-            stderr_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.review_process.stderr, "REVIEW ERROR"),
-                daemon=True,
-            )
-
-            stdout_thread.start()
-            stderr_thread.start()
-
-            # Wait for process to complete
-            self.review_process.wait()
-
-            print(f"DEBUG: Review process ended. Current state: {self.current_state}")
+        # Same path as data coming from the user input screen
+        self.current_state = USER_INPUT
+        await self.handle_user_data(user_data)
 
-            # Process ended, save data and return to idle or detection
-            if self.current_state == REVIEW:
-                print("DEBUG: Transitioning from review state")
-                self.save_session_data()
-                self.start_idle_screen()
-
-        except Exception as e:
-            print(f"Error in review: {e}")
-            self.save_session_data()
-            self.start_idle_screen()
-        finally:
-            self.stop_process(self.review_process)
-            self.review_process = None
-
-    def transition_to_detection(self):
+    async def transition_to_detection(self):
         """Transition to detection state"""
-        self.stop_all_processes()
+        self.retire_all_processes()
 
-        try:
-            # Attempt to release any existing camera resources
-            try:
-                import subprocess
+        # Prepare additional arguments
+        additional_args = {
+            "json_id": self.session_id,
+            "cache_path": self.session.get("cache_image_path"),
+            "prop_list": self.session.get("users.detected_props", []),
+        }
 
-                # Kill any existing camera-related processes
-                subprocess.run(
-                    ["pkill", "-f", "python.*camera"], stderr=subprocess.DEVNULL
+        self.scene_host.show(None)
+        if await self.start_detection_service():
+            try:
+                await self.run_blocking(
+                    self.detection_control.start_session,
+                    additional_args["json_id"],
+                    additional_args["cache_path"],
+                    additional_args["prop_list"],
                 )
-                subprocess.run(["pkill", "-f", "libcamera"], stderr=subprocess.DEVNULL)
-                time.sleep(1)  # Give some time for processes to terminate
+                self.detection_session = True
+                self.current_state = DETECTION
+                print("Detection session started. Press button to take photo.")
+                return
             except Exception as e:
-                print(f"Error releasing camera resources: {e}")
-
-            # Make sure we have current data
-            self.update_session_data_from_json()
-
-            # Prepare command with session ID
-            cmd = ["python3", "detection_app.py", "-i", "rpi"]
+                print(f"Detection service failed, starting detection directly: {e}")
+                self.retire_process(self.detection_service)
+                self.detection_service = None
 
+        try:
             # Prepare environment
-            env = os.environ.copy()
-            if "DISPLAY" not in env:
-                env["DISPLAY"] = ":0"
-
-            # Prepare additional arguments
-            additional_args = {
-                "json_id": self.session_id,
-                "cache_path": self.session_data.get("cache_image_path"),
-                "prop_list": self.session_data["users"].get("detected_props", []),
-            }
+            env = self.detection_env()
+            if CAMERA_SOCKET_ENV not in env:
+                # Our own stages are reaped; only strays need killing
+                await self.wait_for_camera()
+                try:
+                    # Kill any existing camera-related processes
+                    killed = False
+                    for pattern in ["python.*camera", "libcamera"]:
+                        pkill = await asyncio.create_subprocess_exec(
+                            "pkill", "-f", pattern, stderr=asyncio.subprocess.DEVNULL
+                        )
+                        killed |= await pkill.wait() == 0
+                    if killed:
+                        await asyncio.sleep(1)  # Give them time to terminate
+                except Exception as e:
+                    print(f"Error releasing camera resources: {e}")
 
             # Pass additional arguments as a JSON-encoded environment variable
             env["DETECTION_ARGS"] = json.dumps(additional_args)
 
+            cmd = DETECTION_COMMAND
             print(f"Starting detection with command: {' '.join(cmd)}")
 
             # Run detection app
-            self.detection_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                env=env,
-            )
+            self.detection_process, messages = await self.spawn_stage(cmd, env=env)
+            if CAMERA_SOCKET_ENV not in env:
+                self.camera_stages.add(self.detection_process)
             self.current_state = DETECTION
             print(f"Detection process started. Press button to take photo.")
 
             # Monitor detection process
-            threading.Thread(target=self.monitor_detection_process, daemon=True).start()
+            self.watch_process(
+                "detection", self.detection_process, messages, "DETECTION"
+            )
 
         except Exception as e:
             print(f"Error starting detection: {e}")
-            self.start_idle_screen()
+            await self.start_idle_screen()
+
+    def detection_env(self):
+        """Environment for detection, reading from the broker when it runs"""
+        env = os.environ.copy()
+        if "DISPLAY" not in env:
+            env["DISPLAY"] = ":0"
+        if self.camera_broker_running():
+            # Detection reads frames from the broker; nothing to release
+            env[CAMERA_SOCKET_ENV] = self.camera.socket_path
+        return env
+
+    async def start_detection_service(self):
+        """Start detection once and keep it warm between sessions
+
+        Only done with the camera broker, as detection would otherwise hold
+        the camera the countdown needs. Returns whether the service runs.
+        """
+        if self.detection_service and self.detection_service.returncode is None:
+            return True
+        if not self.camera_broker_running():
+            return False
+        if os.environ.get("PHOTOBOOTH_DETECTION_SERVICE", "1") == "0":
+            return False
+
+        control = self.detection_control or DetectionControl()
+        env = self.detection_env()
+        env[DETECTION_SOCKET_ENV] = control.socket_path
+        try:
+            self.detection_service, messages = await self.spawn_stage(
+                DETECTION_COMMAND, env=env
+            )
+        except Exception as e:
+            print(f"Detection service unavailable, starting it per session: {e}")
+            return False
 
-    def monitor_detection_process(self):
-        """Monitor detection process and restart if needed"""
-        if not self.detection_process:
-            return
+        self.detection_control = control
+        self.watch_process(
+            "detection_service", self.detection_service, messages, "DETECTION"
+        )
+        print("Detection service started")
+        return True
 
+    async def end_detection_session(self, wait=True):
+        """Pause the detection service; it saves what the session detected
+
+        With wait False this returns once detection has stopped, while the
+        service is still saving.
+        """
+        if not self.detection_session:
+            return
+        self.detection_session = False
         try:
-            # Monitor stdout and stderr
-            stdout_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.detection_process.stdout, "DETECTION"),
-                daemon=True,
-            )
-            stderr_thread = threading.Thread(
-                target=self.read_process_output,
-                args=(self.detection_process.stderr, "DETECTION ERROR"),
-                daemon=True,
-            )
+            await self.run_blocking(self.detection_control.stop_session, wait)
+        except Exception as e:
+            print(f"Error stopping detection session: {e}")
 
-            stdout_thread.start()
-            stderr_thread.start()
+    def camera_broker_running(self):
+        return self.camera is not None and self.camera.alive()
 
-            # Wait for process to complete
-            self.detection_process.wait()
+    def retire_process(self, process):
+        """Send a stage SIGTERM now and reap it in the background"""
+        if process is None or process in self.exiting:
+            return
+        if process.returncode is not None:
+            self.camera_stages.discard(process)
+            return
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            pass
 
-            # If we get here and still in detection state, restart
-            if self.current_state == DETECTION:
-                print("Detection process ended, restarting...")
-                self.transition_to_detection()
+        def reaped(task):
+            self.exiting.pop(process, None)
+            self.camera_stages.discard(process)
 
-        except Exception as e:
-            print(f"Error monitoring detection: {e}")
+        task = asyncio.ensure_future(self.reap_process(process))
+        task.add_done_callback(reaped)
+        self.exiting[process] = task
 
-    def stop_process(self, process):
-        """Stop a single process safely"""
-        if process and process.poll() is None:
+    async def reap_process(self, process):
+        """Wait for a terminated stage, killing it if it lingers"""
+        try:
             try:
-                process.terminate()
-                try:
-                    process.wait(timeout=1)
-                except subprocess.TimeoutExpired:
-                    process.kill()
-                    process.wait(timeout=1)
-            except:
-                pass
+                await asyncio.wait_for(process.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                process.kill()
+                await asyncio.wait_for(process.wait(), timeout=1)
+        except Exception:
+            pass
 
-    def stop_all_processes(self):
-        """Stop all running processes"""
-        for process in [
-            self.ui_process,
-            self.detection_process,
-            self.photo_process,
-            self.review_process,
-        ]:
-            self.stop_process(process)
+    def retire_all_processes(self):
+        """Signal every stage to stop at once; the caller need not wait"""
+        for process in [self.ui_process, self.detection_process]:
+            self.retire_process(process)
 
         # Reset references
         self.ui_process = None
         self.detection_process = None
-        self.photo_process = None
-        self.review_process = None
+
+    async def wait_for_camera(self):
+        """Wait until no exiting stage still has the camera open"""
+        tasks = [self.exiting[p] for p in self.camera_stages if p in self.exiting]
+        if tasks:
+            with metrics.span("camera_release"):
+                await asyncio.gather(*tasks)
+
+    async def stop_all_processes(self):
+        """Stop all stages and wait until every one has exited"""
+        self.retire_all_processes()
+        self.retire_process(self.detection_service)
+        self.detection_service = None
+        if self.exiting:
+            await asyncio.gather(*self.exiting.values())
+
+    async def shutdown(self):
+        """Stop children and release the camera (runs on the loop)"""
+        await self.stop_all_processes()
+        await self.release_photo_capture()
+        if self.saving:
+            await asyncio.gather(*self.saving)
+        # Stages exit with the loop; nothing is left to report their exit to
+        for task in list(self.watchers):
+            task.cancel()
+        await asyncio.gather(*self.watchers, return_exceptions=True)
+        self.write_metrics()
 
     def cleanup(self):
         """Clean up resources"""
         print("Cleaning up...")
-        self.stop_all_processes()
+        if self.loop_thread and self.loop_thread.is_alive():
+            self.post_event("shutdown")
+            self.loop_thread.join(timeout=5)
+        self.blocking_pool.shutdown(wait=False)
+        self.scene_host.stop()
+        WRITER.close()
+
+        if self.zygote:
+            self.zygote.close()
+            self.zygote = None
+
+        if self.detection_control:
+            self.detection_control.close()
+            self.detection_control = None
+
+        if self.camera:
+            self.camera.close()
+            self.camera = None
+
+        # An unfinished session is dropped, as before; only crashes leave a
+        # journal behind for recovery
+        self.session.discard()
+        self.snapshots.close()
 
         # Clean up temp files
         temp_files = glob.glob(os.path.join("data", "temp_user_data_*.json"))
@@ -796,11 +1033,18 @@ class PhotoboothSystem:
             pass  # Ignore GPIO errors
         print("Cleanup complete.")
 
+    def skip_to_user_input(self):
+        """Skip waiting for the PIR sensor"""
+        self.post_event("skip")
+
     def simulate_button_press(self):
         """Simulate button press for testing"""
-        if self.current_state == DETECTION:
-            print("Simulating button press")
-            self.button_pressed(None)
+        self.post_event("button", simulated=True)
+
+    def show_metrics(self):
+        """Print latency percentiles and write them to the metrics file"""
+        print(metrics.REGISTRY.format_report())
+        self.write_metrics()
 
 
 def main():
@@ -812,20 +1056,24 @@ def main():
         photobooth = PhotoboothSystem()
 
         print("Photobooth system running. Press CTRL+C to exit.")
-        print("Press 's' to skip to user input.")
-        print("Press 'b' to simulate button press when in detection state.")
+        print("Press 's' and Enter to skip to user input.")
+        print("Press 'b' and Enter to simulate button press when in detection state.")
+        print("Press 'm' and Enter to show session latency metrics.")
 
         # Simple command interface for testing
         while True:
             try:
-                cmd = input("")
-                if cmd.lower() == "b" and photobooth.current_state == DETECTION:
+                cmd = input("").strip().lower()
+                if cmd == "s":
+                    photobooth.skip_to_user_input()
+                elif cmd == "b":
                     photobooth.simulate_button_press()
+                elif cmd == "m":
+                    photobooth.show_metrics()
             except (EOFError, KeyboardInterrupt):
                 break
             except Exception:
                 pass
-            time.sleep(0.1)
 
     except KeyboardInterrupt:
         print("Program terminated by user.")
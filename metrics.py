@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+import math
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+import stage_ipc
+from session_store import write_json_atomic
+
+METRICS_FILE = "data/metrics.json"
+
+# Bucket bounds grow by 2**(1/8) (~9%) from 0.1 ms to a bit over 100 s, so a
+# percentile read from a bucket is within ~9% of the true value.
+BUCKET_GROWTH = 2 ** (1 / 8)
+BUCKET_BOUNDS = [
+    0.0001 * BUCKET_GROWTH**i
+    for i in range(int(math.log(1e6, BUCKET_GROWTH)) + 2)
+]
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """Counts of observed durations in fixed log-spaced buckets"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile"""
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index == len(BUCKET_BOUNDS):
+                    return self.max
+                # Never report more than was actually observed
+                return min(BUCKET_BOUNDS[index], self.max)
+        return self.max
+
+    def summary(self):
+        result = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+        }
+        for p in PERCENTILES:
+            result[f"p{p}"] = self.percentile(p)
+        return result
+
+
+class LatencyMetrics:
+    """Named latency histograms plus open marks for spans across events
+
+    mark("button") records when something started; end("button",
+    "button_to_shutter") later observes the time since, in whichever thread
+    the span finishes. Times are time.monotonic(), which is shared by all
+    processes on the box, so stages can report start times too.
+
+    Counters and gauges sit alongside for things that are not durations,
+    such as dropped events or queue depth.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.marks = {}
+        self.counters = {}
+        self.gauges = {}  # name -> {"value": latest, "max": highest}
+        self.started = time.time()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        """Record the current value, keeping the highest seen"""
+        with self.lock:
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                self.gauges[name] = {"value": value, "max": value}
+            else:
+                gauge["value"] = value
+                gauge["max"] = max(gauge["max"], value)
+
+    def mark(self, name, at=None):
+        with self.lock:
+            self.marks[name] = time.monotonic() if at is None else at
+
+    def end(self, mark, name, at=None, keep=False):
+        """Observe the time since mark as name; returns it, or None if unmarked
+
+        The mark is used up unless keep is set, so a later span can end at it.
+        """
+        with self.lock:
+            start = self.marks.get(mark) if keep else self.marks.pop(mark, None)
+        if start is None:
+            return None
+        seconds = (time.monotonic() if at is None else at) - start
+        self.observe(name, seconds)
+        return seconds
+
+    def report(self):
+        with self.lock:
+            return {
+                "since": self.started,
+                "written": time.time(),
+                "latency": {
+                    name: histogram.summary()
+                    for name, histogram in sorted(self.histograms.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": {name: dict(g) for name, g in sorted(self.gauges.items())},
+            }
+
+    def format_report(self):
+        """Table of latencies in milliseconds for the console"""
+        report = self.report()
+        latency = report["latency"]
+        if not latency:
+            return "No latency samples yet"
+
+        width = max(len("span (ms)"), *(len(name) for name in latency))
+        header = " ".join(f"{column:>8}" for column in ("p50", "p95", "p99", "max"))
+        lines = [f"{'span (ms)':<{width}} {'n':>5} {header}"]
+        for name, summary in latency.items():
+            values = [summary[f"p{p}"] for p in PERCENTILES] + [summary["max"]]
+            cells = " ".join(f"{value * 1000:8.1f}" for value in values)
+            lines.append(f"{name:<{width}} {summary['count']:>5} {cells}")
+
+        for name, value in report["counters"].items():
+            lines.append(f"{name:<{width}} {value:>5}")
+        for name, gauge in report["gauges"].items():
+            lines.append(f"{name:<{width}} {gauge['value']:>5} (max {gauge['max']})")
+        return "\n".join(lines)
+
+    def write(self, path=METRICS_FILE):
+        write_json_atomic(path, self.report())
+
+
+# Process-wide registry; in main.py it also collects what the stages report
+REGISTRY = LatencyMetrics()
+
+
+def observe(name, seconds):
+    """Record a duration, sending it to main.py when running as a stage"""
+    if not stage_ipc.send_event(stage_ipc.METRICS, name=name, seconds=seconds):
+        REGISTRY.observe(name, seconds)
+
+
+def count(name, n=1):
+    """Add to a counter, sending it to main.py when running as a stage"""
+    if not stage_ipc.send_event(stage_ipc.METRICS, name=name, count=n):
+        REGISTRY.count(name, n)
+
+
+@contextmanager
+def span(name):
+    """Time a block and record it like observe()"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start)
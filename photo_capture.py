@@ -10,15 +10,16 @@ import json
 import argparse
 import datetime
 import threading
+import collections
 from picamera2 import Picamera2
 
-# Parse arguments
-parser = argparse.ArgumentParser(description="Photo capture with countdown")
-parser.add_argument("--countdown", type=int, default=5, help="Countdown duration in seconds")
-parser.add_argument("--fullscreen", action="store_true", help="Run in fullscreen mode")
-parser.add_argument("--json-id", type=str, help="Session ID for JSON file updates")
-parser.add_argument("--cache-path", type=str, help="Path to cache image")
-args = parser.parse_args()
+import stage_ipc
+import metrics
+from camera_broker import CameraClient, CAMERA_SOCKET_ENV
+from snapshot_index import snapshot_name
+from shot_scoring import ShotScorer
+from snapshot_writer import WRITER
+from scene_host import Scene, SceneHost
 
 # Ensure required directories exist
 SNAPSHOT_DIR = "snapshots"
@@ -27,252 +28,564 @@ CACHE_DIR = "cache"
 for directory in [SNAPSHOT_DIR, DATA_DIR, CACHE_DIR]:
     os.makedirs(directory, exist_ok=True)
 
-# Global variables
-running = True
-camera = None
-display_screen = None
-preview_taken = False
-current_count = args.countdown
-
-# Function to initialize pygame
-def init_pygame():
-    pygame.init()
-    
-    if args.fullscreen:
-        display_screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
-    else:
-        display_screen = pygame.display.set_mode((1280, 720))
-    
-    pygame.display.set_caption("Photo Capture")
-    return display_screen
-
-# Function to clean up resources
-def cleanup():
-    print("Cleaning up resources...")
-    
-    # Release camera
-    if camera:
-        try:
-            camera.stop()
-            camera.close()
-        except:
-            pass
-    
-    # Quit pygame
-    pygame.quit()
-
-# Signal handlers
-def handle_sigterm(signum, frame):
-    global running
-    print("Received termination signal")
-    running = False
-
-signal.signal(signal.SIGTERM, handle_sigterm)
-signal.signal(signal.SIGINT, handle_sigterm)
-
-# Function to initialize and start camera
-def init_camera():
-    global camera
-    
-    try:
-        camera = Picamera2()
-        
-        # Configure camera for desired resolution
-        capture_config = camera.create_still_configuration(
-            main={"size": (2304, 1296)},  # 16:9 aspect ratio
-            lores={"size": (1280, 720)},  # Preview size
-            display="lores"
+CACHE_SIZE = (640, 360)
+
+# The snapshot is the best of this many frames around the end of the
+# countdown; eye detection can be turned off with PHOTOBOOTH_BURST_EYES=0
+BURST_FRAMES = int(os.environ.get("PHOTOBOOTH_BURST", "5"))
+BURST_EYES = os.environ.get("PHOTOBOOTH_BURST_EYES", "1") != "0"
+
+# Scoring gives up on eyes after this long, to stay within "Processing..."
+SCORE_BUDGET = 0.5
+
+# Loading the cascades takes a while, so it happens once, on import, rather
+# than on the button press that creates a PhotoCapture
+SCORER = ShotScorer(eyes=BURST_EYES)
+
+
+class FrameHistory:
+    """The last few full resolution frames of a camera opened directly
+
+    Each is kept with the time.time() it arrived, so the snapshot can be
+    taken from the frames around the end of the countdown. The camera
+    broker keeps its own history when it owns the camera.
+    """
+
+    def __init__(self, camera, camera_lock, size=BURST_FRAMES + 1):
+        self.camera = camera
+        self.camera_lock = camera_lock
+        self.frames = collections.deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.run, name="frame-history", daemon=True
         )
-        
-        camera.configure(capture_config)
-        camera.start()
-        print("Camera initialized successfully")
-        return True
-    except Exception as e:
-        print(f"Error initializing camera: {e}")
-        return False
-
-# Function to take a cache photo
-def take_cache_photo():
-    global camera, preview_taken
-    
-    if not camera:
-        print("Camera not initialized")
-        return None
-    
-    try:
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                with self.camera_lock:
+                    frame = self.camera.capture_array("main")
+            except Exception as e:
+                print(f"Error capturing frame history: {e}")
+                break
+            with self.condition:
+                self.frames.append((time.time(), frame))
+                self.condition.notify_all()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def burst(self, at, count=1, timeout=1.0):
+        """(None, timestamp, frame) of the count frames nearest at
+
+        Waits for the frames after at, then stops keeping frames. The None
+        stands for the broker's sequence number.
+        """
+        after = count // 2 + 1
+        with self.condition:
+            self.condition.wait_for(
+                lambda: sum(t >= at for t, _ in self.frames) >= after
+                or not self.running,
+                timeout,
+            )
+            nearest = sorted(self.frames, key=lambda item: abs(item[0] - at))
+        self.running = False
+        return [(None, t, frame) for t, frame in sorted(nearest[:count])]
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1)
+
+
+class PhotoCapture:
+    """Camera side of a photo session: cache photo and final snapshot"""
+
+    def __init__(
+        self,
+        json_id=None,
+        cache_path=None,
+        write_json=True,
+        camera=None,
+        on_image_ready=None,
+    ):
+        self.json_id = json_id
+        self.cache_path = cache_path
+        # main.py records paths in its session store instead of photo_data files
+        self.write_json = write_json
+        # Called with (stage_ipc kind, path) from a worker thread once a
+        # cache photo or snapshot is on disk, plus renditions={name: path}
+        # for a snapshot; stages also send the event
+        self.on_image_ready = on_image_ready
+        # A camera broker client can stand in for Picamera2; it stays open
+        # after cleanup because the broker owns the sensor
+        self.shared_camera = camera
+        self.camera = None
+        # Picamera2 opened here is used from the cache photo and history threads
+        self.camera_lock = threading.Lock()
+        # Recent full resolution frames: a FrameHistory, or the connection
+        # through which the broker holds them
+        self.frame_history = None
+        self.preview_taken = False
+        self.cache_thread = None
+        self.snapshot_thread = None
+        self.snapshot_path = None
+        self.saved = None  # Future of (path, renditions) once they are on disk
+        self.snapshot_seq = None  # slot of the snapshot in the broker's main ring
+        self.snapshot_image = None  # the snapshot's frame, when taken from history
+        self.shutter_time = None  # time.monotonic() when the snapshot was taken
+
+    # Function to initialize and start camera
+    def init_camera(self):
+        if self.shared_camera:
+            self.camera = self.shared_camera
+            print("Using camera broker")
+            return True
+
+        try:
+            self.camera = Picamera2()
+
+            # Configure camera for desired resolution
+            capture_config = self.camera.create_still_configuration(
+                # RGB888 is B, G, R in memory, which is what cv2 encodes
+                main={"size": (2304, 1296), "format": "RGB888"},  # 16:9
+                lores={"size": (1280, 720)},  # Preview size
+                display="lores",
+            )
+
+            self.camera.configure(capture_config)
+            self.camera.start()
+            print("Camera initialized successfully")
+            return True
+        except Exception as e:
+            print(f"Error initializing camera: {e}")
+            return False
+
+    # Function to clean up resources
+    def cleanup(self):
+        print("Cleaning up resources...")
+        self.wait_final_snapshot()
+        self.release_frames()
+        self.wait_cache_photo()
+
+        # Release camera
+        if self.camera is self.shared_camera:
+            self.camera = None
+        elif self.camera:
+            try:
+                self.camera.stop()
+                self.camera.close()
+            except:
+                pass
+            self.camera = None
+
+    # Function to take a cache photo
+    def take_cache_photo(self):
+        """Start saving a cache photo from the lores stream; returns its path
+
+        The frame is grabbed, scaled and encoded on a background thread, so
+        the countdown keeps drawing; wait_cache_photo() waits for it.
+        """
+        if not self.camera:
+            print("Camera not initialized")
+            return None
+
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        preview_path = os.path.join(SNAPSHOT_DIR, f"preview_{timestamp}.jpg")
         cache_path = os.path.join(CACHE_DIR, f"cache_{timestamp}.jpg")
-        
-        # Capture a frame
-        camera.capture_file(preview_path)
-        print(f"Preview saved to {preview_path}")
-        
-        # Create smaller version for cache
-        img = cv2.imread(preview_path)
-        if img is not None:
-            small_img = cv2.resize(img, (640, 360))  # Half resolution
+        self.preview_taken = True
+        self.cache_thread = threading.Thread(
+            target=self.save_cache_photo,
+            args=(cache_path,),
+            name="cache-photo",
+            daemon=True,
+        )
+        self.cache_thread.start()
+        return cache_path
+
+    def grab_cache_frame(self):
+        """The current lores frame at cache size, as BGR"""
+        if isinstance(self.camera, CameraClient):
+            # Lores frame from the broker's shared memory ring, copied and
+            # checked, as the broker may overwrite it while it is copied
+            for _ in range(3):
+                img = self.camera.grab_frame(copy=True)
+                if img is not None:
+                    break
+            else:
+                return None
+            small = cv2.resize(img, CACHE_SIZE, interpolation=cv2.INTER_AREA)
+            return cv2.cvtColor(small, cv2.COLOR_RGB2BGR)
+
+        # lores is YUV420: a full Y plane then quarter size U and V planes
+        with self.camera_lock:
+            yuv = self.camera.capture_array("lores")
+        img = cv2.cvtColor(yuv, cv2.COLOR_YUV420p2BGR)
+        return cv2.resize(img, CACHE_SIZE, interpolation=cv2.INTER_AREA)
+
+    def save_cache_photo(self, cache_path):
+        try:
+            start = time.monotonic()
+            small_img = self.grab_cache_frame()
+            if small_img is None:
+                print("No frame for the cache photo")
+                return
+
             cv2.imwrite(cache_path, small_img)
             print(f"Cache image saved to {cache_path}")
-            
-            # Update JSON with cache path
-            if args.json_id:
-                update_json_data(cache_img_path=cache_path)
-        
-        preview_taken = True
-        return cache_path
-    except Exception as e:
-        print(f"Error taking cache photo: {e}")
-        return None
-
-# Function to take a final snapshot
-def take_final_snapshot():
-    global camera
-    
-    if not camera:
-        print("Camera not initialized")
-        return None
-    
-    try:
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        snapshot_path = os.path.join(SNAPSHOT_DIR, f"snapshot_{timestamp}.jpg")
-        
-        # Capture a high-quality image
-        camera.capture_file(snapshot_path)
-        print(f"Final snapshot saved to {snapshot_path}")
-        
-        # Update JSON with image path
-        if args.json_id:
-            update_json_data(image_path=snapshot_path)
-        
-        return snapshot_path
-    except Exception as e:
-        print(f"Error taking snapshot: {e}")
-        return None
-
-# Function to update JSON data
-def update_json_data(image_path=None, cache_img_path=None):
-    if not args.json_id:
-        return
-    
-    # File paths
-    user_data_file = os.path.join(DATA_DIR, f"temp_user_data_{args.json_id}.json")
-    
-    # Prepare data
-    data = {
-        "timestamp": datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    }
-    
-    if image_path:
-        data["image_path"] = image_path
-    
-    if cache_img_path:
-        data["cache_img_path"] = cache_img_path
-    
-    # Try to merge with existing user data
-    if os.path.exists(user_data_file):
+            self.cache_path = cache_path
+            self.image_ready(stage_ipc.CACHE_READY, cache_path)
+
+            metrics.observe("capture.cache_photo", time.monotonic() - start)
+        except Exception as e:
+            print(f"Error taking cache photo: {e}")
+
+    def wait_cache_photo(self, timeout=5):
+        """Wait until a cache photo being saved is written"""
+        if self.cache_thread:
+            self.cache_thread.join(timeout)
+            self.cache_thread = None
+
+    def hold_frames(self):
+        """Start keeping recent full resolution frames for the snapshot"""
+        if self.frame_history or not self.camera:
+            return
+        try:
+            if isinstance(self.camera, CameraClient):
+                self.frame_history = self.camera.hold_frames()
+            else:
+                self.frame_history = FrameHistory(self.camera, self.camera_lock)
+        except Exception as e:
+            print(f"Error holding frames, the snapshot will be taken late: {e}")
+
+    def release_frames(self):
+        if self.frame_history:
+            self.frame_history.close()
+            self.frame_history = None
+
+    def start_final_snapshot(self, at=None):
+        """take_final_snapshot on a background thread; see snapshot_done()"""
+        self.snapshot_thread = threading.Thread(
+            target=self.take_final_snapshot,
+            args=(at,),
+            name="final-snapshot",
+            daemon=True,
+        )
+        self.snapshot_thread.start()
+
+    def snapshot_done(self):
+        return self.snapshot_thread is None or not self.snapshot_thread.is_alive()
+
+    def wait_final_snapshot(self, timeout=5):
+        if self.snapshot_thread:
+            self.snapshot_thread.join(timeout)
+            self.snapshot_thread = None
+
+    def burst(self, at):
+        """(seq, timestamp, frame) of the held frames around at"""
+        if isinstance(self.camera, CameraClient):
+            return self.camera.burst(at, BURST_FRAMES)
+        return self.frame_history.burst(at, BURST_FRAMES)
+
+    # Function to take a final snapshot
+    def take_final_snapshot(self, at=None):
+        """Take the final snapshot and start saving it; returns its path
+
+        at is when the photo should be taken, as time.time(). While frames
+        are held (hold_frames), the best of a burst around it is used;
+        otherwise a new frame is captured. The frame is available from
+        snapshot_frame() at once; the file is written in the background,
+        and self.saved tells when it is there.
+        """
+        if not self.camera:
+            print("Camera not initialized")
+            return None
+
+        try:
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            snapshot_path = os.path.join(
+                SNAPSHOT_DIR, snapshot_name(timestamp, self.json_id)
+            )
+
+            # Capture a high-quality image
+            start = time.monotonic()
+            self.shutter_time = start
+            burst = self.burst(at) if at is not None and self.frame_history else []
+            if burst:
+                # Nearest first, so frames that score the same go to that one
+                burst.sort(key=lambda item: abs(item[1] - at))
+                chosen = 0
+                if len(burst) > 1:
+                    with metrics.span("capture.burst_score"):
+                        frames = [frame for _, _, frame in burst]
+                        chosen, _ = SCORER.best(frames, SCORE_BUDGET)
+                seq, frame_time, frame = burst[chosen]
+
+                # The shutter was when the chosen frame arrived
+                self.shutter_time = time.monotonic() - (time.time() - frame_time)
+                metrics.observe("capture.shutter_lag", abs(frame_time - at))
+            elif isinstance(self.camera, CameraClient):
+                seq, _, frame = self.camera.capture_frame()
+            else:
+                seq = None
+                with self.camera_lock:
+                    frame = self.camera.capture_array("main")
+
+            # Copied for the writer while the broker still holds the frame
+            self.saved = self.save_snapshot(snapshot_path, seq, frame)
+            if self.saved is None:
+                print("Snapshot frame was overwritten, taking a new one")
+                seq, _, frame = self.camera.capture_frame()
+                self.saved = self.save_snapshot(snapshot_path, seq, frame)
+            self.release_frames()
+            if self.saved is None:
+                raise RuntimeError("Snapshot frame was overwritten while saved")
+
+            # The broker keeps its frame in the main ring until the next still
+            if seq is None:
+                self.snapshot_image = frame
+            else:
+                self.snapshot_seq = seq
+            self.snapshot_path = snapshot_path
+            metrics.observe("capture.snapshot", time.monotonic() - start)
+
+            # The cache photo is part of what this hands over
+            self.wait_cache_photo()
+            return snapshot_path
+        except Exception as e:
+            print(f"Error taking snapshot: {e}")
+            return None
+
+    def save_snapshot(self, path, seq, frame):
+        """Hand a frame to the writer; None if the broker overwrote it first"""
+        valid = None
+        if seq is not None:
+            valid = lambda: self.camera.frame_valid("main", seq)
+        return WRITER.save(path, frame, self.snapshot_saved, valid)
+
+    def snapshot_saved(self, path, renditions):
+        print(f"Final snapshot saved to {path} with {', '.join(renditions)}")
+        self.image_ready(stage_ipc.SNAPSHOT_READY, path, renditions=renditions)
+
+    def image_ready(self, kind, path, **details):
+        """Announce a cache photo or snapshot that is now on disk"""
+        stage_ipc.send_event(kind, path=path, **details)
+        if self.on_image_ready:
+            self.on_image_ready(kind, path, **details)
+
+        # Update JSON with the path
+        if self.json_id:
+            if kind == stage_ipc.SNAPSHOT_READY:
+                self.update_json_data(image_path=path, **details)
+            else:
+                self.update_json_data(cache_img_path=path)
+
+    def wait_saved(self, timeout=10):
+        """Wait until the snapshot is on disk; returns its path or None"""
+        if self.saved is None:
+            return None
         try:
-            with open(user_data_file, 'r') as f:
-                user_data = json.load(f)
-            
-            # Merge data
-            for key, value in user_data.items():
-                if key not in data:
-                    data[key] = value
+            return self.saved.result(timeout)[0]
         except Exception as e:
-            print(f"Error reading user data: {e}")
-    
-    # Write updated data
-    output_file = os.path.join(DATA_DIR, f"photo_data_{args.json_id}.json")
-    with open(output_file, 'w') as f:
-        json.dump(data, f, indent=2)
-    
-    print(f"Updated session data saved to {output_file}")
+            print(f"Error saving snapshot: {e}")
+            return None
+
+    def snapshot_frame(self):
+        """The final snapshot as a BGR array, if still in memory
+
+        A frame in the broker's ring is copied, as the slot is reused once
+        the capture is released; None if it was already overwritten.
+        """
+        if self.snapshot_image is not None:
+            return self.snapshot_image
+        if self.snapshot_seq is None or not isinstance(self.camera, CameraClient):
+            return None
+        return self.camera.read_frame("main", self.snapshot_seq, copy=True)
+
+    # Function to update JSON data
+    def update_json_data(self, image_path=None, cache_img_path=None, renditions=None):
+        if not self.json_id or not self.write_json:
+            return
+
+        # File paths
+        user_data_file = os.path.join(DATA_DIR, f"temp_user_data_{self.json_id}.json")
+
+        # Prepare data
+        data = {"timestamp": datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}
+
+        if image_path:
+            data["image_path"] = image_path
+
+        if cache_img_path:
+            data["cache_img_path"] = cache_img_path
+
+        if renditions:
+            data["renditions"] = renditions
+
+        # Try to merge with existing user data
+        if os.path.exists(user_data_file):
+            try:
+                with open(user_data_file, "r") as f:
+                    user_data = json.load(f)
+
+                # Merge data
+                for key, value in user_data.items():
+                    if key not in data:
+                        data[key] = value
+            except Exception as e:
+                print(f"Error reading user data: {e}")
+
+        # Write updated data
+        output_file = os.path.join(DATA_DIR, f"photo_data_{self.json_id}.json")
+        with open(output_file, "w") as f:
+            json.dump(data, f, indent=2)
+
+        print(f"Updated session data saved to {output_file}")
+
+
+class CountdownScene(Scene):
+    """Countdown with a cache photo halfway and the snapshot at zero
+
+    Finishes with the snapshot path, or None if cancelled or it failed.
+    """
+
+    # Full resolution frames are held from this many seconds before the end
+    HOLD_FRAMES_BEFORE = 1.0
+
+    def __init__(self, capture, countdown=5, on_finish=None):
+        super().__init__(on_finish)
+        self.capture = capture
+        self.countdown = countdown
+        self.processing = False
+        self.frames_held = False
+
+    def enter(self, host):
+        super().enter(host)
+
+        # Set up fonts
+        self.font_large = pygame.font.Font(None, 300)
+        self.font_medium = pygame.font.Font(None, 100)
+
+        # Countdown timing
+        self.start_time = time.time()
+        self.preview_time = self.start_time + (self.countdown / 2)  # Halfway point
+        self.end_time = self.start_time + self.countdown
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            self.finish(None)
+
+    def update(self, now):
+        if self.processing:
+            # "Processing..." stays up until the snapshot is chosen; it is
+            # saved while the review already shows it
+            if self.capture.snapshot_done():
+                self.finish(self.capture.snapshot_path)
+            return
+
+        # Take cache photo at halfway point
+        if not self.capture.preview_taken and now >= self.preview_time:
+            print("Taking cache photo at halfway point")
+            self.capture.take_cache_photo()
+
+        if not self.frames_held and now >= self.end_time - self.HOLD_FRAMES_BEFORE:
+            self.frames_held = True
+            self.capture.hold_frames()
+
+        if now >= self.end_time:
+            # Countdown finished; the best frame from when it hit zero is
+            # picked while "Processing..." is shown
+            print("Countdown complete, taking final snapshot")
+            self.capture.start_final_snapshot(at=self.end_time)
+            self.processing = True
+
+    def draw(self, display):
+        display.fill((0, 0, 0))
+
+        if self.processing:
+            # Display "Processing..." message
+            processing_text = self.font_medium.render(
+                "Processing...", True, (255, 255, 255)
+            )
+            processing_rect = processing_text.get_rect(
+                center=display.get_rect().center
+            )
+            display.blit(processing_text, processing_rect)
+            return
+
+        # Calculate remaining time
+        remaining = self.end_time - time.time()
+        count = max(0, int(remaining))
+
+        # Determine text color (red for last second)
+        text_color = (255, 255, 255) if count > 1 else (255, 50, 50)
+
+        # Render countdown number
+        count_text = self.font_large.render(str(count), True, text_color)
+        count_rect = count_text.get_rect(center=display.get_rect().center)
+        display.blit(count_text, count_rect)
+
+        # Render message
+        message = "Get ready!" if count > 1 else "SMILE!"
+        msg_text = self.font_medium.render(message, True, (255, 255, 255))
+        msg_rect = msg_text.get_rect(
+            center=(display.get_rect().centerx, display.get_rect().centery - 200)
+        )
+        display.blit(msg_text, msg_rect)
+
 
 # Main function
 def main():
-    global running, current_count, preview_taken
-    
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Photo capture with countdown")
+    parser.add_argument(
+        "--countdown", type=int, default=5, help="Countdown duration in seconds"
+    )
+    parser.add_argument(
+        "--fullscreen", action="store_true", help="Run in fullscreen mode"
+    )
+    parser.add_argument("--json-id", type=str, help="Session ID for JSON file updates")
+    parser.add_argument("--cache-path", type=str, help="Path to cache image")
+    args = parser.parse_args()
+
+    # Borrow the broker's camera when one is running
+    camera = CameraClient() if os.environ.get(CAMERA_SOCKET_ENV) else None
+    capture = PhotoCapture(
+        json_id=args.json_id, cache_path=args.cache_path, camera=camera
+    )
+    scene = CountdownScene(capture, countdown=args.countdown)
+
+    # Signal handlers
+    def handle_sigterm(signum, frame):
+        print("Received termination signal")
+        scene.finish(None)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.signal(signal.SIGINT, handle_sigterm)
+
     # Initialize camera
-    if not init_camera():
+    if not capture.init_camera():
         print("Failed to initialize camera, exiting")
         return 1
-    
-    # Initialize pygame display
-    display = init_pygame()
-    
+    # Snapshot workers start during the countdown rather than at the shutter
+    WRITER.start()
+
     try:
-        # Set up fonts
-        font_large = pygame.font.Font(None, 300)
-        font_medium = pygame.font.Font(None, 100)
-        
-        # Countdown loop
-        start_time = time.time()
-        preview_time = start_time + (args.countdown / 2)  # Halfway point
-        end_time = start_time + args.countdown
-        
-        while running and time.time() < end_time:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
-                    running = False
-            
-            # Calculate remaining time
-            remaining = end_time - time.time()
-            count = max(0, int(remaining))
-            
-            # Take cache photo at halfway point
-            if not preview_taken and time.time() >= preview_time:
-                print("Taking cache photo at halfway point")
-                take_cache_photo()
-            
-            # Prepare display
-            display.fill((0, 0, 0))
-            
-            # Determine text color (red for last second)
-            text_color = (255, 255, 255) if count > 1 else (255, 50, 50)
-            
-            # Render countdown number
-            count_text = font_large.render(str(count), True, text_color)
-            count_rect = count_text.get_rect(center=display.get_rect().center)
-            display.blit(count_text, count_rect)
-            
-            # Render message
-            message = "Get ready!" if count > 1 else "SMILE!"
-            msg_text = font_medium.render(message, True, (255, 255, 255))
-            msg_rect = msg_text.get_rect(center=(display.get_rect().centerx, display.get_rect().centery - 200))
-            display.blit(msg_text, msg_rect)
-            
-            # Update display
-            pygame.display.flip()
-            
-            # Sleep briefly
-            time.sleep(0.05)
-        
-        if running:
-            # Countdown finished, take final photo
-            print("Countdown complete, taking final snapshot")
-            snapshot_path = take_final_snapshot()
-            
-            # Display "Processing..." message
-            display.fill((0, 0, 0))
-            processing_text = font_medium.render("Processing...", True, (255, 255, 255))
-            processing_rect = processing_text.get_rect(center=display.get_rect().center)
-            display.blit(processing_text, processing_rect)
-            pygame.display.flip()
-            
-            # Wait briefly to show processing message
-            time.sleep(1)
-            
+        host = SceneHost(fullscreen=args.fullscreen, caption="Photo Capture")
+        host.run_scene(scene)
     except KeyboardInterrupt:
         print("Program interrupted by user")
     except Exception as e:
         print(f"Error: {e}")
     finally:
-        # Clean up resources
-        cleanup()
-    
+        # Clean up resources, once the snapshot is on disk
+        capture.cleanup()
+        capture.wait_saved()
+        if camera:
+            camera.close()
+
     return 0
 
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -2,25 +2,15 @@
 import pygame
 import sys
 import os
+import time
 import argparse
-import glob
 
-# Parse arguments to get the image path
-parser = argparse.ArgumentParser(description="Photo preview screen")
-parser.add_argument(
-    "--image", type=str, required=True, help="Path to the image to preview"
-)
-args = parser.parse_args()
+import stage_ipc
+import metrics
+from scene_host import Scene, SceneHost
+from snapshot_index import SnapshotIndex, rendition_path
 
-# Initialize pygame
-pygame.init()
-
-# Set up fullscreen display
-screen_info = pygame.display.Info()
-SCREEN_WIDTH = screen_info.current_w
-SCREEN_HEIGHT = screen_info.current_h
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.FULLSCREEN)
-pygame.display.set_caption("Photo Preview")
+START_TIME = time.monotonic()
 
 # Colors
 BLACK = (0, 0, 0)
@@ -29,14 +19,9 @@ GRAY = (200, 200, 200)
 GREEN = (0, 200, 0)
 RED = (255, 0, 0)
 
-# Font setup
-font_large = pygame.font.Font(None, 60)
-font_medium = pygame.font.Font(None, 48)
-font_small = pygame.font.Font(None, 36)
-
 
 class Button:
-    def __init__(self, x, y, w, h, text, action=None, color=GRAY):
+    def __init__(self, x, y, w, h, text, font, action=None, color=GRAY):
         self.rect = pygame.Rect(x, y, w, h)
         self.text = text
         self.action = action
@@ -47,7 +32,7 @@ class Button:
             min(color[2] + 50, 255),
         )
         self.text_color = BLACK if color != RED and color != GREEN else WHITE
-        self.font = font_medium
+        self.font = font
         self.hover = False
 
     def handle_event(self, event):
@@ -71,182 +56,209 @@ class Button:
         screen.blit(text_surf, text_rect)
 
 
-def return_result(result):
-    """Send result back to parent process and exit"""
-    print(f"PREVIEW_RESULT:{result}")
-    sys.stdout.flush()
-    pygame.quit()
-    sys.exit(0)
+_snapshot_index = None
 
 
-def find_latest_snapshot():
+def find_latest_snapshot(snapshots=None):
     """Find the most recent snapshot in the snapshots directory"""
-    snapshot_dir = "snapshots"
-    snapshot_pattern = os.path.join(snapshot_dir, "snapshot_*.jpg")
+    global _snapshot_index
+    if snapshots is None:
+        if _snapshot_index is None:
+            _snapshot_index = SnapshotIndex("snapshots")
+        snapshots = _snapshot_index
+
+    latest_snapshot = snapshots.latest()
+    if not latest_snapshot:
+        print("No snapshots found")
+    return latest_snapshot
 
-    # Get all snapshot files
-    snapshot_files = glob.glob(snapshot_pattern)
 
-    if not snapshot_files:
-        print("No snapshots found")
-        return None
+def choose_image(requested_path):
+    """Prefer the latest snapshot, falling back to the requested image"""
+    latest_snapshot = find_latest_snapshot()
 
-    # Get the most recent snapshot
-    latest_snapshot = max(snapshot_files, key=os.path.getctime)
-    print(f"Latest snapshot found: {latest_snapshot}")
-    return latest_snapshot
+    if latest_snapshot:
+        # Use the latest snapshot if available
+        print(f"Using latest snapshot: {latest_snapshot}")
+        return latest_snapshot
+    if requested_path and os.path.exists(requested_path):
+        # Fall back to the specified image if no snapshots are found
+        print(f"No recent snapshots found. Using specified image: {requested_path}")
+        return requested_path
+    return None
 
 
-def main():
-    # Print a message at startup for debugging
-    print("Photo preview starting...")
-    sys.stdout.flush()
+class ReviewScene(Scene):
+    """Shows the snapshot with Try Again / Continue buttons
 
-    try:
-        # Always find the latest snapshot first
-        latest_snapshot = find_latest_snapshot()
-
-        # Determine which image to use
-        if latest_snapshot:
-            # Use the latest snapshot if available
-            image_path = latest_snapshot
-            print(f"Using latest snapshot: {image_path}")
-        elif os.path.exists(args.image):
-            # Fall back to the specified image if no snapshots are found
-            image_path = args.image
-            print(f"No recent snapshots found. Using specified image: {image_path}")
-        else:
-            print("ERROR: No image found to preview")
-            sys.stdout.flush()
-            return 1
+    Finishes with "try_again" or "continue".
+    """
 
-        print(f"Using image: {image_path}")
-        sys.stdout.flush()
+    def __init__(self, image_path, on_finish=None, snapshots=None, frame=None):
+        super().__init__(on_finish)
+        self.image_path = image_path
+        self.snapshots = snapshots
+        # Decoded BGR pixels of image_path, e.g. from the camera broker
+        self.frame = frame
+        self.scaled_image = None
+        self.last_check_time = 0
 
-        # Check if image exists
-        if not os.path.exists(image_path):
-            print(f"ERROR: Image not found: {image_path}")
-            sys.stdout.flush()
-            return 1
+    def enter(self, host):
+        super().enter(host)
+        width, height = host.screen.get_size()
 
-        # Load image
-        image = pygame.image.load(image_path)
-        img_width, img_height = image.get_size()
+        # Font setup
+        self.font_large = pygame.font.Font(None, 60)
+        self.font_medium = pygame.font.Font(None, 48)
+        self.font_small = pygame.font.Font(None, 36)
 
-        # Scale to fit screen
-        scale_factor = min(
-            (SCREEN_WIDTH * 0.8) / img_width, (SCREEN_HEIGHT * 0.7) / img_height
-        )
-        new_width = int(img_width * scale_factor)
-        new_height = int(img_height * scale_factor)
-        scaled_image = pygame.transform.scale(image, (new_width, new_height))
+        if self.frame is not None:
+            self.load_frame(self.frame)
+        else:
+            self.load_image(self.image_path)
 
         # Create buttons
         button_width = 200
         button_height = 60
-        try_again_button = Button(
-            SCREEN_WIDTH // 2 - button_width - 50,
-            SCREEN_HEIGHT - 100,
+        self.try_again_button = Button(
+            width // 2 - button_width - 50,
+            height - 100,
             button_width,
             button_height,
             "Try Again",
+            self.font_medium,
             "try_again",
             RED,
         )
-        continue_button = Button(
-            SCREEN_WIDTH // 2 + 50,
-            SCREEN_HEIGHT - 100,
+        self.continue_button = Button(
+            width // 2 + 50,
+            height - 100,
             button_width,
             button_height,
             "Continue",
+            self.font_medium,
             "continue",
             GREEN,
         )
 
+        self.last_check_time = time.time()
+
         # Print that we're ready for interaction
         print("Preview screen ready for interaction")
         sys.stdout.flush()
 
-        # Main loop
-        running = True
-        clock = pygame.time.Clock()
-        last_check_time = time.time()
-
-        while running:
-            current_time = time.time()
-
-            # Check for newer snapshot every 2 seconds
-            if current_time - last_check_time > 2:
-                newest_snapshot = find_latest_snapshot()
-                if newest_snapshot and newest_snapshot != image_path:
-                    print(f"Found newer snapshot: {newest_snapshot}")
-                    # Load the new image
-                    image_path = newest_snapshot
-                    image = pygame.image.load(image_path)
-                    img_width, img_height = image.get_size()
-
-                    # Scale to fit screen
-                    scale_factor = min(
-                        (SCREEN_WIDTH * 0.8) / img_width,
-                        (SCREEN_HEIGHT * 0.7) / img_height,
-                    )
-                    new_width = int(img_width * scale_factor)
-                    new_height = int(img_height * scale_factor)
-                    scaled_image = pygame.transform.scale(
-                        image, (new_width, new_height)
-                    )
-
-                last_check_time = current_time
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        return_result("try_again")
-
-                # Check button clicks
-                action = try_again_button.handle_event(event)
-                if action == "try_again":
-                    return_result("try_again")
-
-                action = continue_button.handle_event(event)
-                if action == "continue":
-                    return_result("continue")
-
-            # Draw background
-            screen.fill(BLACK)
-
-            # Draw title
-            title = font_large.render("Photo Preview", True, WHITE)
-            title_rect = title.get_rect(center=(SCREEN_WIDTH // 2, 40))
-            screen.blit(title, title_rect)
-
-            # Draw image
-            image_rect = scaled_image.get_rect(
-                center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50)
-            )
-            screen.blit(scaled_image, image_rect)
-
-            # Draw buttons
-            try_again_button.draw(screen)
-            continue_button.draw(screen)
-
-            # Draw instructions
-            instr_text = font_small.render(
-                "Review your photo and decide to keep it or try again", True, WHITE
-            )
-            instr_rect = instr_text.get_rect(
-                center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT - 160)
-            )
-            screen.blit(instr_text, instr_rect)
-
-            # Update display
-            pygame.display.flip()
-            clock.tick(30)
-
-        # If loop exits without a button click
-        return_result("try_again")
+    def load_image(self, image_path):
+        """Load an image and scale it to fit the screen
+
+        A snapshot's screen-sized preview rendition is decoded instead of
+        the full image when there is one.
+        """
+        preview_path = rendition_path(image_path, "preview")
+        if not os.path.exists(preview_path):
+            preview_path = image_path
+        self.scale_image(pygame.image.load(preview_path))
+        self.image_path = image_path
+
+    def load_frame(self, frame):
+        """Show a BGR array without decoding the JPEG again"""
+        height, width = frame.shape[:2]
+        self.scale_image(pygame.image.frombuffer(frame, (width, height), "BGR"))
+        self.frame = None
+
+    def scale_image(self, image):
+        width, height = self.host.screen.get_size()
+        img_width, img_height = image.get_size()
+
+        # Scale to fit screen
+        scale_factor = min((width * 0.8) / img_width, (height * 0.7) / img_height)
+        new_width = int(img_width * scale_factor)
+        new_height = int(img_height * scale_factor)
+        self.scaled_image = pygame.transform.scale(image, (new_width, new_height))
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            self.finish("try_again")
+            return
+
+        # Check button clicks
+        action = self.try_again_button.handle_event(event)
+        if action == "try_again":
+            self.finish("try_again")
+
+        action = self.continue_button.handle_event(event)
+        if action == "continue":
+            self.finish("continue")
+
+    def update(self, now):
+        # Check for newer snapshot every 2 seconds
+        if now - self.last_check_time > 2:
+            newest_snapshot = find_latest_snapshot(self.snapshots)
+            # One still being saved is newer than any on disk
+            saved = os.path.exists(self.image_path)
+            if saved and newest_snapshot and newest_snapshot != self.image_path:
+                print(f"Found newer snapshot: {newest_snapshot}")
+                self.load_image(newest_snapshot)
+            self.last_check_time = now
+
+    def draw(self, screen):
+        width, height = screen.get_size()
+
+        # Draw background
+        screen.fill(BLACK)
+
+        # Draw title
+        title = self.font_large.render("Photo Preview", True, WHITE)
+        title_rect = title.get_rect(center=(width // 2, 40))
+        screen.blit(title, title_rect)
+
+        # Draw image
+        image_rect = self.scaled_image.get_rect(center=(width // 2, height // 2 - 50))
+        screen.blit(self.scaled_image, image_rect)
+
+        # Draw buttons
+        self.try_again_button.draw(screen)
+        self.continue_button.draw(screen)
+
+        # Draw instructions
+        instr_text = self.font_small.render(
+            "Review your photo and decide to keep it or try again", True, WHITE
+        )
+        instr_rect = instr_text.get_rect(center=(width // 2, height - 160))
+        screen.blit(instr_text, instr_rect)
+
+
+def main():
+    # Parse arguments to get the image path
+    parser = argparse.ArgumentParser(description="Photo preview screen")
+    parser.add_argument(
+        "--image", type=str, required=True, help="Path to the image to preview"
+    )
+    args = parser.parse_args()
+
+    # Print a message at startup for debugging
+    print("Photo preview starting...")
+    sys.stdout.flush()
+
+    try:
+        image_path = choose_image(args.image)
+        if not image_path:
+            print("ERROR: No image found to preview")
+            sys.stdout.flush()
+            return 1
+
+        print(f"Using image: {image_path}")
+        sys.stdout.flush()
+
+        host = SceneHost(fullscreen=True, caption="Photo Preview")
+        scene = ReviewScene(image_path)
+        scene.on_shown = lambda at: metrics.observe("preview.startup", at - START_TIME)
+        result = host.run_scene(scene)
+
+        # Send result back to parent process; closing the window means retry
+        result = result or "try_again"
+        print(f"PREVIEW_RESULT:{result}")
+        sys.stdout.flush()
+        stage_ipc.send_event(stage_ipc.PREVIEW_RESULT, result=result)
 
     except Exception as e:
         print(f"ERROR: {str(e)}")
@@ -256,13 +268,8 @@ def main():
         sys.stdout.flush()
         return 1
 
-    finally:
-        pygame.quit()
-
     return 0
 
 
 if __name__ == "__main__":
-    import time  # Add time module import
-
     sys.exit(main())
@@ -36,11 +36,25 @@ fi
 # Verify required files exist
 required_files=(
     "main.py" 
+    "scene_host.py"
     "idle_screen.py" 
     "user_input_app.py" 
     "detection_app.py" 
     "photo_capture.py"  # Added photo_capture.py
     "photo_preview.py"
+    "zygote.py"
+    "stage_ipc.py"
+    "session_store.py"
+    "snapshot_index.py"
+    "camera_broker.py"
+    "frame_ring.py"
+    "metrics.py"
+    "detection_control.py"
+    "detection_batch.py"
+    "detection_log.py"
+    "cpu_detection.py"
+    "shot_scoring.py"
+    "snapshot_writer.py"
 )
 
 for file in "${required_files[@]}"; do
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import threading
+import time
+import pygame
+
+BLACK = (0, 0, 0)
+
+
+class Scene:
+    """Something drawn on the shared display (idle, countdown, review...)"""
+
+    def __init__(self, on_finish=None):
+        self.on_finish = on_finish
+        self.host = None
+        self.result = None
+        self.finished = False
+        self.reported = False
+        # Called once with time.monotonic() after the first frame is on screen
+        self.on_shown = None
+        self.shown = False
+        # Set when one of its methods raised; it is no longer drawn
+        self.failed = False
+
+    def enter(self, host):
+        """Called on the display thread when the scene becomes active"""
+        self.host = host
+
+    def exit(self):
+        """Called on the display thread when the scene is replaced"""
+        pass
+
+    def handle_event(self, event):
+        pass
+
+    def update(self, now):
+        pass
+
+    def draw(self, screen):
+        screen.fill(BLACK)
+
+    def finish(self, result=None):
+        """Mark the scene as done; the host reports the result once"""
+        if not self.finished:
+            self.finished = True
+            self.result = result
+
+
+class SceneHost:
+    """Owns the one pygame display and swaps scenes without re-opening it"""
+
+    def __init__(self, fullscreen=True, size=(1280, 720), caption="Photobooth", fps=30):
+        self.fullscreen = fullscreen
+        self.size = size
+        self.caption = caption
+        self.fps = fps
+        self.screen = None
+        self.scene = None
+        self.pending = None
+        self.has_pending = False
+        self.running = False
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.error = None  # why the display could not be opened
+        self.thread = None
+
+    def open_display(self):
+        """Initialize pygame and open the display once"""
+        pygame.init()
+        if self.fullscreen:
+            self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        else:
+            self.screen = pygame.display.set_mode(self.size)
+        pygame.display.set_caption(self.caption)
+
+    def start(self):
+        """Run the display loop on its own thread
+
+        Raises RuntimeError if the display cannot be opened.
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        if not self.ready.wait(timeout=10):
+            self.running = False
+            raise RuntimeError("Display did not open within 10 seconds")
+        if self.error:
+            raise RuntimeError(f"Could not open the display: {self.error}")
+
+    def show(self, scene):
+        """Queue a scene; it replaces the current one on the next frame"""
+        with self.lock:
+            self.pending = scene
+            self.has_pending = True
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+    def swap_scene(self):
+        """Switch to the pending scene, if any (display thread only)"""
+        with self.lock:
+            if not self.has_pending:
+                return
+            scene = self.pending
+            self.pending = None
+            self.has_pending = False
+
+        if self.scene:
+            try:
+                self.scene.exit()
+            except Exception as e:
+                print(f"Error leaving scene: {e}")
+        self.scene = scene
+        if scene:
+            try:
+                scene.enter(self)
+            except Exception as e:
+                print(f"Error entering scene {type(scene).__name__}: {e}")
+                scene.finish(None)
+
+    def call(self, scene, method, *args):
+        """Call a scene method; a scene that raises finishes with None"""
+        try:
+            method(*args)
+        except Exception as e:
+            print(f"Error in scene {type(scene).__name__}: {e}")
+            scene.failed = True
+            scene.finish(None)
+
+    def step(self, clock):
+        """Render one frame and report a finished scene"""
+        self.swap_scene()
+        scene = self.scene
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                if scene:
+                    scene.finish(None)
+            elif scene and not scene.failed:
+                self.call(scene, scene.handle_event, event)
+
+        if scene and not scene.failed:
+            if not scene.finished:
+                self.call(scene, scene.update, time.time())
+            self.call(scene, scene.draw, self.screen)
+        if not scene or scene.failed:
+            self.screen.fill(BLACK)
+
+        pygame.display.flip()
+        if scene and not scene.shown:
+            scene.shown = True
+            if scene.on_shown:
+                try:
+                    scene.on_shown(time.monotonic())
+                except Exception as e:
+                    print(f"Error in scene callback: {e}")
+        clock.tick(self.fps)
+
+        if scene and scene.finished and not scene.reported:
+            # The scene keeps drawing its last frame until the next one arrives
+            scene.reported = True
+            if scene.on_finish:
+                try:
+                    scene.on_finish(scene.result)
+                except Exception as e:
+                    print(f"Error in scene callback: {e}")
+            return scene
+        return None
+
+    def run(self):
+        """Display loop used when the host runs in the background"""
+        try:
+            self.open_display()
+        except Exception as e:
+            self.error = e
+            self.running = False
+            pygame.quit()
+            return
+        finally:
+            self.ready.set()
+
+        clock = pygame.time.Clock()
+        try:
+            while self.running:
+                try:
+                    self.step(clock)
+                except Exception as e:
+                    print(f"Error in display loop: {e}")
+                    clock.tick(self.fps)
+        finally:
+            if self.scene:
+                self.scene.exit()
+            pygame.quit()
+
+    def run_scene(self, scene):
+        """Run one scene in the calling thread and return its result
+
+        Used by the standalone entry points (idle_screen.py etc.).
+        """
+        self.open_display()
+        self.show(scene)
+        clock = pygame.time.Clock()
+        try:
+            while self.step(clock) is not scene:
+                pass
+            return scene.result
+        finally:
+            scene.exit()
+            pygame.quit()
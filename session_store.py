@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+import os
+import copy
+import glob
+import json
+import datetime
+
+DATA_DIR = "data"
+
+
+def new_session_data():
+    """Blank session record, as saved in session_*.json"""
+    return {
+        "story_id": None,
+        "users": {"names": [], "detected_props": [], "appearance": ""},
+        "timestamp": "",
+        "image_path": "",
+        "cache_image_path": "",
+        "renditions": {},
+    }
+
+
+def apply_changes(data, changes):
+    """Apply {"users.names": [...], "image_path": ...} style changes in place"""
+    for key, value in changes.items():
+        target = data
+        parts = key.split(".")
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+
+
+def write_file_atomic(path, data):
+    """Write bytes-like data so readers see either no file or all of it"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_json_atomic(path, data):
+    """Write JSON so readers see either the old file or the complete new one"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JsonFileCache:
+    """Parsed JSON files, re-read only when a file's mtime or size changes
+
+    Callers share the cached objects and must not modify them.
+    """
+
+    def __init__(self):
+        self.entries = {}  # path -> ((mtime_ns, size), data)
+
+    def load(self, path):
+        """Contents of path, or None if it does not exist"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.entries.pop(path, None)
+            return None
+
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self.entries.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        with open(path, "r") as f:
+            data = json.load(f)
+        self.entries[path] = (key, data)
+        return data
+
+
+class SessionStore:
+    """Authoritative session data, kept in memory with an append-only journal
+
+    Every change is applied to the in-memory record and appended as one JSON
+    line to data/session_<id>.journal. When the session ends the record is
+    compacted into data/session_<timestamp>.json and the journal removed.
+    If the booth stops mid-session, recover() replays leftover journals.
+    """
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.session_id = None
+        self.data = new_session_data()
+        self.journal = None
+        os.makedirs(self.data_dir, exist_ok=True)
+
+    def journal_path(self, session_id):
+        return os.path.join(self.data_dir, f"session_{session_id}.journal")
+
+    def begin(self, session_id):
+        """Start a new session, dropping any unfinished one"""
+        self.discard()
+        self.session_id = session_id
+        self.data = new_session_data()
+
+    def get(self, key, default=None):
+        """Read a value by dotted key, e.g. "users.detected_props" """
+        value = self.data
+        for part in key.split("."):
+            if not isinstance(value, dict) or part not in value:
+                return default
+            value = value[part]
+        return value
+
+    def snapshot(self):
+        """Deep copy of the current record"""
+        return copy.deepcopy(self.data)
+
+    def update(self, changes):
+        """Apply changes and journal them; unchanged values are skipped"""
+        changes = {k: v for k, v in changes.items() if self.get(k) != v}
+        if not changes:
+            return False
+
+        apply_changes(self.data, changes)
+        if self.session_id:
+            self.append_journal({"set": changes})
+        return True
+
+    def append_journal(self, record):
+        """Append one record and make it durable"""
+        try:
+            if self.journal is None:
+                self.journal = open(self.journal_path(self.session_id), "a")
+            self.journal.write(json.dumps(record) + "\n")
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        except Exception as e:
+            print(f"Error writing session journal: {e}")
+
+    def close_journal(self):
+        if self.journal:
+            try:
+                self.journal.close()
+            except Exception:
+                pass
+            self.journal = None
+
+    def discard(self):
+        """Drop the current session's journal without saving it"""
+        self.close_journal()
+        if self.session_id:
+            try:
+                os.remove(self.journal_path(self.session_id))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Error removing session journal: {e}")
+
+    def compact(self):
+        """Write the final session_*.json and remove the journal"""
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.data["timestamp"] = timestamp
+        filename = os.path.join(self.data_dir, f"session_{timestamp}.json")
+
+        write_json_atomic(filename, self.data)
+        self.discard()
+        self.session_id = None
+        return filename
+
+    @classmethod
+    def replay(cls, journal_path):
+        """Rebuild a session record from its journal"""
+        data = new_session_data()
+        with open(journal_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    break
+                apply_changes(data, record.get("set", {}))
+        return data
+
+    def recover(self):
+        """Compact journals left behind by an unclean shutdown"""
+        recovered = []
+        for journal_path in sorted(
+            glob.glob(os.path.join(self.data_dir, "session_*.journal"))
+        ):
+            if self.session_id and journal_path == self.journal_path(self.session_id):
+                continue
+            try:
+                data = self.replay(journal_path)
+                name = os.path.basename(journal_path)
+                session_id = name[len("session_") : -len(".journal")]
+                data["timestamp"] = session_id
+                filename = os.path.join(self.data_dir, f"session_{session_id}.json")
+                write_json_atomic(filename, data)
+                os.remove(journal_path)
+                recovered.append(filename)
+                print(f"Recovered session journal into {filename}")
+            except Exception as e:
+                print(f"Error recovering {journal_path}: {e}")
+        return recovered
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+SNAPSHOT_DIR = "snapshots"
+# Smaller copies of each snapshot, one directory per rendition
+RENDITION_DIR = "renditions"
+
+# inotify constants from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CLOSE_WRITE = 0x00000008
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+WATCH_MASK |= IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def snapshot_name(timestamp, session_id=None):
+    """File name for a snapshot; the session id is appended when known"""
+    if session_id:
+        return f"snapshot_{timestamp}_{session_id}.jpg"
+    return f"snapshot_{timestamp}.jpg"
+
+
+def rendition_path(snapshot_path, name, directory=RENDITION_DIR):
+    """Where the rendition called name of a snapshot is saved"""
+    return os.path.join(directory, name, os.path.basename(snapshot_path))
+
+
+def parse_session_id(name):
+    """Session id from snapshot_<YYYYmmdd_HHMMSS>_<session>.jpg, or None"""
+    stem = name[len("snapshot_") : -len(".jpg")]
+    parts = stem.split("_", 2)
+    return parts[2] if len(parts) == 3 and parts[2] else None
+
+
+def open_inotify(directory):
+    """Return an inotify fd watching directory, or None if unavailable"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, "inotify_add_watch failed")
+        return fd
+    except (OSError, AttributeError) as e:
+        print(f"inotify unavailable for {directory}, polling instead: {e}")
+        return None
+
+
+class SnapshotIndex:
+    """Index of snapshots/ that answers "latest" and "for session" in O(1)
+
+    Kept current by inotify events; where inotify is unavailable the
+    directory mtime is checked and the directory rescanned only when it
+    changed. Events are drained lazily when the index is queried, so no
+    extra thread is needed.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR, use_inotify=True):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.names = set()
+        self.sessions = {}  # session id -> list of paths, oldest first
+        self.latest_name = None
+        self.dir_mtime = None
+        self.inotify_fd = None
+
+        os.makedirs(directory, exist_ok=True)
+        if use_inotify:
+            self.inotify_fd = open_inotify(directory)
+        self.scan()
+
+    @staticmethod
+    def is_snapshot(name):
+        return name.startswith("snapshot_") and name.endswith(".jpg")
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def scan(self):
+        """Rebuild the index from a directory listing"""
+        with self.lock:
+            self.dir_mtime = self._dir_mtime()
+            self.names = set()
+            self.sessions = {}
+            self.latest_name = None
+            try:
+                with os.scandir(self.directory) as entries:
+                    for entry in entries:
+                        if self.is_snapshot(entry.name):
+                            self._add(entry.name)
+            except FileNotFoundError:
+                pass
+            for paths in self.sessions.values():
+                paths.sort()
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _add(self, name):
+        if name in self.names:
+            return
+        self.names.add(name)
+        session_id = parse_session_id(name)
+        if session_id:
+            self.sessions.setdefault(session_id, []).append(self.path(name))
+        # Names start with the capture timestamp, so name order is time order
+        if self.latest_name is None or name > self.latest_name:
+            self.latest_name = name
+
+    def _remove(self, name):
+        if name not in self.names:
+            return
+        self.names.discard(name)
+        session_id = parse_session_id(name)
+        paths = self.sessions.get(session_id)
+        if paths:
+            try:
+                paths.remove(self.path(name))
+            except ValueError:
+                pass
+            if not paths:
+                del self.sessions[session_id]
+        if name == self.latest_name:
+            # Only deleting the newest file needs a pass over the names
+            self.latest_name = max(self.names) if self.names else None
+
+    def refresh(self):
+        """Apply pending changes from inotify, or poll the directory"""
+        # The loop and display threads both refresh; the fd is only read or
+        # closed under the lock, so neither reads one the other closed
+        with self.lock:
+            if self.inotify_fd is not None:
+                rescan = self._drain_inotify()
+            else:
+                rescan = self._dir_mtime() != self.dir_mtime
+        if rescan:
+            self.scan()
+
+    def _drain_inotify(self):
+        """Apply queued events (lock held); returns whether to rescan"""
+        rescan = False
+        while True:
+            try:
+                data = os.read(self.inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not data:
+                break
+
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                name = os.fsdecode(name)
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    # Directory replaced; fall back to polling
+                    os.close(self.inotify_fd)
+                    self.inotify_fd = None
+                    rescan = True
+                    break
+                elif not self.is_snapshot(name):
+                    continue
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self._add(name)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._remove(name)
+
+            if self.inotify_fd is None:
+                break
+        return rescan
+
+    def latest(self):
+        """Path of the newest snapshot, or None"""
+        self.refresh()
+        with self.lock:
+            return self.path(self.latest_name) if self.latest_name else None
+
+    def for_session(self, session_id):
+        """Paths of a session's snapshots, oldest first"""
+        self.refresh()
+        with self.lock:
+            return list(self.sessions.get(session_id, []))
+
+    def close(self):
+        with self.lock:
+            if self.inotify_fd is not None:
+                os.close(self.inotify_fd)
+                self.inotify_fd = None
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import metrics
+from session_store import write_file_atomic
+from snapshot_index import rendition_path
+
+JPEG_QUALITY = 95
+
+# Smaller copies saved with every snapshot: name -> ((width, height) the
+# frame is scaled down to fit in, JPEG quality). PHOTOBOOTH_RENDITIONS picks
+# which are made and can resize them, e.g. "preview=1920x1080,thumbnail";
+# set it empty for none. Names not listed here need a size.
+RENDITIONS = {
+    "print": ((1800, 1200), 95),  # 6x4 inches at 300 dpi
+    "share": ((1600, 900), 85),
+    "preview": ((1280, 720), 85),  # the review screen
+    "cache": ((640, 360), 85),
+    "thumbnail": ((320, 180), 80),
+}
+RENDITIONS_ENV = "PHOTOBOOTH_RENDITIONS"
+WRITER_WORKERS = int(os.environ.get("PHOTOBOOTH_WRITER_WORKERS", "2"))
+
+
+def parse_renditions(spec):
+    """The rendition table for a PHOTOBOOTH_RENDITIONS value; None for all"""
+    if spec is None:
+        return dict(RENDITIONS)
+    renditions = {}
+    for item in spec.split(","):
+        name, _, size = item.strip().partition("=")
+        if not name:
+            continue
+        box, quality = RENDITIONS.get(name, (None, 85))
+        if size:
+            width, height = size.lower().split("x")
+            box = (int(width), int(height))
+        if box is None:
+            raise ValueError(f"Rendition {name} needs a size, e.g. {name}=800x600")
+        renditions[name] = (box, quality)
+    return renditions
+
+
+def fit_scale(width, height, box):
+    """Scale that fits width x height in box; images are never enlarged"""
+    return min(box[0] / width, box[1] / height, 1.0)
+
+
+def encode_jpeg(path, image, quality):
+    ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise OSError(f"Could not encode {path}")
+    write_file_atomic(path, jpeg)
+
+
+def write_snapshot(shm_name, shape, dtype, path, quality, renditions):
+    """Save a frame from shared memory with its renditions, in a worker
+
+    renditions is a list of (path, box, quality). They are made largest
+    first, each scaled down from the one before, so only the first reads
+    the full frame. The snapshot itself is written last: its file appearing
+    is what readers wait for. Returns the seconds the renditions took.
+    """
+    # Workers share this writer's resource tracker, which already has the
+    # segment; unregistering it here, as open_shared_memory does, would
+    # take it off before the writer unlinks it
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        start = time.monotonic()
+        height, width = shape[:2]
+        renditions = sorted(
+            renditions, key=lambda item: -fit_scale(width, height, item[1])
+        )
+        image = frame
+        for rendition, box, rendition_quality in renditions:
+            scale = fit_scale(width, height, box)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            if size != image.shape[1::-1]:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            encode_jpeg(rendition, image, rendition_quality)
+        seconds = time.monotonic() - start
+
+        encode_jpeg(path, frame, quality)
+        del frame, image
+        return seconds
+    finally:
+        shm.close()
+
+
+def start_worker():
+    """Runs first in every worker; importing this module loaded cv2"""
+    return os.getpid()
+
+
+class SnapshotWriter:
+    """Saves snapshots and their renditions on a small process pool
+
+    Capture hands over the frame and moves on. It is copied once into
+    shared memory, and a worker process makes every rendition from it and
+    encodes them and the snapshot, so nothing decodes the JPEG again.
+    Files are written under a temporary name, fsynced and renamed into
+    place, so the snapshot index never sees half a file. The workers are
+    forked from a server that has only this module loaded, not main.py.
+    """
+
+    def __init__(self, workers=WRITER_WORKERS, quality=JPEG_QUALITY, renditions=None):
+        self.workers = max(1, workers)
+        self.quality = quality
+        if renditions is None:
+            renditions = parse_renditions(os.environ.get(RENDITIONS_ENV))
+        self.renditions = renditions
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes, so the first snapshot does not wait
+
+        Returns the pool.
+        """
+        with self.lock:
+            if self.pool is None:
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=context)
+                for _ in range(self.workers):
+                    self.pool.submit(start_worker)
+            return self.pool
+
+    def submit(self, *args):
+        """Submit a job, replacing the pool if a worker died, e.g. OOM killed"""
+        pool = self.start()
+        try:
+            return pool.submit(*args)
+        except BrokenProcessPool:
+            print("Snapshot worker died, restarting the snapshot writer")
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = None
+            pool.shutdown(wait=False)
+            return self.start().submit(*args)
+
+    def save(self, path, frame, on_saved=None, valid=None):
+        """Save a BGR frame and its renditions
+
+        Returns a Future of (path, {rendition name: path}). The frame is
+        copied before this returns. on_saved(path, renditions) runs in this
+        process once every file is in place, before the Future is done.
+        For a view into a frame ring, valid() is asked after the copy; if
+        the frame was overwritten nothing is saved and None is returned.
+        """
+        start = time.monotonic()
+        paths = {name: rendition_path(path, name) for name in self.renditions}
+        renditions = []
+        for name, (box, quality) in self.renditions.items():
+            os.makedirs(os.path.dirname(paths[name]), exist_ok=True)
+            renditions.append((os.path.abspath(paths[name]), box, quality))
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, frame.nbytes))
+        try:
+            np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)[:] = frame
+            if valid is not None and not valid():
+                shm.close()
+                shm.unlink()
+                return None
+            job = self.submit(
+                write_snapshot,
+                shm.name,
+                frame.shape,
+                frame.dtype.str,
+                os.path.abspath(path),
+                self.quality,
+                renditions,
+            )
+        except BaseException:
+            # done() below never runs, so the segment is freed here
+            shm.close()
+            shm.unlink()
+            raise
+
+        saved = Future()
+
+        def done(job):
+            shm.close()
+            shm.unlink()
+            try:
+                metrics.observe("capture.renditions", job.result())
+                metrics.observe("capture.persist", time.monotonic() - start)
+                if on_saved:
+                    on_saved(path, paths)
+            except Exception as e:
+                saved.set_exception(e)
+                return
+            saved.set_result((path, paths))
+
+        job.add_done_callback(done)
+        return saved
+
+    def close(self):
+        """Wait for snapshots being saved and stop the workers"""
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool:
+            pool.shutdown(wait=True)
+
+
+# Shared by every capture, so saving outlives the PhotoCapture that took it
+WRITER = SnapshotWriter()
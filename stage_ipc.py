@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+import os
+import json
+import struct
+import asyncio
+import threading
+
+# Stage processes find their end of the control channel through this variable.
+# stdout/stderr stay plain logs; results only travel over the channel.
+IPC_FD_ENV = "PHOTOBOOTH_IPC_FD"
+
+# Every frame is a 4-byte big-endian length followed by a UTF-8 JSON object
+# with a "type" key.
+HEADER = struct.Struct("!I")
+MAX_MESSAGE_SIZE = 1 << 20
+
+# Message types understood by main.py
+SNAPSHOT_READY = "snapshot_ready"  # path
+CACHE_READY = "cache_ready"  # path
+PREVIEW_RESULT = "preview_result"  # result: "continue" | "try_again"
+USER_DATA = "user_data"  # user_data: dict from the user input screen
+DETECTIONS = "detections"  # detections: list, detected_props: list
+METRICS = "metrics"  # name, seconds (a latency) or count, measured in the stage
+
+MESSAGE_TYPES = {
+    SNAPSHOT_READY,
+    CACHE_READY,
+    PREVIEW_RESULT,
+    USER_DATA,
+    DETECTIONS,
+    METRICS,
+}
+
+
+def encode_message(message_type, **payload):
+    """Frame one message"""
+    if message_type not in MESSAGE_TYPES:
+        raise ValueError(f"Unknown message type: {message_type}")
+    body = json.dumps(dict(payload, type=message_type)).encode("utf-8")
+    if len(body) > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Message too large: {len(body)} bytes")
+    return HEADER.pack(len(body)) + body
+
+
+class StageChannel:
+    """Write end of the control channel, used inside a stage process"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Open the channel passed by main.py, or None when run standalone"""
+        fd = os.environ.get(IPC_FD_ENV)
+        if not fd:
+            return None
+        try:
+            fd = int(fd)
+            os.fstat(fd)
+        except (ValueError, OSError) as e:
+            print(f"Ignoring invalid {IPC_FD_ENV}={fd}: {e}")
+            return None
+        return cls(fd)
+
+    def send(self, message_type, **payload):
+        """Send one message; frames from several threads never interleave"""
+        data = encode_message(message_type, **payload)
+        with self.lock:
+            if self.fd is None:
+                return False
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.write(self.fd, view)
+                    view = view[written:]
+                return True
+            except OSError as e:
+                print(f"Control channel closed: {e}")
+                self.fd = None
+                return False
+
+
+_channel = None
+_channel_opened = False
+
+
+def send_event(message_type, **payload):
+    """Send a message to main.py if this stage was started with a channel"""
+    global _channel, _channel_opened
+    if not _channel_opened:
+        _channel = StageChannel.from_env()
+        _channel_opened = True
+    if _channel is None:
+        return False
+    return _channel.send(message_type, **payload)
+
+
+def create_channel():
+    """Create a channel for a new stage; returns (read_fd, write_fd)
+
+    The write end is inheritable so it survives into the stage process.
+    """
+    read_fd, write_fd = os.pipe()
+    os.set_inheritable(write_fd, True)
+    return read_fd, write_fd
+
+
+async def open_pipe_reader(fd):
+    """Wrap the read end of a pipe in an asyncio StreamReader"""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    protocol = asyncio.StreamReaderProtocol(reader)
+    await loop.connect_read_pipe(lambda: protocol, os.fdopen(fd, "rb", 0))
+    return reader
+
+
+async def read_messages(reader):
+    """Yield decoded messages until the stage closes its end"""
+    while True:
+        try:
+            header = await reader.readexactly(HEADER.size)
+        except asyncio.IncompleteReadError:
+            return
+
+        (length,) = HEADER.unpack(header)
+        if length > MAX_MESSAGE_SIZE:
+            print(f"Control channel frame too large ({length} bytes), closing")
+            return
+
+        try:
+            body = await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return
+
+        try:
+            message = json.loads(body.decode("utf-8"))
+        except ValueError as e:
+            print(f"Dropping malformed control message: {e}")
+            continue
+
+        if message.get("type") not in MESSAGE_TYPES:
+            print(f"Dropping unknown control message: {message.get('type')}")
+            continue
+        yield message
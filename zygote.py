@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+import os
+import sys
+import asyncio
+import json
+import time
+import errno
+import select
+import signal
+import socket
+import struct
+import runpy
+import pkgutil  # noqa: F401  (runpy.run_path imports it lazily in every child)
+import argparse
+import importlib
+import subprocess
+import traceback
+
+from stage_ipc import open_pipe_reader
+
+# Modules every stage script pays for at startup. Importing them here once
+# means a forked stage starts with them already in sys.modules.
+PRELOAD_MODULES = ["numpy", "cv2", "pygame", "gi", "picamera2"]
+
+DEFAULT_SOCKET_PATH = f"/tmp/photobooth_zygote_{os.getuid()}.sock"
+
+# Length prefix used for spawn requests (network byte order, unsigned int)
+HEADER = struct.Struct("!I")
+
+# stdout, stderr and a few extra fds (e.g. the stage control channel)
+MAX_FDS = 8
+
+
+def preload_modules(modules=PRELOAD_MODULES):
+    """Import the heavy stage dependencies, skipping any that are missing"""
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as e:
+            print(f"Zygote: could not preload {name}: {e}")
+
+    # GStreamer bindings are only useful once the typelib is loaded too
+    if "gi" in loaded:
+        try:
+            import gi
+
+            gi.require_version("Gst", "1.0")
+            from gi.repository import Gst  # noqa: F401
+        except Exception as e:
+            print(f"Zygote: could not preload Gst: {e}")
+
+    return loaded
+
+
+def recv_exact(conn, size):
+    """Read exactly size bytes from a socket"""
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed while reading")
+        data += chunk
+    return data
+
+
+def exit_code_from_status(status):
+    """Convert a waitpid status into a Popen-style return code"""
+    try:
+        return os.waitstatus_to_exitcode(status)
+    except ValueError:
+        return -1
+
+
+class ZygoteServer:
+    """Preloaded parent process that forks one child per stage request"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.children = {}  # pid -> connection waiting for the exit status
+        self.parent_pid = os.getppid()
+        self.server = None
+        self.wake_r, self.wake_w = os.pipe()
+
+    def serve_forever(self):
+        """Accept spawn requests until the orchestrator goes away"""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen(8)
+
+        # SIGCHLD wakes select() so exits are reported without polling delay
+        os.set_blocking(self.wake_w, False)
+        signal.set_wakeup_fd(self.wake_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        print(f"Zygote ready on {self.socket_path}")
+        sys.stdout.flush()
+
+        try:
+            while True:
+                # Exit with the orchestrator instead of lingering as an orphan
+                if os.getppid() != self.parent_pid:
+                    print("Zygote: parent exited, shutting down")
+                    break
+
+                try:
+                    readable, _, _ = select.select(
+                        [self.server, self.wake_r], [], [], 1.0
+                    )
+                except InterruptedError:
+                    readable = []
+
+                if self.wake_r in readable:
+                    try:
+                        os.read(self.wake_r, 512)
+                    except BlockingIOError:
+                        pass
+
+                self.reap_children()
+
+                if self.server in readable:
+                    conn, _ = self.server.accept()
+                    self.handle_request(conn)
+        finally:
+            self.shutdown()
+
+    def handle_request(self, conn):
+        """Read one spawn request and fork the stage"""
+        try:
+            header, fds, _, _ = socket.recv_fds(conn, HEADER.size, MAX_FDS)
+            if not header:
+                # Readiness probe from ZygoteClient.start
+                conn.close()
+                return
+            if len(header) < HEADER.size:
+                header += recv_exact(conn, HEADER.size - len(header))
+            (length,) = HEADER.unpack(header)
+            request = json.loads(recv_exact(conn, length).decode("utf-8"))
+        except Exception as e:
+            print(f"Zygote: bad spawn request: {e}")
+            conn.close()
+            return
+
+        if len(fds) != 2 + len(request.get("fd_env", [])):
+            print("Zygote: spawn request has the wrong number of fds")
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self.run_child(conn, request, fds)
+            # run_child never returns
+
+        for fd in fds:
+            os.close(fd)
+
+        self.children[pid] = conn
+        self.send_status(conn, {"pid": pid})
+
+    def run_child(self, conn, request, fds):
+        """Become the stage process (runs in the forked child)"""
+        code = 1
+        try:
+            # Drop everything that belongs to the server
+            signal.set_wakeup_fd(-1)
+            for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            conn.close()
+            self.server.close()
+            for pid, child_conn in self.children.items():
+                child_conn.close()
+            os.close(self.wake_r)
+            os.close(self.wake_w)
+
+            # Wire stdout/stderr to the pipes main.py reads
+            os.dup2(fds[0], 1)
+            os.dup2(fds[1], 2)
+            for fd in fds[:2]:
+                os.close(fd)
+
+            os.chdir(request.get("cwd") or os.getcwd())
+            env = request.get("env")
+            if env is not None:
+                os.environ.clear()
+                os.environ.update(env)
+
+            # Extra fds arrive under new numbers; tell the stage where they are
+            for name, fd in zip(request.get("fd_env", []), fds[2:]):
+                os.environ[name] = str(fd)
+
+            script = request["argv"][0]
+            sys.argv = list(request["argv"])
+            sys.path[0] = os.path.dirname(os.path.abspath(script))
+
+            code = 0
+            runpy.run_path(script, run_name="__main__")
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except Exception:
+                pass
+            os._exit(code)
+
+    def reap_children(self):
+        """Collect exited children and report their status"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+
+            conn = self.children.pop(pid, None)
+            if conn:
+                self.send_status(conn, {"exit": exit_code_from_status(status)})
+                conn.close()
+
+    def send_status(self, conn, message):
+        """Send a status line back to the client, ignoring closed sockets"""
+        try:
+            conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        except OSError:
+            pass
+
+    def shutdown(self):
+        """Terminate remaining children and remove the socket"""
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if self.server:
+            self.server.close()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+
+class ZygoteProcess:
+    """Popen-like handle for a stage forked by the zygote"""
+
+    def __init__(self, args, conn, stdout, stderr):
+        self.args = args
+        self.conn = conn
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.buffer = b""
+
+        status = self._read_status(None)
+        if "pid" not in status:
+            raise RuntimeError(f"Zygote did not start {args}: {status}")
+        self.pid = status["pid"]
+
+    def _read_status(self, timeout):
+        """Read the next status line from the zygote"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b"\n" not in self.buffer:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.conn], [], [], remaining)
+            if not readable:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            chunk = self.conn.recv(4096)
+            if not chunk:
+                # Zygote went away; we can no longer learn the real status
+                return {"exit": -1}
+            self.buffer += chunk
+
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return json.loads(line.decode("utf-8"))
+
+    def poll(self):
+        """Return the exit code if the process has finished, else None"""
+        if self.returncode is None:
+            try:
+                self.wait(timeout=0)
+            except subprocess.TimeoutExpired:
+                pass
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """Wait for the process to exit and return its exit code"""
+        if self.returncode is None:
+            status = self._read_status(timeout)
+            self.returncode = status.get("exit", -1)
+            self.conn.close()
+        return self.returncode
+
+    def send_signal(self, signum):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class AsyncZygoteProcess:
+    """asyncio.subprocess.Process-like handle for a stage forked by the zygote"""
+
+    def __init__(self, args, status_reader, status_writer, stdout, stderr):
+        self.args = args
+        self.status_reader = status_reader
+        self.status_writer = status_writer
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.pid = None
+        self.exit_waiter = None
+
+    @classmethod
+    async def create(cls, args, conn, out_r, err_r):
+        status_reader, status_writer = await asyncio.open_unix_connection(sock=conn)
+        process = cls(args, status_reader, status_writer, None, None)
+
+        status = await process._read_status()
+        if "pid" not in status:
+            status_writer.close()
+            raise RuntimeError(f"Zygote did not start {args}: {status}")
+        process.pid = status["pid"]
+
+        # Taken over last, so the caller still owns the pipes if this fails
+        process.stdout = await open_pipe_reader(out_r)
+        process.stderr = await open_pipe_reader(err_r)
+        return process
+
+    async def _read_status(self):
+        line = await self.status_reader.readline()
+        if not line:
+            # Zygote went away; we can no longer learn the real status
+            return {"exit": -1}
+        return json.loads(line.decode("utf-8"))
+
+    async def _wait_for_exit(self):
+        status = await self._read_status()
+        self.returncode = status.get("exit", -1)
+        self.status_writer.close()
+        return self.returncode
+
+    async def wait(self):
+        """Wait for the process to exit and return its exit code"""
+        if self.returncode is not None:
+            return self.returncode
+        # Several tasks may wait on the same process; read the status once
+        if self.exit_waiter is None:
+            self.exit_waiter = asyncio.ensure_future(self._wait_for_exit())
+        return await asyncio.shield(self.exit_waiter)
+
+    def send_signal(self, signum):
+        if self.returncode is None and self.pid:
+            try:
+                os.kill(self.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class ZygoteClient:
+    """Starts the zygote and asks it to fork stage processes"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+        self.process = None
+
+    def start(self, timeout=30):
+        """Launch the zygote and wait until it accepts connections"""
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zygote.py")
+        self.process = subprocess.Popen(
+            ["python3", script, "--socket", self.socket_path],
+            stdin=subprocess.DEVNULL,
+        )
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Zygote exited during startup")
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(self.socket_path)
+                return True
+            except OSError:
+                time.sleep(0.05)
+
+        self.close()
+        raise RuntimeError("Timed out waiting for zygote")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def send_request(self, cmd, env=None, fd_env=None):
+        """Ask the zygote to fork cmd; returns (conn, stdout_fd, stderr_fd)
+
+        fd_env maps environment variable names to extra fds to hand over,
+        e.g. {"PHOTOBOOTH_IPC_FD": write_fd}.
+        """
+        fd_env = fd_env or {}
+        if not self.alive():
+            raise RuntimeError("Zygote is not running")
+
+        # cmd is ["python3", "script.py", ...]; the interpreter is already running
+        argv = list(cmd[1:])
+        if not argv or not os.path.exists(argv[0]):
+            raise FileNotFoundError(errno.ENOENT, "Stage script not found", argv[:1])
+
+        request = json.dumps(
+            {
+                "argv": argv,
+                "cwd": os.getcwd(),
+                "env": dict(os.environ if env is None else env),
+                "fd_env": list(fd_env),
+            }
+        ).encode("utf-8")
+
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+            socket.send_fds(
+                conn, [HEADER.pack(len(request))], [out_w, err_w, *fd_env.values()]
+            )
+            conn.sendall(request)
+        except Exception:
+            conn.close()
+            for fd in (out_r, err_r):
+                os.close(fd)
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+
+        return conn, out_r, err_r
+
+    def spawn(self, cmd, env=None, fd_env=None):
+        """Fork a stage; cmd is the same list that would be passed to Popen"""
+        conn, out_r, err_r = self.send_request(cmd, env, fd_env)
+        stdout = open(out_r, "r")
+        stderr = open(err_r, "r")
+        try:
+            return ZygoteProcess(cmd, conn, stdout, stderr)
+        except Exception:
+            stdout.close()
+            stderr.close()
+            conn.close()
+            raise
+
+    async def spawn_async(self, cmd, env=None, fd_env=None):
+        """Fork a stage and return an asyncio.subprocess.Process-like handle"""
+        conn, out_r, err_r = self.send_request(cmd, env, fd_env)
+        try:
+            return await AsyncZygoteProcess.create(cmd, conn, out_r, err_r)
+        except Exception:
+            conn.close()
+            for fd in (out_r, err_r):
+                os.close(fd)
+            raise
+
+    def close(self):
+        """Stop the zygote"""
+        if self.alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait(timeout=1)
+        self.process = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Photobooth stage fork server")
+    parser.add_argument(
+        "--socket", type=str, default=DEFAULT_SOCKET_PATH, help="Unix socket path"
+    )
+    args = parser.parse_args()
+
+    start = time.time()
+    loaded = preload_modules()
+    print(f"Zygote preloaded {loaded} in {time.time() - start:.2f}s")
+
+    ZygoteServer(args.socket).serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())